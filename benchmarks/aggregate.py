@@ -0,0 +1,92 @@
+"""
+Compare the cost of fanning in many Deferreds with a DeferredList, as
+txyam.utils.deferredDict used to, against txyam.utils.deferredDict and
+txyam.utils.aggregate.
+
+Run from the top of the repository with:
+
+    PYTHONPATH=. python benchmarks/aggregate.py
+"""
+
+from __future__ import print_function
+
+import timeit
+import tracemalloc
+
+from twisted.internet import defer
+
+from txyam.utils import aggregate, deferredDict
+
+
+def deferredListDict(d):
+    """
+    deferredDict as it was built on DeferredList.
+    """
+    def handle(results, names):
+        rvalue = {}
+        for key, (succeeded, value) in zip(names, results):
+            if succeeded:
+                rvalue[key] = value
+        return rvalue
+
+    dl = defer.DeferredList(list(d.values()), consumeErrors=True)
+    return dl.addCallback(handle, list(d.keys()))
+
+
+def deferredList(ds):
+    return defer.DeferredList(ds, consumeErrors=True)
+
+
+# Every FAILURE_EVERY-th deferred fails, so that the failure handling of each
+# fan-in is measured too.
+FAILURE_EVERY = 10
+
+CASES = [
+    ('DeferredList dict', deferredListDict, dict),
+    ('deferredDict', deferredDict, dict),
+    ('DeferredList', deferredList, list),
+    ('aggregate', aggregate, list),
+]
+
+
+def fanIn(fanInFunction, container, size):
+    ds = [defer.Deferred() for i in range(size)]
+    if container is dict:
+        result = fanInFunction(dict(enumerate(ds)))
+    else:
+        result = fanInFunction(ds)
+    for i, d in enumerate(ds):
+        if i % FAILURE_EVERY:
+            d.callback(i)
+        else:
+            d.errback(ValueError(i))
+    return result
+
+
+def allocations(fanInFunction, container, size):
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    result = fanIn(fanInFunction, container, size)
+    after = tracemalloc.take_snapshot()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    del result
+    stats = after.compare_to(before, 'filename')
+    return sum(stat.count_diff for stat in stats), peak
+
+
+def main():
+    print('%8s %-18s %12s %12s %12s' % (
+        'size', 'fan-in', 'usec/batch', 'blocks', 'peak bytes'))
+    for size in (10, 100, 1000, 10000):
+        number = max(1, 20000 // size)
+        for name, function, container in CASES:
+            elapsed = timeit.timeit(
+                lambda: fanIn(function, container, size), number=number)
+            blocks, peak = allocations(function, container, size)
+            print('%8d %-18s %12.1f %12d %12d' % (
+                size, name, elapsed / number * 1e6, blocks, peak))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+Compare the memory allocated for outstanding commands by the protocol from
+txyam.factory built on Twisted's MemCacheProtocol against the one built on
+txyam.protocol, with and without command reuse.
+
+Run from the top of the repository with:
+
+    PYTHONPATH=. python benchmarks/protocol.py
+"""
+
+from __future__ import print_function
+
+import gc
+import timeit
+import tracemalloc
+
+from twisted.internet.task import Clock
+from twisted.test.proto_helpers import StringTransport
+
+from txyam.factory import (
+    ConnectingMemCacheProtocol, SlottedConnectingMemCacheProtocol)
+
+
+PROTOCOLS = [
+    ('twisted', ConnectingMemCacheProtocol, {}),
+    ('slotted', SlottedConnectingMemCacheProtocol,
+     {'reuseCommands': False}),
+    ('slotted+reuse', SlottedConnectingMemCacheProtocol, {}),
+]
+
+
+def connect(protocolClass, kw):
+    proto = protocolClass(None, Clock(), **kw)
+    proto.makeConnection(StringTransport())
+    return proto
+
+
+def roundTrip(proto, depth):
+    """
+    Send C{depth} gets and C{depth} sets, then answer them all.
+    """
+    for i in range(depth):
+        proto.get(b'key')
+        proto.set(b'key', b'value')
+    proto.transport.clear()
+    proto.dataReceived(
+        b'VALUE key 0 5\r\nvalue\r\nEND\r\nSTORED\r\n' * depth)
+
+
+def pendingBytes(protocolClass, kw, depth):
+    """
+    The bytes and blocks held while C{depth} gets and C{depth} sets are
+    waiting for their responses.
+    """
+    proto = connect(protocolClass, kw)
+    # Fill the record pool, if there is one.
+    roundTrip(proto, depth)
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for i in range(depth):
+        proto.get(b'key')
+        proto.set(b'key', b'value')
+    proto.transport.clear()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    stats = after.compare_to(before, 'filename')
+    return (sum(stat.size_diff for stat in stats),
+            sum(stat.count_diff for stat in stats))
+
+
+def collections(protocolClass, kw, depth, rounds):
+    """
+    The number of young generation garbage collections triggered by
+    C{rounds} round trips.
+    """
+    proto = connect(protocolClass, kw)
+    gc.collect()
+    before = gc.get_stats()[0]['collections']
+    for i in range(rounds):
+        roundTrip(proto, depth)
+    return gc.get_stats()[0]['collections'] - before
+
+
+def main():
+    print('%6s %-14s %12s %12s %12s %12s' % (
+        'depth', 'protocol', 'usec/cmd', 'bytes/cmd', 'blocks/cmd',
+        'gen0 GCs'))
+    for depth in (1, 10, 100, 1000):
+        rounds = max(1, 20000 // depth)
+        commands = 2 * depth
+        for name, protocolClass, kw in PROTOCOLS:
+            proto = connect(protocolClass, kw)
+            elapsed = timeit.timeit(
+                lambda: roundTrip(proto, depth), number=rounds)
+            size, blocks = pendingBytes(protocolClass, kw, depth)
+            print('%6d %-14s %12.2f %12.1f %12.2f %12d' % (
+                depth, name, elapsed / rounds / commands * 1e6,
+                size / float(commands), blocks / float(commands),
+                collections(protocolClass, kw, depth, rounds)))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,21 @@
+from binascii import hexlify
 from collections import defaultdict
+import hashlib
+import os
+import random
 
 from consistent_hash.consistent_hash import ConsistentHash
 from twisted.internet.error import ConnectionAborted
 from twisted.internet import defer, endpoints
 from twisted.python import log
+from twisted.python.failure import Failure
 
-from txyam.utils import deferredDict
+from txyam.codec import BytesCodec, threadPoolRunner
+from txyam.utils import aggregate, deferredDict
 from txyam.factory import MemCacheClientFactory
+from txyam.keys import MAX_KEY_LENGTH, keyToBytes
+from txyam.namespace import Namespace
+from txyam.pipeline import Pipeline
 
 
 if hasattr(dict, "iteritems"):
@@ -23,32 +32,144 @@ else:
         return d.values()
 
 
-def _wrap(cmd):
+def _wrap(cmd, mirror=False):
     """
     Used to wrap all of the memcache methods (get,set,getMultiple,etc).
+
+    If C{mirror} is true, the command is also sent to the key's previous
+    owner while hosts are being migrated.
     """
     def wrapper(self, key, *args, **kwargs):
-        client = self.getClient(key)
-        if client is None:
-            return defer.succeed(None)
-        func = getattr(client, cmd)
-        d = func(key, *args, **kwargs)
-        d.addErrback(lambda ign: None)
-        return d
+        return self._command(
+            cmd, mirror, self._encodeKey(key), *args, **kwargs)
     return wrapper
 
 
+def _firstFailure(results):
+    """
+    Fail the way C{defer.gatherResults} would if any result is a failure.
+    """
+    for index, result in enumerate(results):
+        if isinstance(result, Failure):
+            return Failure(defer.FirstError(result, index))
+    return results
+
+
+_missing = object()
+
+
+def _markVivified(result):
+    # memcached answers a vivified miss with the empty item it created, with
+    # a win flag for the client which created it and a win token sent flag
+    # for the others until it's replaced. An item invalidated by a meta
+    # delete has win flags too, but is stale.
+    if (result is not None and result.value == b'' and not result.stale
+            and (result.won or result.winTokenSent)):
+        result.vivified = True
+    return result
+
+
+def _decodeKeys(results, mapping):
+    return dict((mapping[key], value) for key, value in iteritems(results))
+
+
+def _largeChunkKeys(key, token, count):
+    key = base = keyToBytes(key)
+    if len(b'%s/%s/%d' % (key, token, count - 1)) > MAX_KEY_LENGTH:
+        # Keys too long to be extended are replaced with a fixed-size digest.
+        base = b'#' + hexlify(hashlib.sha1(key).digest())
+    return [b'%s/%s/%d' % (base, token, i) for i in range(count)]
+
+
+def _parseLargeManifest(manifest):
+    try:
+        token, count, length = manifest.split(b':')
+        return token, int(count), int(length)
+    except (AttributeError, ValueError):
+        return None
+
+
 class YamClient(object):
     clientFromString = staticmethod(endpoints.clientFromString)
 
-    def __init__(self, reactor, hosts, retryDelay=2, **kw):
+    # memcached's default item size limit is 1MB, which also has to fit the
+    # key and item header.
+    largeChunkSize = 1000 * 1000
+
+    # The number of keys whose ring position is cached.
+    nodeCacheSize = 10000
+
+    # The smallest weight which still gives a host a point in the consistent
+    # hash, which has interleave_count points per unit of weight.
+    minWeight = 1.0 / ConsistentHash.interleave_count
+
+    def __init__(self, reactor, hosts, retryDelay=2, retryBackoff=1,
+                 maxRetryDelay=None, retryJitter=0, warmup=False,
+                 warmupDuration=0, warmupSteps=4, keyEncoder=None,
+                 factoryClass=MemCacheClientFactory, codec=None,
+                 offloadThreshold=None, offloadRunner=None, **kw):
+        """
+        @param retryDelay: The delay before the first reconnection attempt
+        to a host.
+        @param retryBackoff: The factor by which the delay grows after each
+        consecutive failed attempt.
+        @param maxRetryDelay: The cap on the delay, if any.
+        @param retryJitter: The fraction of the delay, between 0 and 1, which
+        is randomly shaved off each delay so that many clients don't reconnect
+        in lockstep.
+        @param warmup: If true, a connected host only joins the consistent
+        hash once it answered a C{version} probe.
+        @param warmupDuration: If nonzero, after the probe, a host's weight in
+        the consistent hash is ramped up to its full share over this many
+        seconds, in C{warmupSteps} steps.
+        @param keyEncoder: If not C{None}, a L{txyam.keys.KeyEncoder} which
+        every key is passed through before being sent.
+        @param factoryClass: The factory used to build the protocol for each
+        connection. Use L{txyam.factory.SlottedMemCacheClientFactory} for the
+        protocol from L{txyam.protocol}, which allocates less per command.
+        Other keyword arguments are passed to the protocol.
+        @param codec: The codec used by L{getValue}, L{setValue} and their
+        multiple-key variants, by default a L{txyam.codec.BytesCodec}.
+        @param offloadThreshold: If not C{None}, values at least this many
+        bytes long are encoded and decoded by C{offloadRunner} instead of on
+        the reactor thread.
+        @param offloadRunner: A callable taking a function and its arguments
+        and returning a C{Deferred} of its result, such as
+        L{txyam.codec.executorRunner}. By default, the reactor's thread pool
+        is used.
+        """
         self.reactor = reactor
         self._allHosts = hosts
         self._consistentHash = ConsistentHash([])
-        self._connectionDeferreds = set()
+        self._connecting = {}
+        self._reconnectCalls = {}
+        self._retryAttempts = defaultdict(int)
+        self._rampCalls = {}
+        self._weights = {}
         self._protocols = {}
+        self._nodeCache = {}
+        self._keyEncoder = keyEncoder
+        self._factoryClass = factoryClass
+        if codec is None:
+            codec = BytesCodec()
+        self.codec = codec
+        self._offloadThreshold = offloadThreshold
+        if offloadRunner is None:
+            offloadRunner = threadPoolRunner(reactor)
+        self._offloadRunner = offloadRunner
         self._retryDelay = retryDelay
+        self._retryBackoff = retryBackoff
+        self._maxRetryDelay = maxRetryDelay
+        self._retryJitter = retryJitter
+        self._random = random.random
+        self._warmup = warmup
+        self._warmupDuration = warmupDuration
+        self._warmupSteps = warmupSteps
         self._protocolKwargs = kw
+        self._previousHash = None
+        self._copyForward = False
+        self._copyExpireTime = 0
+        self._migrationCall = None
         self.disconnecting = False
 
     def connect(self):
@@ -62,38 +183,246 @@ class YamClient(object):
         return dl
 
     def _connectHost(self, host):
+        if host in self._connecting:
+            # Don't start a second attempt while the first is pending.
+            return self._connecting[host]
         endpoint = self.clientFromString(self.reactor, host)
         d = endpoint.connect(
-            MemCacheClientFactory(self.reactor, **self._protocolKwargs))
-        self._connectionDeferreds.add(d)
+            self._factoryClass(self.reactor, **self._protocolKwargs))
+        self._connecting[host] = d
         d.addCallback(self._gotProtocol, host, d)
         d.addErrback(self._connectionFailed, host, d)
         return d
 
+    def _finishedConnecting(self, host, deferred):
+        if self._connecting.get(host) is deferred:
+            del self._connecting[host]
+
     def _gotProtocol(self, protocol, host, deferred):
-        self._connectionDeferreds.discard(deferred)
+        self._finishedConnecting(host, deferred)
+        if host not in self._allHosts or host in self._protocols:
+            # The host was removed while it was being connected to, or is
+            # already connected.
+            protocol.deferred.addErrback(lambda ign: None)
+            protocol.transport.loseConnection()
+            return
         self._protocols[host] = protocol
-        self._consistentHash.add_nodes([host])
-        protocol.deferred.addErrback(self._lostProtocol, host)
+        protocol.deferred.addErrback(self._lostProtocol, host, protocol)
+        if self._warmup:
+            d = protocol.version()
+            d.addCallbacks(
+                self._warmedUp, self._warmupFailed,
+                callbackArgs=(host, protocol), errbackArgs=(host, protocol))
+        else:
+            protocol.responded.addCallback(self._responded, host, protocol)
+            self._addToRing(host)
+
+    def _responded(self, ign, host, protocol):
+        # Backoff only starts over once the connection proved healthy, so
+        # that a host which accepts and then drops connections backs off.
+        if self._protocols.get(host) is protocol:
+            self._retryAttempts.pop(host, None)
+
+    def _warmedUp(self, version, host, protocol):
+        if (self._protocols.get(host) is not protocol
+                or host not in self._allHosts):
+            return
+        self._retryAttempts.pop(host, None)
+        if self._warmupDuration:
+            self._rampUp(host, protocol, 1)
+        else:
+            self._addToRing(host)
+
+    def _warmupFailed(self, reason, host, protocol):
+        if self._protocols.get(host) is not protocol:
+            return
+        log.err(reason, 'warmup of %r failed' % (host,), system='txyam')
+        protocol.transport.loseConnection()
+
+    def _rampUp(self, host, protocol, step):
+        self._rampCalls.pop(host, None)
+        if (self._protocols.get(host) is not protocol
+                or host not in self._allHosts):
+            return
+        self._addToRing(host, step / float(self._warmupSteps))
+        if step < self._warmupSteps:
+            self._rampCalls[host] = self.reactor.callLater(
+                self._warmupDuration / float(self._warmupSteps),
+                self._rampUp, host, protocol, step + 1)
+
+    def _addToRing(self, host, fraction=1):
+        # Weights are always passed explicitly, as the ring remembers the
+        # last weight of removed nodes. A host already in the ring is removed
+        # first, as the ring would otherwise hold it twice.
+        if host in self._consistentHash.nodes:
+            self._consistentHash.del_nodes([host])
+        weight = max(fraction * self._weights.get(host, 1), self.minWeight)
+        self._consistentHash.add_nodes({host: weight})
+        self._nodeCache.clear()
+
+    def setWeight(self, host, weight):
+        """
+        Change the share of keys C{host} gets, relative to the default weight
+        of 1. For example, a L{txyam.stats.StatsCollector} observer can use
+        this to shift keys away from hosts under memory pressure.
+
+        The weight is kept if the host reconnects or is removed and added
+        again. A host which is still warming up gets it once it's done.
+
+        @raise ValueError: If C{weight} is below L{minWeight}.
+        """
+        if weight < self.minWeight:
+            raise ValueError('weight must be at least %r' % (self.minWeight,))
+        self._weights[host] = weight
+        if (host in self._consistentHash.nodes
+                and host not in self._rampCalls):
+            self._addToRing(host)
+
+    def _removeFromRing(self, host):
+        call = self._rampCalls.pop(host, None)
+        if call is not None:
+            call.cancel()
+        self._consistentHash.del_nodes([host])
+        self._nodeCache.clear()
 
     def _connectionFailed(self, reason, host, deferred):
-        self._connectionDeferreds.discard(deferred)
-        if self.disconnecting:
+        self._finishedConnecting(host, deferred)
+        if self.disconnecting or host not in self._allHosts:
             return
         log.err(reason, 'connection to %r failed' % (host,), system='txyam')
-        self.reactor.callLater(self._retryDelay, self._connectHost, host)
+        self._scheduleReconnect(host)
 
-    def _lostProtocol(self, reason, host):
-        if not self.disconnecting:
+    def _lostProtocol(self, reason, host, protocol):
+        if self._protocols.get(host) is not protocol:
+            return
+        stopped = self.disconnecting or host not in self._allHosts
+        if not stopped:
             log.err(reason, 'connection to %r lost' % (host,), system='txyam')
         del self._protocols[host]
-        self._consistentHash.del_nodes([host])
-        if self.disconnecting:
+        self._removeFromRing(host)
+        if stopped:
             return
-        if reason.check(ConnectionAborted):
-            self._connectHost(host)
+        if reason.check(ConnectionAborted) and not self._retryAttempts[host]:
+            # A timed out connection is replaced right away, or after a
+            # random part of the jittered first delay, so that the clients
+            # which timed out on an overloaded host don't reconnect at once.
+            self._retryAttempts[host] = 1
+            delay = self._retryDelay * self._retryJitter * self._random()
+            if delay:
+                self._scheduleReconnect(host, delay)
+            else:
+                self._connectHost(host)
         else:
-            self.reactor.callLater(self._retryDelay, self._connectHost, host)
+            self._scheduleReconnect(host)
+
+    def _nextRetryDelay(self, host):
+        attempts = self._retryAttempts[host]
+        self._retryAttempts[host] = attempts + 1
+        delay = self._retryDelay * self._retryBackoff ** attempts
+        if self._maxRetryDelay is not None:
+            delay = min(delay, self._maxRetryDelay)
+        return delay * (1 - self._retryJitter * self._random())
+
+    def _scheduleReconnect(self, host, delay=None):
+        if delay is None:
+            delay = self._nextRetryDelay(host)
+        self._reconnectCalls[host] = self.reactor.callLater(
+            delay, self._reconnect, host)
+
+    def _reconnect(self, host):
+        del self._reconnectCalls[host]
+        self._connectHost(host)
+
+    def _cancelReconnect(self, host):
+        call = self._reconnectCalls.pop(host, None)
+        if call is not None:
+            call.cancel()
+
+    def setHosts(self, hosts, migrationWindow=0, copyForward=False,
+                 copyExpireTime=0):
+        """
+        Change the set of hosts without building a new client.
+
+        Added hosts are connected to and join the consistent hash as their
+        connections are made; removed hosts leave it immediately.
+
+        If C{migrationWindow} is nonzero, then for that many seconds the
+        consistent hash from before the change is kept around: removed hosts
+        stay connected, reads which miss on a key's new owner fall back to its
+        previous owner, and writes go to both owners. If C{copyForward} is
+        true, values found on a previous owner are also stored on the new
+        owner, expiring after C{copyExpireTime} seconds.
+
+        @return: A C{Deferred} which fires with this client once every added
+        host's first connection attempt has completed.
+        """
+        hosts = list(hosts)
+        added = [host for host in hosts if host not in self._allHosts]
+        removed = [host for host in self._allHosts if host not in hosts]
+        ring = self._consistentHash
+        # The ring keeps the last weight of removed nodes too, so only the
+        # weights of the nodes still in it are copied.
+        previousNodes = dict(
+            (node, ring.weights.get(node, 1)) for node in ring.nodes)
+        self._allHosts = hosts
+
+        if self._migrationCall is not None and self._migrationCall.active():
+            self._migrationCall.cancel()
+        self._migrationCall = None
+        if migrationWindow:
+            self._previousHash = ConsistentHash(previousNodes)
+            self._copyForward = copyForward
+            self._copyExpireTime = copyExpireTime
+            self._migrationCall = self.reactor.callLater(
+                migrationWindow, self._endMigration)
+        else:
+            self._endMigration()
+
+        for host in removed:
+            self._removeFromRing(host)
+            self._cancelReconnect(host)
+            self._retryAttempts.pop(host, None)
+        deferreds = []
+        for host in added:
+            if host in self._protocols:
+                # Still connected from before it was removed.
+                self._addToRing(host)
+            else:
+                deferreds.append(self._connectHost(host))
+
+        dl = defer.DeferredList(deferreds)
+        dl.addCallback(lambda ign: self)
+        return dl
+
+    def _endMigration(self):
+        self._migrationCall = None
+        self._previousHash = None
+        for host, proto in list(iteritems(self._protocols)):
+            if host not in self._allHosts:
+                proto.drain()
+
+    def followMembership(self, source, **kwargs):
+        """
+        Keep the set of hosts in sync with a membership source from
+        L{txyam.membership}.
+
+        @param kwargs: Passed to L{setHosts} every time the membership
+        changes.
+        """
+        source.start(lambda hosts: self.setHosts(hosts, **kwargs))
+        return source
+
+    def _previousClient(self, key, client):
+        """
+        Get the connection to the host which owned C{key} before the hosts
+        were changed, if that's a different host than C{client}'s.
+        """
+        if self._previousHash is None:
+            return None
+        previous = self._protocols.get(self._previousHash.get_node(key))
+        if previous is client:
+            return None
+        return previous
 
     @property
     def _allConnections(self):
@@ -102,14 +431,17 @@ class YamClient(object):
     def disconnect(self):
         self.disconnecting = True
         log.msg('disconnecting from all clients', system='txyam')
-        for d in list(self._connectionDeferreds):
+        for d in list(self._connecting.values()):
             d.cancel()
+        for host in list(self._reconnectCalls):
+            self._cancelReconnect(host)
         for proto in self._allConnections:
             proto.transport.loseConnection()
 
     def flushAll(self):
-        return defer.gatherResults(
-            [proto.flushAll() for proto in self._allConnections])
+        d = aggregate([proto.flushAll() for proto in self._allConnections])
+        d.addCallback(_firstFailure)
+        return d
 
     def stats(self, arg=None):
         ds = {}
@@ -124,18 +456,156 @@ class YamClient(object):
         return deferredDict(ds)
 
     def getClient(self, key):
-        return self._protocols.get(self._consistentHash.get_node(key))
+        try:
+            node = self._nodeCache[key]
+        except KeyError:
+            if len(self._nodeCache) >= self.nodeCacheSize:
+                self._nodeCache.clear()
+            node = self._nodeCache[key] = self._consistentHash.get_node(key)
+        return self._protocols.get(node)
 
-    def getMultiple(self, keys, withIdentifier=False):
+    def _encodeKey(self, key):
+        if self._keyEncoder is None:
+            return key
+        return self._keyEncoder.encode(key)
+
+    def _encodeKeys(self, keys):
+        """
+        Encode many keys at once.
+
+        @return: A tuple of the list of encoded keys, and either a C{dict}
+        mapping encoded keys back to the original keys or C{None} if keys
+        aren't encoded.
+        """
+        if self._keyEncoder is None:
+            return keys, None
+        mapping = dict((self._keyEncoder.encode(key), key) for key in keys)
+        return list(mapping), mapping
+
+    def _command(self, cmd, mirror, key, *args, **kwargs):
+        client = self.getClient(key)
+        if client is None:
+            return defer.succeed(None)
+        if mirror:
+            self._mirror(cmd, key, client, *args, **kwargs)
+        func = getattr(client, cmd)
+        d = func(key, *args, **kwargs)
+        d.addErrback(lambda ign: None)
+        return d
+
+    def _mirror(self, cmd, key, client, *args, **kwargs):
+        """
+        Send a write to the key's previous owner while hosts are being
+        migrated, if that's a different host than C{client}'s.
+        """
+        previous = self._previousClient(key, client)
+        if previous is not None:
+            getattr(previous, cmd)(key, *args, **kwargs).addErrback(
+                lambda ign: None)
+
+    def _clientsForKeys(self, keys):
         clients = defaultdict(list)
         for key in keys:
             clients[self.getClient(key)].append(key)
-        dl = defer.DeferredList(
-            [c.getMultiple(ks, withIdentifier) for c, ks in iteritems(clients)
-             if c is not None],
-            consumeErrors=True)
-        dl.addCallback(self._consolidateMultiple)
-        return dl
+        clients.pop(None, None)
+        return clients
+
+    def get(self, key, withIdentifier=False):
+        key = self._encodeKey(key)
+        d = self._command('get', False, key, withIdentifier)
+        if self._previousHash is not None and not withIdentifier:
+            d.addCallback(self._fallBackOnMiss, key)
+        return d
+
+    def _fallBackOnMiss(self, result, key):
+        if result is None or result[1] is not None:
+            return result
+        client = self.getClient(key)
+        previous = self._previousClient(key, client)
+        if previous is None:
+            return result
+        d = previous.get(key)
+        d.addCallback(self._gotPrevious, key, client, result)
+        d.addErrback(lambda ign: result)
+        return d
+
+    def _gotPrevious(self, previousResult, key, client, result):
+        flags, value = previousResult
+        if value is None:
+            return result
+        if self._copyForward and client is not None:
+            client.set(key, value, flags, self._copyExpireTime).addErrback(
+                lambda ign: None)
+        return previousResult
+
+    def getMultiple(self, keys, withIdentifier=False):
+        keys, mapping = self._encodeKeys(keys)
+        clients = self._clientsForKeys(keys)
+        d = aggregate(
+            [c.getMultiple(ks, withIdentifier)
+             for c, ks in iteritems(clients)])
+        d.addCallback(self._consolidateMultiple)
+        if self._previousHash is not None and not withIdentifier:
+            d.addCallback(self._fallBackOnMultipleMisses)
+        if mapping is not None:
+            d.addCallback(_decodeKeys, mapping)
+        return d
+
+    def _fallBackOnMultipleMisses(self, results):
+        previousClients = defaultdict(list)
+        for key, (flags, value) in iteritems(results):
+            if value is not None:
+                continue
+            client = self.getClient(key)
+            previous = self._previousClient(key, client)
+            if previous is not None:
+                previousClients[previous].append(key)
+        if not previousClients:
+            return results
+
+        d = aggregate(
+            [c.getMultiple(ks) for c, ks in iteritems(previousClients)])
+        d.addCallback(self._consolidateMultiple)
+        d.addCallback(self._mergePrevious, results)
+        return d
+
+    def _mergePrevious(self, previousResults, results):
+        for key, (flags, value) in iteritems(previousResults):
+            if value is None:
+                continue
+            results[key] = flags, value
+            client = self.getClient(key)
+            if self._copyForward and client is not None:
+                client.set(key, value, flags, self._copyExpireTime).addErrback(
+                    lambda ign: None)
+        return results
+
+    def getAndTouchMultiple(self, keys, expireTime, withIdentifier=False):
+        keys, mapping = self._encodeKeys(keys)
+        clients = self._clientsForKeys(keys)
+        d = aggregate(
+            [c.getAndTouchMultiple(ks, expireTime, withIdentifier)
+             for c, ks in iteritems(clients)])
+        d.addCallback(self._consolidateMultiple)
+        if mapping is not None:
+            d.addCallback(_decodeKeys, mapping)
+        return d
+
+    def touchMultiple(self, keys, expireTime):
+        keys, mapping = self._encodeKeys(keys)
+        ds = {}
+        for client, ks in iteritems(self._clientsForKeys(keys)):
+            for key in ks:
+                self._mirror('touch', key, client, expireTime)
+                d = ds[key] = client.touch(key, expireTime)
+                d.addErrback(lambda ign: None)
+        for key in keys:
+            if key not in ds:
+                ds[key] = defer.succeed(None)
+        d = deferredDict(ds)
+        if mapping is not None:
+            d.addCallback(_decodeKeys, mapping)
+        return d
 
     def setMultiple(self, items, flags=0, expireTime=0):
         ds = {}
@@ -149,20 +619,367 @@ class YamClient(object):
             ds[key] = self.delete(key)
         return deferredDict(ds)
 
+    def _offloads(self, size):
+        return (self._offloadThreshold is not None
+                and getattr(self.codec, 'offload', True)
+                and size is not None and size >= self._offloadThreshold)
+
+    def _encodeValue(self, value):
+        try:
+            offload = self._offloads(self.codec.sizeOf(value))
+        except Exception:
+            return defer.fail()
+        if offload:
+            return self._offloadRunner(self.codec.encode, value)
+        return defer.maybeDeferred(self.codec.encode, value)
+
+    def _decodeValue(self, flags, data):
+        if self._offloads(len(data)):
+            return self._offloadRunner(self.codec.decode, flags, data)
+        return defer.maybeDeferred(self.codec.decode, flags, data)
+
+    def _codecFailed(self, failure, action, key, result):
+        log.err(failure, '%s the value of %r failed' % (action, key),
+                system='txyam')
+        return result
+
+    def getValue(self, key, default=None):
+        """
+        Get C{key} and decode its value with the client's codec.
+
+        @return: A C{Deferred} which fires with the value, or C{default} if
+        the key wasn't found, no client is available or the value couldn't be
+        decoded.
+        """
+        d = self.get(key)
+        d.addCallback(self._gotValue, key, default)
+        return d
+
+    def _gotValue(self, result, key, default):
+        if result is None or result[-1] is None:
+            return default
+        flags, data = result
+        d = self._decodeValue(flags, data)
+        d.addErrback(self._codecFailed, 'decoding', key, default)
+        return d
+
+    def getValues(self, keys):
+        """
+        Get C{keys} and decode their values with the client's codec.
+
+        @return: A C{Deferred} which fires with a C{dict} mapping the keys
+        which were found and could be decoded to their values.
+        """
+        d = self.getMultiple(keys)
+        d.addCallback(self._gotValues)
+        return d
+
+    def _gotValues(self, results):
+        keys = []
+        ds = []
+        for key, (flags, data) in iteritems(results):
+            if data is None:
+                continue
+            keys.append(key)
+            ds.append(self._decodeValue(flags, data).addErrback(
+                self._codecFailed, 'decoding', key, _missing))
+        d = aggregate(ds)
+        d.addCallback(lambda values: dict(
+            (key, value) for key, value in zip(keys, values)
+            if value is not _missing))
+        return d
+
+    def setValue(self, key, value, expireTime=0):
+        """
+        Encode C{value} with the client's codec and set C{key} to it.
+
+        @return: A C{Deferred} which fires like L{set}'s, or fails if the
+        value couldn't be encoded.
+        """
+        d = self._encodeValue(value)
+        d.addCallback(self._setEncoded, key, expireTime)
+        return d
+
+    def _setEncoded(self, encoded, key, expireTime):
+        flags, data = encoded
+        return self.set(key, data, flags, expireTime)
+
+    def setValues(self, items, expireTime=0):
+        """
+        Encode and set every value of the C{dict} C{items}.
+
+        @return: A C{Deferred} which fires with a C{dict} mapping each key to
+        the result of its set, or C{None} if its value couldn't be encoded.
+        """
+        ds = {}
+        for key, value in iteritems(items):
+            ds[key] = self.setValue(key, value, expireTime).addErrback(
+                self._codecFailed, 'encoding', key, None)
+        return deferredDict(ds)
+
+    def namespace(self, name, cacheTime=1):
+        """
+        Create a L{Namespace} of keys which can be invalidated all at once.
+        """
+        return Namespace(self, name, cacheTime)
+
+    def metaGet(self, key, withIdentifier=False, vivify=None, recache=None,
+                expireTime=None):
+        """
+        Get C{key} with a meta get, for protection against thundering herds.
+
+        @param vivify: If not C{None}, a miss creates an empty placeholder
+        item with this TTL. The client which created it gets it with a win
+        flag, and other clients get it with the win token already sent until
+        it's replaced. Either way, the result's C{vivified} is true and its
+        C{hit} false.
+        @param recache: If not C{None}, the first client to fetch the value
+        once its remaining TTL drops below this many seconds gets a win flag,
+        while others keep being served the current value.
+        @param expireTime: If not C{None}, the item's TTL is updated.
+
+        @return: A C{Deferred} which fires with a
+        L{txyam.factory.MetaResult}, or C{None} if no client is available. If
+        its C{won} is true, the caller should recompute the value and store it
+        with L{metaSet}; if its C{stale} is true, the value may be served
+        while that happens.
+        """
+        flags = [b'v', b'f', b't']
+        if withIdentifier:
+            flags.append(b'c')
+        if vivify is not None:
+            flags.append(b'N%d' % (vivify,))
+        if recache is not None:
+            flags.append(b'R%d' % (recache,))
+        if expireTime is not None:
+            flags.append(b'T%d' % (expireTime,))
+        d = self._metaGet(key, flags)
+        if vivify is not None:
+            d.addCallback(_markVivified)
+        return d
+
+    def metaSet(self, key, value, flags=0, expireTime=0, cas=None,
+                invalidate=False):
+        """
+        Store C{value} with a meta set.
+
+        @param cas: If not C{None}, the value is only stored if the item's CAS
+        identifier still matches.
+        @param invalidate: If true along with C{cas}, a set with an older CAS
+        identifier marks the item stale instead of failing.
+
+        @return: A C{Deferred} which fires with a
+        L{txyam.factory.MetaResult}, whose C{hit} is true if the value was
+        stored.
+        """
+        metaFlags = [b'F%d' % (flags,), b'T%d' % (expireTime,)]
+        if cas is not None:
+            metaFlags.append(b'C%d' % (cas,))
+        if invalidate:
+            metaFlags.append(b'I')
+        return self._metaSet(key, value, metaFlags)
+
+    def metaDelete(self, key, invalidate=False, expireTime=None):
+        """
+        Delete C{key} with a meta delete.
+
+        @param invalidate: If true, the item is marked stale instead of being
+        removed, so that clients keep being served it while one of them wins
+        the right to recompute it.
+        @param expireTime: If not C{None}, the TTL of an invalidated item.
+        """
+        metaFlags = []
+        if invalidate:
+            metaFlags.append(b'I')
+        if expireTime is not None:
+            metaFlags.append(b'T%d' % (expireTime,))
+        return self._metaDelete(key, metaFlags)
+
+    def incrementMultiple(self, deltas, expireTime=0):
+        """
+        Apply many counter deltas at once.
+
+        The commands are grouped per host. Negative deltas are applied with
+        C{decr}. Missing counters are initialized with C{add}, starting from
+        the delta (or zero, for negative deltas, as memcached counters can't
+        go below zero).
+
+        @param deltas: A C{dict} mapping keys to the C{int} to add.
+
+        @return: A C{Deferred} which fires with a C{dict} mapping each key to
+        the counter's new value, or C{None} if it couldn't be updated.
+        """
+        keys, mapping = self._encodeKeys(deltas)
+        if mapping is not None:
+            deltas = dict((key, deltas[mapping[key]]) for key in keys)
+        ds = {}
+        for client, ks in iteritems(self._clientsForKeys(keys)):
+            for key in ks:
+                d = ds[key] = self._incrementOrAdd(
+                    client, key, deltas[key], expireTime)
+                d.addErrback(lambda ign: None)
+        for key in keys:
+            if key not in ds:
+                ds[key] = defer.succeed(None)
+        d = deferredDict(ds)
+        if mapping is not None:
+            d.addCallback(_decodeKeys, mapping)
+        return d
+
+    def _incrementOrAdd(self, client, key, delta, expireTime, retry=True):
+        if delta < 0:
+            cmd, args = 'decrement', (-delta,)
+        else:
+            cmd, args = 'increment', (delta,)
+        if retry:
+            # Retries aren't mirrored, so the previous owner only gets the
+            # delta once.
+            self._mirror(cmd, key, client, *args)
+        d = getattr(client, cmd)(key, *args)
+
+        def added(stored, initial):
+            if stored:
+                return initial
+            elif retry:
+                # Someone else created the counter first.
+                return self._incrementOrAdd(
+                    client, key, delta, expireTime, retry=False)
+            return None
+
+        def incremented(result):
+            if result is not False:
+                return result
+            initial = max(delta, 0)
+            value = b'%d' % (initial,)
+            if retry:
+                self._mirror('add', key, client, value, 0, expireTime)
+            d = client.add(key, value, 0, expireTime)
+            d.addCallback(added, initial)
+            return d
+
+        d.addCallback(incremented)
+        return d
+
+    def pipeline(self):
+        """
+        Create a L{Pipeline} for sending many operations at once.
+        """
+        return Pipeline(self)
+
+    def _largeValueToken(self):
+        return hexlify(os.urandom(8))
+
+    def setLarge(self, key, value, flags=0, expireTime=0):
+        """
+        Store a value which may be bigger than memcached's item size limit.
+
+        The value is split into chunks of at most C{largeChunkSize} bytes,
+        stored under keys derived from C{key}, or from a digest of C{key} if
+        it's too long to be extended, and a fresh version token. Once
+        every chunk has been stored, a manifest naming the token is stored
+        under C{key} itself, so readers never see chunks from different
+        writes. Chunks of previous versions are left to expire.
+
+        @return: A C{Deferred} which fires with C{True} if the value was
+        stored, or C{False} otherwise.
+        """
+        size = self.largeChunkSize
+        token = self._largeValueToken()
+        count = max(1, (len(value) + size - 1) // size)
+        chunkKeys = _largeChunkKeys(key, token, count)
+        chunks = {}
+        for i, chunkKey in enumerate(chunkKeys):
+            chunks[chunkKey] = value[i * size:(i + 1) * size]
+        manifest = b'%s:%d:%d' % (token, count, len(value))
+
+        def storeManifest(results):
+            if len(results) != count or not all(itervalues(results)):
+                return False
+            d = self.set(key, manifest, flags, expireTime)
+            d.addCallback(bool)
+            return d
+
+        d = self.setMultiple(chunks, 0, expireTime)
+        d.addCallback(storeManifest)
+        return d
+
+    def getLarge(self, key):
+        """
+        Retrieve a value stored with C{setLarge}.
+
+        The manifest is fetched first, then all of the chunks it names with a
+        single C{getMultiple}.
+
+        @return: A C{Deferred} which fires with a C{(flags, value)} tuple,
+        like C{get}. If the manifest or any chunk is missing, the value will be
+        C{None}.
+        """
+        def gotManifest(result):
+            if result is None:
+                return None
+            flags, manifest = result
+            parsed = _parseLargeManifest(manifest)
+            if parsed is None:
+                return 0, None
+            token, count, length = parsed
+            chunkKeys = _largeChunkKeys(key, token, count)
+            d = self.getMultiple(chunkKeys)
+            d.addCallback(self._reassembleLarge, chunkKeys, flags, length)
+            return d
+
+        d = self.get(key)
+        d.addCallback(gotManifest)
+        return d
+
+    def _reassembleLarge(self, results, chunkKeys, flags, length):
+        buf = bytearray()
+        for chunkKey in chunkKeys:
+            chunk = results.get(chunkKey, (0, None))[1]
+            if chunk is None:
+                return 0, None
+            buf += chunk
+        if len(buf) != length:
+            return 0, None
+        return flags, bytes(buf)
+
+    def deleteLarge(self, key):
+        """
+        Delete a value stored with C{setLarge}, along with its chunks.
+
+        @return: A C{Deferred} which fires with C{True} if the manifest was
+        deleted, or C{False} otherwise.
+        """
+        def gotManifest(result):
+            parsed = result and _parseLargeManifest(result[1])
+            d = self.delete(key)
+            if parsed is not None:
+                token, count, length = parsed
+                self.deleteMultiple(_largeChunkKeys(key, token, count))
+            d.addCallback(bool)
+            return d
+
+        d = self.get(key)
+        d.addCallback(gotManifest)
+        return d
+
     def _consolidateMultiple(self, results):
         ret = {}
-        for succeeded, result in results:
-            if succeeded:
+        for result in results:
+            if not isinstance(result, Failure):
                 ret.update(result)
         return ret
 
-    set = _wrap('set')
-    get = _wrap('get')
-    increment = _wrap('increment')
-    decrement = _wrap('decrement')
-    replace = _wrap('replace')
-    add = _wrap('add')
+    set = _wrap('set', mirror=True)
+    increment = _wrap('increment', mirror=True)
+    decrement = _wrap('decrement', mirror=True)
+    replace = _wrap('replace', mirror=True)
+    add = _wrap('add', mirror=True)
     checkAndSet = _wrap('checkAndSet')
-    append = _wrap('append')
-    prepend = _wrap('prepend')
-    delete = _wrap('delete')
+    append = _wrap('append', mirror=True)
+    prepend = _wrap('prepend', mirror=True)
+    delete = _wrap('delete', mirror=True)
+    touch = _wrap('touch', mirror=True)
+    _metaGet = _wrap('metaGet')
+    _metaSet = _wrap('metaSet', mirror=True)
+    _metaDelete = _wrap('metaDelete', mirror=True)
+    getAndTouch = _wrap('getAndTouch')
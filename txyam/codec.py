@@ -0,0 +1,125 @@
+"""
+Codecs turn application values into the flags and bytes stored in memcached,
+and back.
+
+A codec has an C{encode(value)} method returning a C{(flags, data)} tuple, a
+C{decode(flags, data)} method reversing it, and a C{sizeOf(value)} method
+estimating how large a value is before it's encoded, or returning C{None} if
+that isn't known cheaply. A codec whose work is too cheap to be worth running
+away from the reactor thread sets C{offload} to false.
+
+Encoding and decoding large values can take long enough to hold up every
+other response the reactor is waiting for, so C{YamClient} can hand them to
+a runner: a callable which takes a function and its arguments, calls it away
+from the reactor thread and returns a C{Deferred} firing with its result.
+"""
+
+import pickle
+import zlib
+
+from twisted.internet import defer, threads
+from twisted.python.failure import Failure
+
+
+# Flags set by PickleCodec.
+FLAG_PICKLE = 1 << 0
+FLAG_COMPRESSED = 1 << 1
+FLAG_TEXT = 1 << 2
+
+
+class BytesCodec(object):
+    """
+    A codec which only stores C{bytes}, as they are.
+    """
+
+    offload = False
+
+    def sizeOf(self, value):
+        if not isinstance(value, bytes):
+            return None
+        return len(value)
+
+    def encode(self, value):
+        if not isinstance(value, bytes):
+            raise TypeError('expected bytes, not %s' % (type(value),))
+        return 0, value
+
+    def decode(self, flags, data):
+        return data
+
+
+class PickleCodec(object):
+    """
+    A codec which stores C{bytes} as they are, text as UTF-8 and any other
+    value pickled. Only use it with memcached servers which are trusted, as
+    unpickling data can run arbitrary code.
+
+    @ivar compressThreshold: If not C{None}, encoded values at least this many
+    bytes long are compressed with zlib.
+    """
+
+    def __init__(self, compressThreshold=None,
+                 protocol=pickle.HIGHEST_PROTOCOL):
+        self.compressThreshold = compressThreshold
+        self.protocol = protocol
+
+    def sizeOf(self, value):
+        if isinstance(value, (bytes, type(u''))):
+            return len(value)
+        return None
+
+    def encode(self, value):
+        if isinstance(value, bytes):
+            flags, data = 0, value
+        elif isinstance(value, type(u'')):
+            flags, data = FLAG_TEXT, value.encode('utf-8')
+        else:
+            flags, data = FLAG_PICKLE, pickle.dumps(value, self.protocol)
+        if (self.compressThreshold is not None
+                and len(data) >= self.compressThreshold):
+            flags, data = flags | FLAG_COMPRESSED, zlib.compress(data)
+        return flags, data
+
+    def decode(self, flags, data):
+        if flags & FLAG_COMPRESSED:
+            data = zlib.decompress(data)
+        if flags & FLAG_PICKLE:
+            return pickle.loads(data)
+        if flags & FLAG_TEXT:
+            return data.decode('utf-8')
+        return data
+
+
+def threadPoolRunner(reactor, threadPool=None):
+    """
+    A runner which calls functions in a thread pool, by default the
+    reactor's.
+    """
+    def run(f, *args):
+        pool = threadPool
+        if pool is None:
+            pool = reactor.getThreadPool()
+        return threads.deferToThreadPool(reactor, pool, f, *args)
+    return run
+
+
+def executorRunner(reactor, executor):
+    """
+    A runner which calls functions with a C{concurrent.futures} executor, such
+    as a C{ProcessPoolExecutor}. With a process pool, the codec must be
+    picklable.
+    """
+    def run(f, *args):
+        d = defer.Deferred()
+
+        def done(future):
+            try:
+                result = future.result()
+            except Exception:
+                reactor.callFromThread(d.errback, Failure())
+            else:
+                reactor.callFromThread(d.callback, result)
+
+        executor.submit(f, *args).add_done_callback(done)
+        return d
+    return run
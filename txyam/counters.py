@@ -0,0 +1,82 @@
+from collections import defaultdict
+
+from twisted.internet import defer
+
+
+class Counters(object):
+    """
+    Aggregates counter updates in-process and applies them in batches.
+
+    Deltas for the same key are summed for up to C{flushInterval} seconds,
+    then every pending counter is sent with one
+    C{YamClient.incrementMultiple} call.
+    """
+
+    def __init__(self, client, flushInterval=1, expireTime=0):
+        self.client = client
+        self.flushInterval = flushInterval
+        self.expireTime = expireTime
+        self._deltas = defaultdict(int)
+        self._waiting = defaultdict(list)
+        self._delayedFlush = None
+
+    def increment(self, key, delta=1):
+        """
+        Add C{delta} to the counter at C{key} on the next flush.
+
+        @return: A C{Deferred} which fires with the counter's new value once
+        the batch containing this update has been applied.
+        """
+        self._deltas[key] += delta
+        d = defer.Deferred()
+        self._waiting[key].append(d)
+        if self._delayedFlush is None:
+            self._delayedFlush = self.client.reactor.callLater(
+                self.flushInterval, self._scheduledFlush)
+        return d
+
+    def decrement(self, key, delta=1):
+        """
+        Subtract C{delta} from the counter at C{key} on the next flush.
+        """
+        return self.increment(key, -delta)
+
+    def flush(self):
+        """
+        Immediately apply every pending update.
+
+        @return: A C{Deferred} which fires with the result of the
+        C{incrementMultiple} call, or an empty C{dict} if nothing was pending.
+        If the call fails, so do the C{Deferred}s of every update it
+        contained.
+        """
+        if self._delayedFlush is not None:
+            if self._delayedFlush.active():
+                self._delayedFlush.cancel()
+            self._delayedFlush = None
+        deltas, self._deltas = self._deltas, defaultdict(int)
+        waiting, self._waiting = self._waiting, defaultdict(list)
+        if not deltas:
+            return defer.succeed({})
+        d = defer.maybeDeferred(
+            self.client.incrementMultiple, dict(deltas), self.expireTime)
+        d.addCallbacks(self._distribute, self._failed,
+                       callbackArgs=(waiting,), errbackArgs=(waiting,))
+        return d
+
+    def _scheduledFlush(self):
+        # The failure was already passed on to every update's Deferred.
+        self.flush().addErrback(lambda ign: None)
+
+    def _distribute(self, results, waiting):
+        for key, ds in waiting.items():
+            value = results.get(key)
+            for d in ds:
+                d.callback(value)
+        return results
+
+    def _failed(self, reason, waiting):
+        for ds in waiting.values():
+            for d in ds:
+                d.errback(reason)
+        return reason
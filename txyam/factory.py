@@ -1,14 +1,105 @@
-from twisted.internet.defer import Deferred
+from twisted.internet.defer import Deferred, fail
 from twisted.internet.protocol import Factory
-from twisted.protocols.memcache import MemCacheProtocol
+from twisted.protocols.memcache import ClientError, Command, MemCacheProtocol
 
+from txyam import protocol as txyamProtocol
+
+
+def _parseMetaFlags(line):
+    return dict((token[:1], token[1:]) for token in line.split())
+
+
+class MetaResult(object):
+    """
+    The response to a meta command.
+
+    @ivar status: The response code, such as C{VA}, C{HD} or C{EN}.
+    @ivar value: The value, if one was requested and found, otherwise C{None}.
+    @ivar flags: A C{dict} mapping the returned flags, as single-character
+    C{bytes}, to their (possibly empty) C{bytes} tokens.
+    @ivar vivified: Whether the item is the empty placeholder a meta get with
+    vivify-on-miss created, rather than a cached value.
+    """
+
+    def __init__(self, status, flags=None, value=None, vivified=False):
+        self.status = status
+        self.flags = flags or {}
+        self.value = value
+        self.vivified = vivified
+
+    def __repr__(self):
+        return '<MetaResult %r flags=%r value=%r>' % (
+            self.status, self.flags, self.value)
+
+    @property
+    def hit(self):
+        """
+        Whether a meta get found a cached value, or a meta set or delete
+        succeeded. A vivified placeholder isn't a hit.
+        """
+        return self.status in (b'VA', b'HD') and not self.vivified
+
+    @property
+    def won(self):
+        """
+        Whether this client won the right to recompute the value.
+        """
+        return b'W' in self.flags
+
+    @property
+    def stale(self):
+        """
+        Whether the value is stale, as it was invalidated or is being
+        recached.
+        """
+        return b'X' in self.flags
+
+    @property
+    def winTokenSent(self):
+        """
+        Whether another client already won the right to recompute the value.
+        """
+        return b'Z' in self.flags
+
+    def _intFlag(self, flag):
+        token = self.flags.get(flag)
+        if not token:
+            return None
+        return int(token)
+
+    @property
+    def cas(self):
+        return self._intFlag(b'c')
+
+    @property
+    def clientFlags(self):
+        return self._intFlag(b'f')
+
+    @property
+    def ttl(self):
+        return self._intFlag(b't')
+
+
+class _ConnectingMixin(object):
+    """
+    The connection handling and command extensions shared by the protocols
+    built by L{MemCacheClientFactory}.
+
+    @cvar _baseProtocol: The memcached protocol class this is mixed into.
+    @ivar responded: A C{Deferred} which fires with this protocol when the
+    server first sends a response, then C{None}.
+    """
+
+    _baseProtocol = None
 
-class ConnectingMemCacheProtocol(MemCacheProtocol):
     def __init__(self, factory, reactor, **kw):
-        MemCacheProtocol.__init__(self, **kw)
+        self._baseProtocol.__init__(self, **kw)
         self.factory = factory
         self.reactor = reactor
         self.deferred = Deferred()
+        self.responded = Deferred()
+        self._draining = False
+        self._batch = None
 
     def callLater(self, *a, **kw):
         return self.reactor.callLater(*a, **kw)
@@ -17,9 +108,231 @@ class ConnectingMemCacheProtocol(MemCacheProtocol):
         self.transport.abortConnection()
 
     def connectionLost(self, reason):
-        MemCacheProtocol.connectionLost(self, reason)
+        self._baseProtocol.connectionLost(self, reason)
         self.deferred.errback(reason)
 
+    def sendLine(self, line):
+        if self._batch is None:
+            return self._baseProtocol.sendLine(self, line)
+        if not self._current:
+            self.setTimeout(self.persistentTimeOut)
+        self._batch.append(line)
+
+    def startBatch(self):
+        """
+        Buffer the commands sent until L{endBatch} is called, so that they're
+        written to the transport all at once.
+        """
+        self._batch = []
+
+    def endBatch(self):
+        """
+        Write every command buffered since L{startBatch} with a single write.
+        """
+        batch, self._batch = self._batch, None
+        if batch:
+            self.transport.write(
+                self.delimiter.join(batch) + self.delimiter)
+
+    def drain(self):
+        """
+        Close the connection once every outstanding command has been answered.
+        """
+        self._draining = True
+        if not self._current:
+            self.transport.loseConnection()
+
+    def lineReceived(self, line):
+        if self.responded is not None:
+            responded, self.responded = self.responded, None
+            responded.callback(self)
+        self._baseProtocol.lineReceived(self, line)
+        self._checkDrained()
+
+    def _checkDrained(self):
+        if self._draining and not self._current:
+            self.transport.loseConnection()
+
+    def _meta(self, cmd, key, flags, value=None):
+        failed = self._checkKey(key)
+        if failed is not None:
+            return failed
+        parts = [cmd, key]
+        if value is not None:
+            if not isinstance(value, bytes):
+                return fail(ClientError(
+                    "Invalid type for value: %s, expecting bytes"
+                    % (type(value),)))
+            parts.append(b'%d' % (len(value),))
+        self.sendLine(b' '.join(parts + list(flags)))
+        if value is not None:
+            self.sendLine(value)
+        return self._newCommand(cmd, key=key, multiple=False)._deferred
+
+    def metaGet(self, key, flags=(b'v',)):
+        """
+        Issue a meta get (C{mg}) command.
+
+        @param flags: The C{bytes} flag tokens to send, such as C{v}, C{c},
+        C{N30} or C{R10}.
+
+        @return: A C{Deferred} which fires with a L{MetaResult}.
+        """
+        return self._meta(b'mg', key, flags)
+
+    def metaSet(self, key, value, flags=()):
+        """
+        Issue a meta set (C{ms}) command.
+
+        @return: A C{Deferred} which fires with a L{MetaResult}.
+        """
+        return self._meta(b'ms', key, flags, value)
+
+    def metaDelete(self, key, flags=()):
+        """
+        Issue a meta delete (C{md}) command.
+
+        @return: A C{Deferred} which fires with a L{MetaResult}.
+        """
+        return self._meta(b'md', key, flags)
+
+    def _metaResponse(self, status, flags):
+        self._current.popleft().success(
+            MetaResult(status, _parseMetaFlags(flags)))
+
+    def cmd_HD(self, flags=b''):
+        self._metaResponse(b'HD', flags)
+
+    def cmd_EN(self, flags=b''):
+        self._metaResponse(b'EN', flags)
+
+    def cmd_NS(self, flags=b''):
+        self._metaResponse(b'NS', flags)
+
+    def cmd_EX(self, flags=b''):
+        self._metaResponse(b'EX', flags)
+
+    def cmd_NF(self, flags=b''):
+        self._metaResponse(b'NF', flags)
+
+    def cmd_VA(self, line):
+        """
+        Prepare reading the value of a meta get.
+        """
+        size, _, flags = line.partition(b' ')
+        cmd = self._current[0]
+        cmd.flags = _parseMetaFlags(flags)
+        self._lenExpected = int(size)
+        self._getBuffer = []
+        self._bufferLength = 0
+        self.setRawMode()
+
+    def rawDataReceived(self, data):
+        if self._current[0].command != b'mg':
+            return self._baseProtocol.rawDataReceived(self, data)
+        # Unlike a get, a meta get is complete as soon as its value has been
+        # read, as there is no END line.
+        self.resetTimeout()
+        self._getBuffer.append(data)
+        self._bufferLength += len(data)
+        if self._bufferLength >= self._lenExpected + 2:
+            data = b''.join(self._getBuffer)
+            value = data[:self._lenExpected]
+            rem = data[self._lenExpected + 2:]
+            self._lenExpected = None
+            self._getBuffer = None
+            self._bufferLength = None
+            cmd = self._current.popleft()
+            cmd.success(MetaResult(b'VA', cmd.flags, value))
+            if not self._current:
+                self.setTimeout(None)
+            self._checkDrained()
+            self.setLineMode(rem)
+
+    def _checkKey(self, key):
+        if self._disconnected:
+            return fail(RuntimeError("not connected"))
+        if not isinstance(key, bytes):
+            return fail(ClientError(
+                "Invalid type for key: %s, expecting bytes" % (type(key),)))
+        if len(key) > self.MAX_KEY_LENGTH:
+            return fail(ClientError("Key too long"))
+        return None
+
+    def touch(self, key, expireTime):
+        """
+        Update the expiration time of an existing C{key} without fetching it.
+
+        @return: A C{Deferred} which fires with C{True} if the key exists, or
+        C{False} otherwise.
+        """
+        failed = self._checkKey(key)
+        if failed is not None:
+            return failed
+        self.sendLine(b'touch ' + key + b' %d' % (expireTime,))
+        return self._newCommand(b'touch', key=key)._deferred
+
+    def cmd_TOUCHED(self):
+        """
+        A touch command has completed successfully.
+        """
+        self._current.popleft().success(True)
+
+    def getAndTouch(self, key, expireTime, withIdentifier=False):
+        """
+        Get the given C{key} and update its expiration time, like C{get}.
+        """
+        return self._getAndTouch([key], expireTime, withIdentifier, False)
+
+    def getAndTouchMultiple(self, keys, expireTime, withIdentifier=False):
+        """
+        Get the given list of C{keys} and update their expiration times, like
+        C{getMultiple}.
+        """
+        return self._getAndTouch(keys, expireTime, withIdentifier, True)
+
+    def _getAndTouch(self, keys, expireTime, withIdentifier, multiple):
+        keys = list(keys)
+        for key in keys:
+            failed = self._checkKey(key)
+            if failed is not None:
+                return failed
+        if withIdentifier:
+            cmd, responseCmd = b'gats', b'gets'
+        else:
+            cmd, responseCmd = b'gat', b'get'
+        self.sendLine(b' '.join([cmd, b'%d' % (expireTime,)] + keys))
+        # The responses to gat and gats are the same as the responses to get
+        # and gets, so the commands are recorded as such.
+        if multiple:
+            values = dict((key, (0, b'', None)) for key in keys)
+            cmdObj = self._newCommand(
+                responseCmd, keys=keys, values=values, multiple=True)
+        else:
+            cmdObj = self._newCommand(
+                responseCmd, key=keys[0], value=None, flags=0, cas=b'',
+                multiple=False)
+        return cmdObj._deferred
+
+
+class ConnectingMemCacheProtocol(_ConnectingMixin, MemCacheProtocol):
+    _baseProtocol = MemCacheProtocol
+
+    def _newCommand(self, command, **kw):
+        cmdObj = Command(command, **kw)
+        self._current.append(cmdObj)
+        return cmdObj
+
+
+class SlottedConnectingMemCacheProtocol(
+        _ConnectingMixin, txyamProtocol.MemCacheProtocol):
+    """
+    A L{ConnectingMemCacheProtocol} built on L{txyam.protocol}, which
+    allocates less for each command.
+    """
+
+    _baseProtocol = txyamProtocol.MemCacheProtocol
+
 
 class MemCacheClientFactory(Factory):
     protocol = ConnectingMemCacheProtocol
@@ -30,3 +343,7 @@ class MemCacheClientFactory(Factory):
 
     def buildProtocol(self, addr):
         return self.protocol(self, *self._protocolArgs, **self._protocolKwargs)
+
+
+class SlottedMemCacheClientFactory(MemCacheClientFactory):
+    protocol = SlottedConnectingMemCacheProtocol
@@ -0,0 +1,76 @@
+import hashlib
+import re
+
+
+MAX_KEY_LENGTH = 250
+
+# memcached's text protocol can't carry keys containing whitespace or control
+# characters.
+_unsafe = re.compile(b'[\x00-\x20\x7f]')
+
+
+def keyToBytes(key):
+    """
+    Encode a text key to UTF-8, leaving C{bytes} keys as they are.
+    """
+    if isinstance(key, bytes):
+        return key
+    return key.encode('utf-8')
+
+
+class KeyCollision(Exception):
+    """
+    Two different keys were digested into the same key.
+    """
+
+
+class KeyEncoder(object):
+    """
+    Turns application keys into keys memcached will accept.
+
+    Keys are prefixed with C{prefix}. Text keys are encoded to UTF-8. Keys
+    which would be longer than C{maxLength} bytes or contain whitespace or
+    control characters are replaced with the prefix followed by a fixed-size
+    hex digest of the key.
+
+    Encoded keys are cached for up to C{cacheSize} distinct keys. Digests are
+    checked for collisions against the keys in the cache.
+    """
+
+    def __init__(self, prefix=b'', maxLength=MAX_KEY_LENGTH, cacheSize=10000,
+                 hashFunction=hashlib.sha1):
+        self.prefix = prefix
+        self.maxLength = maxLength
+        self.cacheSize = cacheSize
+        self.hashFunction = hashFunction
+        self._cache = {}
+        self._digested = {}
+        if len(self._digest(b'')) > maxLength:
+            raise ValueError('prefix too long for a digested key')
+
+    def _digest(self, key):
+        digest = self.hashFunction(key).hexdigest().encode('ascii')
+        return self.prefix + b'#' + digest
+
+    def encode(self, key):
+        """
+        Encode C{key} into a key suitable for memcached.
+        """
+        encoded = self._cache.get(key)
+        if encoded is not None:
+            return encoded
+
+        if len(self._cache) >= self.cacheSize:
+            self._cache.clear()
+            self._digested.clear()
+        raw = keyToBytes(key)
+        full = self.prefix + raw
+        if len(full) > self.maxLength or _unsafe.search(full):
+            encoded = self._digest(raw)
+            other = self._digested.setdefault(encoded, raw)
+            if other != raw:
+                raise KeyCollision(raw, other)
+        else:
+            encoded = full
+        self._cache[key] = encoded
+        return encoded
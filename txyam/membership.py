@@ -0,0 +1,142 @@
+"""
+Sources of the set of memcached hosts a C{YamClient} should use.
+
+A source is started with a callable which it calls with the new list of host
+endpoint descriptions every time the membership changes. Use
+C{YamClient.followMembership} to apply the changes to a client.
+"""
+
+from twisted.internet import task
+from twisted.names import client as namesClient
+from twisted.python import log
+
+
+class MembershipSource(object):
+    """
+    The base class of membership sources.
+
+    @ivar hosts: The most recently reported list of hosts, or C{None}.
+    """
+
+    hosts = None
+
+    def __init__(self):
+        self._onChange = None
+
+    def start(self, onChange):
+        self._onChange = onChange
+        if self.hosts is not None:
+            onChange(list(self.hosts))
+
+    def stop(self):
+        self._onChange = None
+
+    def _changed(self, hosts):
+        hosts = list(hosts)
+        if self.hosts is not None and set(hosts) == set(self.hosts):
+            return
+        self.hosts = hosts
+        if self._onChange is not None:
+            self._onChange(list(hosts))
+
+
+class CallbackMembership(MembershipSource):
+    """
+    A membership source which is updated by calling L{setHosts}, for example
+    from an application's own service discovery callbacks.
+    """
+
+    def __init__(self, hosts=None):
+        MembershipSource.__init__(self)
+        if hosts is not None:
+            self.hosts = list(hosts)
+
+    def setHosts(self, hosts):
+        self._changed(hosts)
+
+
+class _PollingMembership(MembershipSource):
+    def __init__(self, reactor, interval):
+        MembershipSource.__init__(self)
+        self.reactor = reactor
+        self.interval = interval
+        self._loop = None
+
+    def start(self, onChange):
+        MembershipSource.start(self, onChange)
+        self._loop = task.LoopingCall(self.poll)
+        self._loop.clock = self.reactor
+        self._loop.start(self.interval, now=True).addErrback(
+            log.err, 'membership polling failed', system='txyam')
+
+    def stop(self):
+        MembershipSource.stop(self)
+        if self._loop is not None and self._loop.running:
+            self._loop.stop()
+        self._loop = None
+
+
+class FileMembership(_PollingMembership):
+    """
+    A membership source which watches a file containing one host endpoint
+    description per line. Blank lines and lines starting with C{#} are
+    ignored.
+
+    If the file can't be read or lists no hosts, the previous membership is
+    kept.
+    """
+
+    def __init__(self, reactor, path, interval=5):
+        _PollingMembership.__init__(self, reactor, interval)
+        self.path = path
+
+    def poll(self):
+        try:
+            with open(self.path) as f:
+                lines = f.read().splitlines()
+        except (IOError, OSError):
+            log.err(None, 'reading %r failed' % (self.path,), system='txyam')
+            return
+        hosts = [
+            line.strip() for line in lines
+            if line.strip() and not line.strip().startswith('#')]
+        if not hosts:
+            # Probably read halfway through being rewritten.
+            log.msg('%r lists no hosts; keeping the previous membership'
+                    % (self.path,), system='txyam')
+            return
+        self._changed(hosts)
+
+
+class SRVMembership(_PollingMembership):
+    """
+    A membership source which periodically resolves a DNS SRV record, such as
+    C{_memcache._tcp.example.com}, into TCP endpoint descriptions.
+
+    If the lookup fails, the previous membership is kept.
+    """
+
+    def __init__(self, reactor, name, interval=60, resolver=None):
+        _PollingMembership.__init__(self, reactor, interval)
+        self.name = name
+        if resolver is None:
+            resolver = namesClient
+        self.resolver = resolver
+
+    def poll(self):
+        d = self.resolver.lookupService(self.name)
+        d.addCallback(self._gotRecords)
+        d.addErrback(
+            log.err, 'resolving %r failed' % (self.name,), system='txyam')
+        return d
+
+    def _gotRecords(self, result):
+        answers, authority, additional = result
+        hosts = set()
+        for record in answers:
+            payload = record.payload
+            if getattr(payload, 'target', None) is None:
+                continue
+            hosts.add('tcp:host=%s:port=%d' % (payload.target, payload.port))
+        if hosts:
+            self._changed(sorted(hosts))
@@ -0,0 +1,205 @@
+from twisted.internet import defer
+
+from txyam.keys import keyToBytes
+
+
+def _wrap(cmd):
+    """
+    Used to wrap the single-key memcache methods (set,delete,etc) so that they
+    operate on the namespaced key.
+    """
+    def wrapper(self, key, *args, **kwargs):
+        d = self._currentGeneration()
+        d.addCallback(lambda generation: getattr(self.client, cmd)(
+            self._key(generation, key), *args, **kwargs))
+        return d
+    return wrapper
+
+
+class Namespace(object):
+    """
+    A group of keys which can all be invalidated at once.
+
+    Every key in the namespace is prefixed with the namespace's current
+    generation, which is stored in memcached under its own key. Invalidating
+    the namespace increments the generation, so every key stored under the
+    previous generation simply stops being read and is left to expire.
+
+    The generation is cached in-process for C{cacheTime} seconds. Once the
+    cached generation is stale, it is refetched in the same C{getMultiple}
+    batch as the data keys, which are only used if the generation didn't
+    change in the meantime.
+    """
+
+    def __init__(self, client, name, cacheTime=1):
+        self.client = client
+        self.name = name
+        self.cacheTime = cacheTime
+        self._generationKey = b'ns:' + name
+        self._generation = None
+        self._fetchedAt = None
+
+    def _now(self):
+        return self.client.reactor.seconds()
+
+    def _cacheGeneration(self, generation):
+        self._generation = generation
+        self._fetchedAt = self._now()
+        return generation
+
+    def _generationIsFresh(self):
+        return (self._generation is not None
+                and self._now() - self._fetchedAt < self.cacheTime)
+
+    def _key(self, generation, key):
+        return b'%s:%s:%s' % (self.name, generation, keyToBytes(key))
+
+    def _currentGeneration(self):
+        if self._generationIsFresh():
+            return defer.succeed(self._generation)
+        return self._fetchGeneration()
+
+    def _fetchGeneration(self):
+        d = self.client.get(self._generationKey)
+        d.addCallback(self._gotGeneration)
+        return d
+
+    def _gotGeneration(self, result):
+        if result is None or result[1] is None:
+            return self._initGeneration()
+        return self._cacheGeneration(result[1])
+
+    def _initGeneration(self):
+        # Start from the current time so that a generation counter which was
+        # evicted doesn't come back as a generation that was used before.
+        generation = b'%d' % (int(self._now() * 1000),)
+
+        def added(stored):
+            if stored is False:
+                # Someone else initialized it first.
+                d = self.client.get(self._generationKey)
+                d.addCallback(lambda result: self._cacheGeneration(
+                    result[1] if result and result[1] else generation))
+                return d
+            return self._cacheGeneration(generation)
+
+        d = self.client.add(self._generationKey, generation)
+        d.addCallback(added)
+        return d
+
+    def invalidate(self):
+        """
+        Invalidate every key in the namespace with a single increment.
+
+        @return: A C{Deferred} which fires with the new generation.
+        """
+        def incremented(result):
+            if not result:
+                return self._initGeneration()
+            return self._cacheGeneration(b'%d' % (result,))
+
+        d = self.client.increment(self._generationKey)
+        d.addCallback(incremented)
+        return d
+
+    def getMultiple(self, keys, withIdentifier=False):
+        """
+        Get the given C{keys} from the namespace.
+
+        @return: A C{Deferred} which fires with the same C{dict} that
+        C{YamClient.getMultiple} would, keyed by the unprefixed keys.
+        """
+        keys = list(keys)
+        if self._generation is None:
+            d = self._fetchGeneration()
+            d.addCallback(self._getWithGeneration, keys, withIdentifier)
+            return d
+        if self._generationIsFresh():
+            return self._getWithGeneration(
+                self._generation, keys, withIdentifier)
+
+        generation = self._generation
+        mapping = dict((self._key(generation, key), key) for key in keys)
+        d = self.client.getMultiple(
+            list(mapping) + [self._generationKey], withIdentifier)
+        d.addCallback(self._gotSpeculative, generation, mapping,
+                      withIdentifier)
+        return d
+
+    def _gotSpeculative(self, results, generation, mapping, withIdentifier):
+        current = results.pop(self._generationKey, None)
+        if current is None or current[-1] is None:
+            d = self._initGeneration()
+        elif current[-1] != generation:
+            d = defer.succeed(self._cacheGeneration(current[-1]))
+        else:
+            self._cacheGeneration(generation)
+            return self._unprefix(results, mapping)
+        d.addCallback(self._getWithGeneration, list(mapping.values()),
+                      withIdentifier)
+        return d
+
+    def _getWithGeneration(self, generation, keys, withIdentifier):
+        mapping = dict((self._key(generation, key), key) for key in keys)
+        d = self.client.getMultiple(list(mapping), withIdentifier)
+        d.addCallback(self._unprefix, mapping)
+        return d
+
+    def _unprefix(self, results, mapping):
+        return dict(
+            (mapping[key], value) for key, value in results.items()
+            if key in mapping)
+
+    def get(self, key, withIdentifier=False):
+        """
+        Get the given C{key} from the namespace.
+
+        @return: A C{Deferred} which fires with the same value that
+        C{YamClient.get} would.
+        """
+        d = self.getMultiple([key], withIdentifier)
+        d.addCallback(lambda results: results.get(key))
+        return d
+
+    def setMultiple(self, items, flags=0, expireTime=0):
+        """
+        Set every key in the C{items} C{dict} in the namespace.
+        """
+        def gotGeneration(generation):
+            mapping = {}
+            prefixed = {}
+            for key, value in items.items():
+                prefixedKey = self._key(generation, key)
+                mapping[prefixedKey] = key
+                prefixed[prefixedKey] = value
+            d = self.client.setMultiple(prefixed, flags, expireTime)
+            d.addCallback(self._unprefix, mapping)
+            return d
+
+        d = self._currentGeneration()
+        d.addCallback(gotGeneration)
+        return d
+
+    def deleteMultiple(self, keys):
+        """
+        Delete the given C{keys} from the namespace.
+        """
+        def gotGeneration(generation):
+            mapping = dict((self._key(generation, key), key) for key in keys)
+            d = self.client.deleteMultiple(list(mapping))
+            d.addCallback(self._unprefix, mapping)
+            return d
+
+        d = self._currentGeneration()
+        d.addCallback(gotGeneration)
+        return d
+
+    set = _wrap('set')
+    increment = _wrap('increment')
+    decrement = _wrap('decrement')
+    replace = _wrap('replace')
+    add = _wrap('add')
+    checkAndSet = _wrap('checkAndSet')
+    append = _wrap('append')
+    prepend = _wrap('prepend')
+    delete = _wrap('delete')
@@ -0,0 +1,128 @@
+from collections import defaultdict
+
+from txyam.utils import aggregate
+
+
+# The commands which are also sent to a key's previous owner while hosts are
+# being migrated; see YamClient.setHosts.
+_MIRRORED = frozenset([
+    'set', 'add', 'replace', 'append', 'prepend', 'delete', 'increment',
+    'decrement', 'touch',
+])
+
+
+def _queue(cmd):
+    """
+    Used to make the methods which queue an operation (get,set,delete,etc).
+    """
+    def method(self, key, *args, **kwargs):
+        self._operations.append((cmd, key, args, kwargs))
+        return self
+    return method
+
+
+class Pipeline(object):
+    """
+    Queues many operations on different keys and sends them all at once.
+
+    Every queueing method returns the pipeline, so calls can be chained. When
+    L{execute} is called, the operations are grouped by host and each host's
+    commands are sent with a single write, with consecutive gets coalesced
+    into one multi-key get. The order of operations on each host is kept.
+
+    Unlike C{YamClient.get}, gets in a pipeline don't fall back to a key's
+    previous owner during a host migration.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self._operations = []
+
+    def __len__(self):
+        return len(self._operations)
+
+    def execute(self):
+        """
+        Send every queued operation and empty the queue.
+
+        @return: A C{Deferred} which fires with a C{list} holding the result
+        of each operation, in the order they were queued. Each result is the
+        same as the corresponding C{YamClient} method's would be.
+        """
+        operations, self._operations = self._operations, []
+        results = [None] * len(operations)
+        client = self.client
+        byHost = defaultdict(list)
+        for index, (cmd, key, args, kwargs) in enumerate(operations):
+            key = client._encodeKey(key)
+            proto = client.getClient(key)
+            if proto is None:
+                continue
+            byHost[proto].append((index, cmd, key, args, kwargs))
+            if cmd in _MIRRORED:
+                previous = client._previousClient(key, proto)
+                if previous is not None:
+                    byHost[previous].append((None, cmd, key, args, kwargs))
+
+        ds = []
+        for proto, hostOperations in byHost.items():
+            proto.startBatch()
+            try:
+                self._send(proto, hostOperations, results, ds)
+            finally:
+                proto.endBatch()
+
+        d = aggregate(ds)
+        d.addCallback(lambda ign: results)
+        return d
+
+    def _send(self, proto, operations, results, ds):
+        gets = []
+        getsWithIdentifier = None
+        for index, cmd, key, args, kwargs in operations:
+            if cmd == 'get':
+                withIdentifier = bool(
+                    kwargs.get('withIdentifier', args[0] if args else False))
+                if gets and withIdentifier != getsWithIdentifier:
+                    self._sendGets(proto, gets, getsWithIdentifier, results,
+                                   ds)
+                    gets = []
+                gets.append((index, key))
+                getsWithIdentifier = withIdentifier
+                continue
+            if gets:
+                self._sendGets(proto, gets, getsWithIdentifier, results, ds)
+                gets = []
+            d = getattr(proto, cmd)(key, *args, **kwargs)
+            if index is None:
+                d.addErrback(lambda ign: None)
+                continue
+            d.addCallback(self._store, results, index)
+            ds.append(d)
+        if gets:
+            self._sendGets(proto, gets, getsWithIdentifier, results, ds)
+
+    def _sendGets(self, proto, gets, withIdentifier, results, ds):
+        d = proto.getMultiple([key for index, key in gets], withIdentifier)
+        d.addCallback(self._storeGets, results, gets)
+        ds.append(d)
+
+    def _store(self, result, results, index):
+        results[index] = result
+
+    def _storeGets(self, values, results, gets):
+        for index, key in gets:
+            results[index] = values.get(key)
+
+    get = _queue('get')
+    getAndTouch = _queue('getAndTouch')
+    set = _queue('set')
+    add = _queue('add')
+    replace = _queue('replace')
+    checkAndSet = _queue('checkAndSet')
+    append = _queue('append')
+    prepend = _queue('prepend')
+    delete = _queue('delete')
+    increment = _queue('increment')
+    decrement = _queue('decrement')
+    touch = _queue('touch')
@@ -0,0 +1,362 @@
+"""
+A memcached text protocol client with a small per-command memory footprint.
+
+L{MemCacheProtocol} has the same API and results as
+C{twisted.protocols.memcache.MemCacheProtocol}, but records outstanding
+commands in L{CommandRecord} objects, which use C{__slots__} and can be
+reused once their command has completed.
+"""
+
+from collections import deque
+
+from twisted.internet.defer import Deferred, TimeoutError, fail
+from twisted.protocols.basic import LineReceiver
+from twisted.protocols.memcache import ClientError, NoSuchCommand, ServerError
+from twisted.protocols.policies import TimeoutMixin
+from twisted.python import log
+
+
+def _handlerName(token):
+    return 'cmd_' + token.decode('ascii', 'replace')
+
+
+class _CommandPool(list):
+    __slots__ = ('size',)
+
+
+class CommandRecord(object):
+    """
+    An outstanding command, waiting for the server's response.
+    """
+
+    __slots__ = (
+        'command', '_deferred', 'key', 'keys', 'values', 'value', 'flags',
+        'cas', 'multiple', 'currentKey', 'length', '_pool',
+    )
+
+    def __init__(self):
+        self._pool = None
+        self._reset()
+
+    def _reset(self):
+        self.command = None
+        self._deferred = None
+        self.key = None
+        self.keys = None
+        self.values = None
+        self.value = None
+        self.flags = 0
+        self.cas = b''
+        self.multiple = False
+        self.currentKey = None
+        self.length = None
+
+    def _release(self):
+        d = self._deferred
+        pool = self._pool
+        if pool is not None and len(pool) < pool.size:
+            self._reset()
+            pool.append(self)
+        return d
+
+    def success(self, value):
+        self._release().callback(value)
+
+    def fail(self, error):
+        self._release().errback(error)
+
+
+class MemCacheProtocol(LineReceiver, TimeoutMixin):
+    """
+    Memcached text protocol client.
+
+    @ivar reuseCommands: Whether completed L{CommandRecord}s are kept for
+    reuse by later commands. Up to C{poolSize} idle records are kept.
+    """
+
+    MAX_KEY_LENGTH = 250
+    _disconnected = False
+
+    def __init__(self, timeOut=60, reuseCommands=True, poolSize=64):
+        self._current = deque()
+        self._lenExpected = None
+        self._getBuffer = None
+        self._bufferLength = None
+        self.persistentTimeOut = self.timeOut = timeOut
+        self.reuseCommands = reuseCommands
+        self._pool = _CommandPool()
+        self._pool.size = poolSize
+
+    def _newCommand(self, command, key=None, keys=None, values=None,
+                    value=None, flags=0, cas=b'', multiple=False,
+                    length=None):
+        pool = self._pool
+        if pool:
+            cmd = pool.pop()
+        else:
+            cmd = CommandRecord()
+        if self.reuseCommands:
+            cmd._pool = pool
+        else:
+            cmd._pool = None
+        cmd.command = command
+        cmd._deferred = Deferred()
+        cmd.key = key
+        cmd.keys = keys
+        cmd.values = values
+        cmd.value = value
+        cmd.flags = flags
+        cmd.cas = cas
+        cmd.multiple = multiple
+        cmd.length = length
+        self._current.append(cmd)
+        return cmd
+
+    def _checkKeys(self, keys):
+        if self._disconnected:
+            return fail(RuntimeError("not connected"))
+        for key in keys:
+            if not isinstance(key, bytes):
+                return fail(ClientError(
+                    "Invalid type for key: %s, expecting bytes"
+                    % (type(key),)))
+            if len(key) > self.MAX_KEY_LENGTH:
+                return fail(ClientError("Key too long"))
+        return None
+
+    def _cancelCommands(self, reason):
+        while self._current:
+            self._current.popleft().fail(reason)
+
+    def timeoutConnection(self):
+        self._cancelCommands(TimeoutError("Connection timeout"))
+        self.transport.loseConnection()
+
+    def connectionLost(self, reason):
+        self._disconnected = True
+        self._cancelCommands(reason)
+        LineReceiver.connectionLost(self, reason)
+
+    def sendLine(self, line):
+        if not self._current:
+            self.setTimeout(self.persistentTimeOut)
+        LineReceiver.sendLine(self, line)
+
+    def rawDataReceived(self, data):
+        self.resetTimeout()
+        self._getBuffer.append(data)
+        self._bufferLength += len(data)
+        if self._bufferLength >= self._lenExpected + 2:
+            data = b''.join(self._getBuffer)
+            val = data[:self._lenExpected]
+            rem = data[self._lenExpected + 2:]
+            self._lenExpected = None
+            self._getBuffer = None
+            self._bufferLength = None
+            cmd = self._current[0]
+            if cmd.multiple:
+                flags, cas = cmd.values[cmd.currentKey]
+                cmd.values[cmd.currentKey] = (flags, cas, val)
+            else:
+                cmd.value = val
+            self.setLineMode(rem)
+
+    def cmd_STORED(self):
+        self._current.popleft().success(True)
+
+    def cmd_NOT_STORED(self):
+        self._current.popleft().success(False)
+
+    def cmd_END(self):
+        cmd = self._current.popleft()
+        if cmd.command == b'get':
+            if cmd.multiple:
+                values = dict(
+                    (key, val[::2]) for key, val in cmd.values.items())
+                cmd.success(values)
+            else:
+                cmd.success((cmd.flags, cmd.value))
+        elif cmd.command == b'gets':
+            if cmd.multiple:
+                cmd.success(cmd.values)
+            else:
+                cmd.success((cmd.flags, cmd.cas, cmd.value))
+        elif cmd.command == b'stats':
+            cmd.success(cmd.values)
+        else:
+            raise RuntimeError(
+                "Unexpected END response to %r command" % (cmd.command,))
+
+    def cmd_NOT_FOUND(self):
+        self._current.popleft().success(False)
+
+    def cmd_VALUE(self, line):
+        cmd = self._current[0]
+        if cmd.command == b'get':
+            key, flags, length = line.split()
+            cas = b''
+        else:
+            key, flags, length, cas = line.split()
+        self._lenExpected = int(length)
+        self._getBuffer = []
+        self._bufferLength = 0
+        if cmd.multiple:
+            if key not in cmd.values:
+                raise RuntimeError("Unexpected commands answer.")
+            cmd.currentKey = key
+            cmd.values[key] = [int(flags), cas]
+        else:
+            if cmd.key != key:
+                raise RuntimeError("Unexpected commands answer.")
+            cmd.flags = int(flags)
+            cmd.cas = cas
+        self.setRawMode()
+
+    def cmd_STAT(self, line):
+        key, val = line.split(b' ', 1)
+        self._current[0].values[key] = val
+
+    def cmd_VERSION(self, versionData):
+        self._current.popleft().success(versionData)
+
+    def cmd_ERROR(self):
+        log.err("Non-existent command sent.")
+        self._current.popleft().fail(NoSuchCommand())
+
+    def cmd_CLIENT_ERROR(self, errText):
+        errText = repr(errText)
+        log.err("Invalid input: " + errText)
+        self._current.popleft().fail(ClientError(errText))
+
+    def cmd_SERVER_ERROR(self, errText):
+        errText = repr(errText)
+        log.err("Server error: " + errText)
+        self._current.popleft().fail(ServerError(errText))
+
+    def cmd_DELETED(self):
+        self._current.popleft().success(True)
+
+    def cmd_OK(self):
+        self._current.popleft().success(True)
+
+    def cmd_EXISTS(self):
+        self._current.popleft().success(False)
+
+    def lineReceived(self, line):
+        self.resetTimeout()
+        token, _, args = line.partition(b' ')
+        handler = getattr(self, _handlerName(token), None)
+        if handler is not None:
+            if args:
+                handler(args)
+            else:
+                handler()
+        else:
+            handler = getattr(
+                self, _handlerName(line.replace(b' ', b'_')), None)
+            if handler is not None:
+                handler()
+            else:
+                # Increment/decrement response
+                self._current.popleft().success(int(line))
+        if not self._current:
+            self.setTimeout(None)
+
+    def increment(self, key, val=1):
+        return self._incrdecr(b'incr', key, val)
+
+    def decrement(self, key, val=1):
+        return self._incrdecr(b'decr', key, val)
+
+    def _incrdecr(self, cmd, key, val):
+        failed = self._checkKeys([key])
+        if failed is not None:
+            return failed
+        self.sendLine(b' '.join([cmd, key, b'%d' % (int(val),)]))
+        return self._newCommand(cmd, key=key)._deferred
+
+    def replace(self, key, val, flags=0, expireTime=0):
+        return self._set(b'replace', key, val, flags, expireTime, b'')
+
+    def add(self, key, val, flags=0, expireTime=0):
+        return self._set(b'add', key, val, flags, expireTime, b'')
+
+    def set(self, key, val, flags=0, expireTime=0):
+        return self._set(b'set', key, val, flags, expireTime, b'')
+
+    def checkAndSet(self, key, val, cas, flags=0, expireTime=0):
+        return self._set(b'cas', key, val, flags, expireTime, cas)
+
+    def append(self, key, val):
+        return self._set(b'append', key, val, 0, 0, b'')
+
+    def prepend(self, key, val):
+        return self._set(b'prepend', key, val, 0, 0, b'')
+
+    def _set(self, cmd, key, val, flags, expireTime, cas):
+        failed = self._checkKeys([key])
+        if failed is not None:
+            return failed
+        if not isinstance(val, bytes):
+            return fail(ClientError(
+                "Invalid type for value: %s, expecting bytes" % (type(val),)))
+        length = len(val)
+        fullcmd = b'%s %s %d %d %d' % (cmd, key, flags, expireTime, length)
+        if cas:
+            fullcmd += b' ' + cas
+        self.sendLine(fullcmd)
+        self.sendLine(val)
+        return self._newCommand(
+            cmd, key=key, flags=flags, length=length)._deferred
+
+    def get(self, key, withIdentifier=False):
+        return self._get([key], withIdentifier, False)
+
+    def getMultiple(self, keys, withIdentifier=False):
+        return self._get(keys, withIdentifier, True)
+
+    def _get(self, keys, withIdentifier, multiple):
+        keys = list(keys)
+        failed = self._checkKeys(keys)
+        if failed is not None:
+            return failed
+        if withIdentifier:
+            cmd = b'gets'
+        else:
+            cmd = b'get'
+        self.sendLine(b' '.join([cmd] + keys))
+        if multiple:
+            values = dict((key, (0, b'', None)) for key in keys)
+            cmdObj = self._newCommand(
+                cmd, keys=keys, values=values, multiple=True)
+        else:
+            cmdObj = self._newCommand(cmd, key=keys[0])
+        return cmdObj._deferred
+
+    def stats(self, arg=None):
+        if self._disconnected:
+            return fail(RuntimeError("not connected"))
+        if arg:
+            self.sendLine(b'stats ' + arg)
+        else:
+            self.sendLine(b'stats')
+        return self._newCommand(b'stats', values={})._deferred
+
+    def version(self):
+        if self._disconnected:
+            return fail(RuntimeError("not connected"))
+        self.sendLine(b'version')
+        return self._newCommand(b'version')._deferred
+
+    def delete(self, key):
+        failed = self._checkKeys([key])
+        if failed is not None:
+            return failed
+        self.sendLine(b'delete ' + key)
+        return self._newCommand(b'delete', key=key)._deferred
+
+    def flushAll(self):
+        if self._disconnected:
+            return fail(RuntimeError("not connected"))
+        self.sendLine(b'flush_all')
+        return self._newCommand(b'flush_all')._deferred
@@ -0,0 +1,393 @@
+"""
+Routing keys to separate memcached clusters.
+
+A L{Router} maps key prefixes or regular expressions to named pools, each a
+C{YamClient} with its own hosts, consistent hash ring, timeouts and codec,
+and exposes the usual commands across all of them.
+"""
+
+from twisted.internet import defer
+from twisted.python.failure import Failure
+
+from txyam.client import YamClient, iteritems
+from txyam.utils import aggregate, deferredDict
+
+
+class NoRoute(LookupError):
+    """
+    No route matched a key and the router has no default pool.
+    """
+
+
+class PoolMetrics(object):
+    """
+    Counters for the commands a L{Router} sent to one pool.
+
+    C{YamClient} turns most errors into C{None} results, so commands which
+    fired with C{None} count as failures rather than misses. Each key of a
+    multiple key write whose result is C{None} counts as a failed command,
+    while a multiple key fetch some of whose hosts didn't answer counts as one.
+
+    @ivar requests: The number of commands.
+    @ivar keys: The number of keys the commands were for.
+    @ivar hits: The number of keys fetched which were found.
+    @ivar misses: The number of keys fetched which weren't found.
+    @ivar failures: The number of commands which failed.
+    @ivar totalTime: The total number of seconds the commands took.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.requests = 0
+        self.keys = 0
+        self.hits = 0
+        self.misses = 0
+        self.failures = 0
+        self.totalTime = 0.0
+
+    def __repr__(self):
+        return ('<PoolMetrics requests=%d keys=%d hits=%d misses=%d '
+                'failures=%d>' % (self.requests, self.keys, self.hits,
+                                  self.misses, self.failures))
+
+    @property
+    def hitRatio(self):
+        """
+        The fraction of keys fetched which were found, or C{None} if none were
+        fetched.
+        """
+        if self.hits + self.misses == 0:
+            return None
+        return self.hits / float(self.hits + self.misses)
+
+    @property
+    def averageTime(self):
+        """
+        The average number of seconds a command took, or C{None} if there
+        were none.
+        """
+        if not self.requests:
+            return None
+        return self.totalTime / self.requests
+
+
+def _countFailure(result, metrics):
+    if result is None:
+        metrics.failures += 1
+    return result
+
+
+def _countGetHit(result, metrics):
+    if result is None:
+        metrics.failures += 1
+    elif result[-1] is None:
+        metrics.misses += 1
+    else:
+        metrics.hits += 1
+    return result
+
+
+def _countFailures(results, metrics):
+    metrics.failures += sum(1 for value in results.values() if value is None)
+    return results
+
+
+def _countMultipleHits(results, metrics, count):
+    hits = sum(1 for value in results.values() if value[-1] is not None)
+    metrics.hits += hits
+    metrics.misses += len(results) - hits
+    if len(results) < count:
+        metrics.failures += 1
+    return results
+
+
+def _routed(cmd):
+    """
+    Used to wrap the single key commands of a pool's C{YamClient}.
+    """
+    def wrapper(self, key, *args, **kwargs):
+        return self._command(cmd, key, *args, **kwargs)
+    return wrapper
+
+
+class Router(object):
+    """
+    Routes each key to a named pool of memcached hosts.
+
+    Routes are tried in the order they were added. A route's pattern is
+    either a prefix, of the same type as the keys, or a compiled regular
+    expression which must match at the start of the key. Keys no route
+    matches go to the C{default} pool, if there is one.
+
+    @ivar pools: A C{dict} mapping pool names to their C{YamClient}.
+    @ivar metrics: A C{dict} mapping pool names to their L{PoolMetrics}.
+    """
+
+    # The number of keys whose pool is cached.
+    routeCacheSize = 10000
+
+    def __init__(self, reactor, pools, routes=(), default=None):
+        """
+        @param pools: A C{dict} mapping pool names to C{YamClient}s.
+        @param routes: A sequence of C{(pattern, poolName)} tuples.
+        @param default: The name of the pool for keys no route matches.
+        """
+        self.reactor = reactor
+        self.pools = {}
+        self.metrics = {}
+        self._routes = []
+        self._routeCache = {}
+        for name, client in iteritems(pools):
+            self.addPool(name, client)
+        for pattern, name in routes:
+            self.addRoute(pattern, name)
+        if default is not None and default not in self.pools:
+            raise ValueError('unknown pool %r' % (default,))
+        self.default = default
+
+    @classmethod
+    def fromConfig(cls, reactor, config, routes=(), default=None):
+        """
+        Create a router and its pools.
+
+        @param config: A C{dict} mapping pool names to C{dict}s of keyword
+        arguments for each pool's C{YamClient}, such as C{hosts}, C{timeOut}
+        or C{codec}.
+        """
+        pools = dict(
+            (name, YamClient(reactor, **kwargs))
+            for name, kwargs in iteritems(config))
+        return cls(reactor, pools, routes, default)
+
+    def addPool(self, name, client):
+        self.pools[name] = client
+        self.metrics[name] = PoolMetrics()
+
+    def addRoute(self, pattern, name):
+        """
+        Route keys matching C{pattern} to the pool C{name}, unless an earlier
+        route matches them.
+        """
+        if name not in self.pools:
+            raise ValueError('unknown pool %r' % (name,))
+        self._routes.append((pattern, name))
+        self._routeCache.clear()
+
+    def poolFor(self, key):
+        """
+        The name of the pool C{key} is routed to.
+
+        @raise NoRoute: If no route matches and there's no default pool.
+        """
+        name = self._routeCache.get(key)
+        if name is not None:
+            return name
+        for pattern, name in self._routes:
+            if hasattr(pattern, 'match'):
+                if pattern.match(key):
+                    break
+            elif key.startswith(pattern):
+                break
+        else:
+            name = self.default
+            if name is None:
+                raise NoRoute(key)
+        if len(self._routeCache) >= self.routeCacheSize:
+            self._routeCache.clear()
+        self._routeCache[key] = name
+        return name
+
+    def clientFor(self, key):
+        """
+        The C{YamClient} of the pool C{key} is routed to.
+        """
+        return self.pools[self.poolFor(key)]
+
+    def _groupByPool(self, keys):
+        groups = {}
+        for key in keys:
+            groups.setdefault(self.poolFor(key), []).append(key)
+        return groups
+
+    def _groupItemsByPool(self, items):
+        groups = {}
+        for key, value in iteritems(items):
+            groups.setdefault(self.poolFor(key), {})[key] = value
+        return groups
+
+    def _started(self, name, keyCount):
+        metrics = self.metrics[name]
+        metrics.requests += 1
+        metrics.keys += keyCount
+        return metrics
+
+    def _finished(self, result, metrics, start):
+        metrics.totalTime += self.reactor.seconds() - start
+        if isinstance(result, Failure):
+            metrics.failures += 1
+        return result
+
+    def _timed(self, d, metrics):
+        d.addBoth(self._finished, metrics, self.reactor.seconds())
+        return d
+
+    def _command(self, cmd, key, *args, **kwargs):
+        try:
+            name = self.poolFor(key)
+        except NoRoute:
+            return defer.fail()
+        metrics = self._started(name, 1)
+        d = getattr(self.pools[name], cmd)(key, *args, **kwargs)
+        d.addCallback(_countFailure, metrics)
+        return self._timed(d, metrics)
+
+    def _perPool(self, groups, call):
+        ds = []
+        for name, group in iteritems(groups):
+            metrics = self._started(name, len(group))
+            ds.append(self._timed(call(name, group, metrics), metrics))
+        return aggregate(ds)
+
+    def _merge(self, results):
+        merged = {}
+        for result in results:
+            if not isinstance(result, Failure):
+                merged.update(result)
+        return merged
+
+    def connect(self):
+        """
+        Connect every pool.
+
+        @return: A C{Deferred} which fires with this router once every pool's
+        connection attempts have completed.
+        """
+        d = aggregate([client.connect() for client in self.pools.values()])
+        d.addCallback(lambda ign: self)
+        return d
+
+    def disconnect(self):
+        for client in self.pools.values():
+            client.disconnect()
+
+    def stats(self, arg=None):
+        """
+        Get the stats of every host of every pool.
+
+        @return: A C{Deferred} which fires with a C{dict} mapping each pool's
+        name to the result of its C{stats}.
+        """
+        return deferredDict(dict(
+            (name, client.stats(arg))
+            for name, client in iteritems(self.pools)))
+
+    def get(self, key, withIdentifier=False):
+        try:
+            name = self.poolFor(key)
+        except NoRoute:
+            return defer.fail()
+        metrics = self._started(name, 1)
+        d = self.pools[name].get(key, withIdentifier)
+        d.addCallback(_countGetHit, metrics)
+        return self._timed(d, metrics)
+
+    def getMultiple(self, keys, withIdentifier=False):
+        """
+        Get C{keys} from their pools, each of which splits its keys between
+        its hosts. Every request is sent before any response is awaited.
+        """
+        try:
+            groups = self._groupByPool(keys)
+        except NoRoute:
+            return defer.fail()
+
+        def call(name, group, metrics):
+            d = self.pools[name].getMultiple(group, withIdentifier)
+            d.addCallback(_countMultipleHits, metrics, len(set(group)))
+            return d
+
+        return self._perPool(groups, call).addCallback(self._merge)
+
+    def setMultiple(self, items, flags=0, expireTime=0):
+        try:
+            groups = self._groupItemsByPool(items)
+        except NoRoute:
+            return defer.fail()
+
+        def call(name, group, metrics):
+            d = self.pools[name].setMultiple(group, flags, expireTime)
+            return d.addCallback(_countFailures, metrics)
+
+        return self._perPool(groups, call).addCallback(self._merge)
+
+    def deleteMultiple(self, keys):
+        try:
+            groups = self._groupByPool(keys)
+        except NoRoute:
+            return defer.fail()
+
+        def call(name, group, metrics):
+            d = self.pools[name].deleteMultiple(group)
+            return d.addCallback(_countFailures, metrics)
+
+        return self._perPool(groups, call).addCallback(self._merge)
+
+    def getValue(self, key, default=None):
+        """
+        Get C{key} and decode its value with its pool's codec.
+        """
+        try:
+            name = self.poolFor(key)
+        except NoRoute:
+            return defer.fail()
+        metrics = self._started(name, 1)
+        client = self.pools[name]
+        d = client.get(key)
+        d.addCallback(_countGetHit, metrics)
+        d.addCallback(client._gotValue, key, default)
+        return self._timed(d, metrics)
+
+    def getValues(self, keys):
+        try:
+            groups = self._groupByPool(keys)
+        except NoRoute:
+            return defer.fail()
+
+        def call(name, group, metrics):
+            client = self.pools[name]
+            d = client.getMultiple(group)
+            d.addCallback(_countMultipleHits, metrics, len(set(group)))
+            d.addCallback(client._gotValues)
+            return d
+
+        return self._perPool(groups, call).addCallback(self._merge)
+
+    def setValues(self, items, expireTime=0):
+        try:
+            groups = self._groupItemsByPool(items)
+        except NoRoute:
+            return defer.fail()
+
+        def call(name, group, metrics):
+            d = self.pools[name].setValues(group, expireTime)
+            return d.addCallback(_countFailures, metrics)
+
+        return self._perPool(groups, call).addCallback(self._merge)
+
+    set = _routed('set')
+    increment = _routed('increment')
+    decrement = _routed('decrement')
+    replace = _routed('replace')
+    add = _routed('add')
+    checkAndSet = _routed('checkAndSet')
+    append = _routed('append')
+    prepend = _routed('prepend')
+    delete = _routed('delete')
+    touch = _routed('touch')
+    getAndTouch = _routed('getAndTouch')
+    setValue = _routed('setValue')
+    metaGet = _routed('metaGet')
+    metaSet = _routed('metaSet')
+    metaDelete = _routed('metaDelete')
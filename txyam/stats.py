@@ -0,0 +1,282 @@
+from twisted.internet import task
+from twisted.python import log
+
+from txyam.utils import deferredDict
+
+
+# Monotonic counters for which per-second rates are computed between polls.
+RATE_STATS = [
+    b'cmd_get', b'cmd_set', b'cmd_touch', b'get_hits', b'get_misses',
+    b'evictions', b'bytes_read', b'bytes_written', b'total_connections',
+]
+
+
+def parseStatValue(value):
+    """
+    Convert a raw stat value to an C{int} or C{float} if it looks like one.
+    Other values are returned unchanged.
+    """
+    for convert in (int, float):
+        try:
+            return convert(value)
+        except ValueError:
+            pass
+    return value
+
+
+def parseStats(raw):
+    """
+    Parse the values of a plain C{stats} response.
+    """
+    return dict((key, parseStatValue(value)) for key, value in raw.items())
+
+
+def parseSlabStats(raw):
+    """
+    Parse a C{stats slabs} or C{stats items} response.
+
+    Per-slab stats look like C{1:chunk_size} or C{items:1:number}.
+
+    @return: A tuple of a C{dict} mapping each slab class id to a C{dict} of
+    its stats, and a C{dict} of the stats which aren't specific to a slab.
+    """
+    slabs = {}
+    totals = {}
+    for key, value in raw.items():
+        parts = key.split(b':')
+        if parts[0] == b'items':
+            parts = parts[1:]
+        if len(parts) == 2 and parts[0].isdigit():
+            slabs.setdefault(int(parts[0]), {})[parts[1]] = (
+                parseStatValue(value))
+        else:
+            totals[key] = parseStatValue(value)
+    return slabs, totals
+
+
+def _hitRatio(hits, misses):
+    if hits + misses == 0:
+        return None
+    return hits / float(hits + misses)
+
+
+class HostStats(object):
+    """
+    The parsed stats of one host at one point in time.
+
+    @ivar stats: The parsed C{stats} response.
+    @ivar slabs: The per-slab-class C{stats slabs} values.
+    @ivar items: The per-slab-class C{stats items} values.
+    @ivar slabTotals: The C{stats slabs} values which aren't specific to a
+    slab class, such as C{total_malloced} and C{active_slabs}.
+    @ivar rates: A C{dict} mapping each stat in L{RATE_STATS} to its
+    per-second rate since the previous poll. Empty on the first poll, or after
+    the server restarted.
+    """
+
+    def __init__(self, host, stats, slabs, items, previous=None,
+                 slabTotals=None):
+        self.host = host
+        self.stats = stats
+        self.slabs = slabs
+        self.items = items
+        self.slabTotals = slabTotals or {}
+        self.rates = {}
+        if previous is not None:
+            self._computeRates(previous)
+
+    def _computeRates(self, previous):
+        elapsed = (self.stats.get(b'uptime', 0)
+                   - previous.stats.get(b'uptime', 0))
+        if elapsed <= 0:
+            return
+        for key in RATE_STATS:
+            if key not in self.stats or key not in previous.stats:
+                continue
+            delta = self.stats[key] - previous.stats[key]
+            if delta < 0:
+                # The server restarted between polls.
+                self.rates.clear()
+                return
+            self.rates[key] = delta / float(elapsed)
+
+    @property
+    def hitRatio(self):
+        """
+        The fraction of gets which were hits since the server started, or
+        C{None} if there were no gets.
+        """
+        return _hitRatio(self.stats.get(b'get_hits', 0),
+                         self.stats.get(b'get_misses', 0))
+
+    @property
+    def recentHitRatio(self):
+        """
+        The fraction of gets which were hits since the previous poll, or
+        C{None} if unknown.
+        """
+        return _hitRatio(self.rates.get(b'get_hits', 0),
+                         self.rates.get(b'get_misses', 0))
+
+    @property
+    def evictionRate(self):
+        """
+        Evictions per second since the previous poll, or C{None} if unknown.
+        """
+        return self.rates.get(b'evictions')
+
+    @property
+    def memoryPressure(self):
+        """
+        The fraction of the memory limit in use, or C{None} if unknown.
+        """
+        limit = self.stats.get(b'limit_maxbytes')
+        if not limit:
+            return None
+        return self.stats.get(b'bytes', 0) / float(limit)
+
+    @property
+    def mallocedPressure(self):
+        """
+        The fraction of the memory limit allocated to slabs, or C{None} if
+        unknown. Unlike L{memoryPressure}, this counts memory held by slab
+        classes even when their items have expired.
+        """
+        limit = self.stats.get(b'limit_maxbytes')
+        malloced = self.slabTotals.get(b'total_malloced')
+        if not limit or malloced is None:
+            return None
+        return malloced / float(limit)
+
+    def evictingSlabs(self):
+        """
+        The ids of the slab classes which have evicted items.
+        """
+        return sorted(
+            slab for slab, stats in self.items.items()
+            if stats.get(b'evicted', 0) > 0)
+
+
+class ClusterStats(object):
+    """
+    The stats of every host which answered one poll.
+
+    @ivar hosts: A C{dict} mapping host descriptions to L{HostStats}.
+    """
+
+    def __init__(self, hosts):
+        self.hosts = hosts
+
+    def _sum(self, key):
+        return sum(h.stats.get(key, 0) for h in self.hosts.values())
+
+    @property
+    def hitRatio(self):
+        """
+        The fraction of gets which were hits across the cluster.
+        """
+        return _hitRatio(self._sum(b'get_hits'), self._sum(b'get_misses'))
+
+    @property
+    def evictionRate(self):
+        """
+        Evictions per second across the cluster since the previous poll.
+        """
+        return sum(h.evictionRate or 0 for h in self.hosts.values())
+
+    @property
+    def memoryPressure(self):
+        """
+        The fraction of the cluster's total memory limit in use.
+        """
+        limit = self._sum(b'limit_maxbytes')
+        if not limit:
+            return None
+        return self._sum(b'bytes') / float(limit)
+
+    def pressuredHosts(self, threshold=0.9):
+        """
+        The hosts whose memory use is at least C{threshold} of their limit.
+        """
+        return sorted(
+            host for host, h in self.hosts.items()
+            if h.memoryPressure is not None
+            and h.memoryPressure >= threshold)
+
+    def evictingHosts(self):
+        """
+        The hosts which evicted items since the previous poll.
+        """
+        return sorted(
+            host for host, h in self.hosts.items() if h.evictionRate)
+
+
+class StatsCollector(object):
+    """
+    Periodically polls C{stats}, C{stats slabs} and C{stats items} from every
+    connected host of a C{YamClient}.
+
+    Observers added with L{addObserver} are called with a L{ClusterStats}
+    after every poll, which can be used to drive alerting or to adjust the
+    client's routing with C{YamClient.setWeight}.
+    """
+
+    def __init__(self, client, interval=60):
+        self.client = client
+        self.interval = interval
+        self.latest = None
+        self._observers = []
+        self._loop = None
+
+    def addObserver(self, observer):
+        self._observers.append(observer)
+
+    def removeObserver(self, observer):
+        self._observers.remove(observer)
+
+    def start(self):
+        """
+        Start polling every C{interval} seconds, starting immediately.
+        """
+        self._loop = task.LoopingCall(self.poll)
+        self._loop.clock = self.client.reactor
+        self._loop.start(self.interval, now=True).addErrback(
+            log.err, 'stats collection failed', system='txyam')
+
+    def stop(self):
+        if self._loop is not None and self._loop.running:
+            self._loop.stop()
+        self._loop = None
+
+    def poll(self):
+        """
+        Poll every host once.
+
+        @return: A C{Deferred} which fires with the new L{ClusterStats}.
+        """
+        d = deferredDict({
+            b'stats': self.client.stats(),
+            b'slabs': self.client.stats(b'slabs'),
+            b'items': self.client.stats(b'items'),
+        })
+        d.addCallback(self._gotStats)
+        return d
+
+    def _gotStats(self, results):
+        previous = self.latest.hosts if self.latest is not None else {}
+        slabs = results.get(b'slabs', {})
+        items = results.get(b'items', {})
+        hosts = {}
+        for host, raw in results.get(b'stats', {}).items():
+            hostSlabs, slabTotals = parseSlabStats(slabs.get(host, {}))
+            hosts[host] = HostStats(
+                host, parseStats(raw), hostSlabs,
+                parseSlabStats(items.get(host, {}))[0],
+                previous.get(host), slabTotals)
+        self.latest = cluster = ClusterStats(hosts)
+        for observer in list(self._observers):
+            try:
+                observer(cluster)
+            except Exception:
+                log.err(None, 'stats observer failed', system='txyam')
+        return cluster
@@ -1,10 +1,15 @@
-from twisted.internet.error import ConnectionAborted
+from binascii import hexlify
+import hashlib
+
+from twisted.internet.error import ConnectionAborted, ConnectionDone
 from twisted.internet import defer
+from twisted.protocols.memcache import ServerError
 from twisted.python.failure import Failure
 from twisted.test import proto_helpers
 from twisted.trial.unittest import TestCase
 
 from txyam import client
+from txyam.codec import BytesCodec, PickleCodec
 
 
 class FakeEndpoint(object):
@@ -558,6 +563,750 @@ class YamClientTests(TestCase):
             self.successResultOf(d),
             dict.fromkeys([b'key1', b'key2', b'key3', b'key4', b'key5']))
 
+    def test_getAndTouchMultipleQuery(self):
+        """
+        getAndTouchMultiple issues one gat query to each client.
+        """
+        self.yam.connect()
+        self.yam.getAndTouchMultiple(
+            [b'key1', b'key2', b'key3', b'key4', b'key5'], 10)
+        ep1 = self.yam._endpoints['fake:1']
+        ep2 = self.yam._endpoints['fake:2']
+        self.assertEqual(ep1.transport.value(), b'gat 10 key5\r\n')
+        self.assertEqual(
+            ep2.transport.value(), b'gat 10 key1 key2 key3 key4\r\n')
+
+    def test_getAndTouchMultipleAnswer(self):
+        """
+        getAndTouchMultiple aggregates answers from each client.
+        """
+        self.yam.connect()
+        d = self.yam.getAndTouchMultiple([b'key1', b'key5'], 10)
+        self.assertNoResult(d)
+        ep1 = self.yam._endpoints['fake:1']
+        ep2 = self.yam._endpoints['fake:2']
+        ep1.proto.dataReceived(b'VALUE key5 0 1\r\n5\r\nEND\r\n')
+        ep2.proto.dataReceived(b'END\r\n')
+        self.assertEqual(
+            self.successResultOf(d),
+            {
+                b'key1': (0, None),
+                b'key5': (0, b'5'),
+            })
+
+    def test_getAndTouchMultipleWithIdentifier(self):
+        """
+        getAndTouchMultiple issues gats queries when asked for identifiers.
+        """
+        self.yam.connect()
+        d = self.yam.getAndTouchMultiple([b'key5'], 10, withIdentifier=True)
+        ep1 = self.yam._endpoints['fake:1']
+        self.assertEqual(ep1.transport.value(), b'gats 10 key5\r\n')
+        ep1.proto.dataReceived(b'VALUE key5 0 1 9\r\n5\r\nEND\r\n')
+        self.assertEqual(self.successResultOf(d), {b'key5': (0, b'9', b'5')})
+
+    def test_touchMultipleQuery(self):
+        """
+        touchMultiple issues touch commands to multiple clients.
+        """
+        self.yam.connect()
+        self.yam.touchMultiple(
+            [b'key1', b'key2', b'key3', b'key4', b'key5'], 10)
+        ep1 = self.yam._endpoints['fake:1']
+        ep2 = self.yam._endpoints['fake:2']
+        self.assertEqual(ep1.transport.value(), b'touch key5 10\r\n')
+        self.assertEqual(
+            ep2.transport.value().splitlines(),
+            [b'touch key1 10', b'touch key2 10', b'touch key3 10',
+             b'touch key4 10'])
+
+    def test_touchMultipleAnswer(self):
+        """
+        touchMultiple aggregates answers from each client.
+        """
+        self.yam.connect()
+        d = self.yam.touchMultiple([b'key1', b'key2', b'key5'], 10)
+        self.assertNoResult(d)
+        ep1 = self.yam._endpoints['fake:1']
+        ep2 = self.yam._endpoints['fake:2']
+        ep1.proto.dataReceived(b'TOUCHED\r\n')
+        ep2.proto.dataReceived(b'TOUCHED\r\nNOT_FOUND\r\n')
+        self.assertEqual(
+            self.successResultOf(d),
+            {b'key1': True, b'key2': False, b'key5': True})
+
+    def test_touchMultipleQueryWithNoClients(self):
+        """
+        If there are no clients available, touchMultiple will immediately fire
+        with a dict mapping each key to None.
+        """
+        self.yam._endpoints['fake:1'].failure = FakeError()
+        self.yam._endpoints['fake:2'].failure = FakeError()
+        self.yam.connect()
+        self.assertEqual(len(self.flushLoggedErrors(FakeError)), 2)
+        d = self.yam.touchMultiple([b'key1', b'key5'], 10)
+        self.assertEqual(
+            self.successResultOf(d), dict.fromkeys([b'key1', b'key5']))
+
+    def test_incrementMultipleQuery(self):
+        """
+        incrementMultiple issues incr and decr commands to multiple clients.
+        """
+        self.yam.connect()
+        self.yam.incrementMultiple({b'key1': 3, b'key2': -2, b'key5': 1})
+        ep1 = self.yam._endpoints['fake:1']
+        ep2 = self.yam._endpoints['fake:2']
+        self.assertEqual(ep1.transport.value(), b'incr key5 1\r\n')
+        self.assertEqual(
+            sorted(ep2.transport.value().splitlines()),
+            [b'decr key2 2', b'incr key1 3'])
+
+    def test_incrementMultipleAnswer(self):
+        """
+        incrementMultiple aggregates the new values from each client.
+        """
+        self.yam.connect()
+        d = self.yam.incrementMultiple({b'key1': 3, b'key5': 1})
+        self.assertNoResult(d)
+        self.yam._endpoints['fake:1'].proto.dataReceived(b'8\r\n')
+        self.yam._endpoints['fake:2'].proto.dataReceived(b'4\r\n')
+        self.assertEqual(self.successResultOf(d), {b'key1': 4, b'key5': 8})
+
+    def test_incrementMultipleInitializesMissingKeys(self):
+        """
+        Missing counters are created with add, starting from the delta.
+        """
+        self.yam.connect()
+        d = self.yam.incrementMultiple({b'key5': 3}, expireTime=10)
+        ep1 = self.yam._endpoints['fake:1']
+        ep1.transport.clear()
+        ep1.proto.dataReceived(b'NOT_FOUND\r\n')
+        self.assertEqual(ep1.transport.value(), b'add key5 0 10 1\r\n3\r\n')
+        ep1.proto.dataReceived(b'STORED\r\n')
+        self.assertEqual(self.successResultOf(d), {b'key5': 3})
+
+    def test_incrementMultipleRetriesLostAdd(self):
+        """
+        If another client creates a missing counter first, the increment is
+        retried.
+        """
+        self.yam.connect()
+        d = self.yam.incrementMultiple({b'key5': 3})
+        ep1 = self.yam._endpoints['fake:1']
+        ep1.proto.dataReceived(b'NOT_FOUND\r\n')
+        ep1.transport.clear()
+        ep1.proto.dataReceived(b'NOT_STORED\r\n')
+        self.assertEqual(ep1.transport.value(), b'incr key5 3\r\n')
+        ep1.proto.dataReceived(b'5\r\n')
+        self.assertEqual(self.successResultOf(d), {b'key5': 5})
+
+    def test_incrementMultipleQueryWithNoClients(self):
+        """
+        If there are no clients available, incrementMultiple will immediately
+        fire with a dict mapping each key to None.
+        """
+        self.yam._endpoints['fake:1'].failure = FakeError()
+        self.yam._endpoints['fake:2'].failure = FakeError()
+        self.yam.connect()
+        self.assertEqual(len(self.flushLoggedErrors(FakeError)), 2)
+        d = self.yam.incrementMultiple({b'key1': 1, b'key5': 1})
+        self.assertEqual(
+            self.successResultOf(d), dict.fromkeys([b'key1', b'key5']))
+
+
+class YamClientSetHostsTests(TestCase):
+    def setUp(self):
+        self.clock = clock()
+        self.yam = yam(self.clock)
+        self.yam._endpoints['fake:3'] = FakeEndpoint()
+        self.yam.connect()
+        self.ep1 = self.yam._endpoints['fake:1']
+        self.ep2 = self.yam._endpoints['fake:2']
+        self.ep3 = self.yam._endpoints['fake:3']
+
+    def test_readdedWhileConnecting(self):
+        """
+        A host which is removed and added again while its connection attempt
+        is pending isn't connected to twice, and joins the ring once.
+        """
+        self.ep3.deferred = defer.Deferred()
+        self.yam.setHosts(['fake:1', 'fake:2', 'fake:3'])
+        factory = self.ep3.factory
+        self.yam.setHosts(['fake:1', 'fake:2'])
+        self.yam.setHosts(['fake:1', 'fake:2', 'fake:3'])
+        self.assertIs(self.ep3.factory, factory)
+        self.ep3.deferred.callback(self.ep3.proto)
+        self.assertEqual(
+            sorted(self.yam._consistentHash.nodes),
+            ['fake:1', 'fake:2', 'fake:3'])
+        self.assertIs(self.yam.getClient(b'key3'), self.ep3.proto)
+
+    def test_secondProtocolDropped(self):
+        """
+        A second connection to a host which is already connected is closed.
+        """
+        first = self.ep2.proto
+        self.ep2.connect(self.ep2.factory)
+        second = self.ep2.proto
+        self.yam._gotProtocol(second, 'fake:2', defer.succeed(second))
+        self.assertIs(self.yam._protocols['fake:2'], first)
+        self.assertTrue(second.transport.disconnecting)
+        self.assertEqual(self.yam._consistentHash.nodes.count('fake:2'), 1)
+
+    def test_staleProtocolLost(self):
+        """
+        Losing a connection which was already replaced doesn't affect its
+        replacement.
+        """
+        first = self.ep2.proto
+        self.ep2.connect(self.ep2.factory)
+        second = self.ep2.proto
+        self.yam._protocols['fake:2'] = second
+        first.connectionLost(Failure(ConnectionDone()))
+        self.assertIs(self.yam._protocols['fake:2'], second)
+        self.assertIn('fake:2', self.yam._consistentHash.nodes)
+
+    def test_addHost(self):
+        """
+        Added hosts are connected to and take over their share of the keys.
+        """
+        d = self.yam.setHosts(['fake:1', 'fake:2', 'fake:3'])
+        self.assertIs(self.successResultOf(d), self.yam)
+        self.yam.get(b'key3')
+        self.assertEqual(self.ep3.transport.value(), b'get key3\r\n')
+        self.assertEqual(self.ep2.transport.value(), b'')
+
+    def test_removeHost(self):
+        """
+        Without a migration window, removed hosts are disconnected right away
+        and aren't reconnected to.
+        """
+        self.yam.setHosts(['fake:1'])
+        proto = self.ep2.proto
+        self.assertTrue(proto.transport.disconnecting)
+        proto.connectionLost(Failure(FakeError()))
+        self.clock.advance(2)
+        self.assertIs(self.ep2.proto, proto)
+        self.assertEqual(len(self.flushLoggedErrors(FakeError)), 0)
+        self.yam.get(b'key1')
+        self.assertEqual(self.ep1.transport.value(), b'get key1\r\n')
+
+    def test_removedHostIsDrained(self):
+        """
+        A removed host's connection is only closed once its outstanding
+        commands have been answered.
+        """
+        d = self.yam.get(b'key1')
+        self.yam.setHosts(['fake:1'])
+        self.assertFalse(self.ep2.transport.disconnecting)
+        self.ep2.proto.dataReceived(b'VALUE key1 0 1\r\n1\r\nEND\r\n')
+        self.assertEqual(self.successResultOf(d), (0, b'1'))
+        self.assertTrue(self.ep2.transport.disconnecting)
+
+    def test_removedHostPendingReconnection(self):
+        """
+        A pending reconnection to a removed host is abandoned.
+        """
+        proto = self.ep2.proto
+        self.ep2.failure = FakeError()
+        proto.connectionLost(Failure(FakeError()))
+        self.assertEqual(len(self.flushLoggedErrors(FakeError)), 1)
+        self.yam.setHosts(['fake:1'])
+        self.clock.advance(2)
+        self.assertIs(self.ep2.proto, proto)
+
+    def test_readFallsBackToPreviousOwner(self):
+        """
+        During the migration window, a miss on the new owner is retried on the
+        previous owner.
+        """
+        self.yam.setHosts(['fake:1', 'fake:2', 'fake:3'], migrationWindow=60)
+        d = self.yam.get(b'key3')
+        self.ep3.proto.dataReceived(b'END\r\n')
+        self.assertEqual(self.ep2.transport.value(), b'get key3\r\n')
+        self.ep2.proto.dataReceived(b'VALUE key3 0 1\r\n3\r\nEND\r\n')
+        self.assertEqual(self.successResultOf(d), (0, b'3'))
+        self.assertEqual(self.ep3.transport.value(), b'get key3\r\n')
+
+    def test_readCopiesForward(self):
+        """
+        With copyForward, values found on the previous owner are stored on the
+        new owner.
+        """
+        self.yam.setHosts(['fake:1', 'fake:2', 'fake:3'], migrationWindow=60,
+                          copyForward=True, copyExpireTime=30)
+        d = self.yam.getMultiple([b'key1', b'key3'])
+        self.ep2.proto.dataReceived(b'END\r\n')
+        self.ep3.proto.dataReceived(b'END\r\n')
+        self.assertEqual(
+            self.ep2.transport.value(), b'get key1\r\nget key3\r\n')
+        self.ep2.proto.dataReceived(b'VALUE key3 0 1\r\n3\r\nEND\r\n')
+        self.assertEqual(
+            self.successResultOf(d),
+            {b'key1': (0, None), b'key3': (0, b'3')})
+        self.assertEqual(
+            self.ep3.transport.value(),
+            b'get key3\r\nset key3 0 30 1\r\n3\r\n')
+
+    def test_writesGoToBothOwners(self):
+        """
+        During the migration window, writes go to both the new and the
+        previous owner.
+        """
+        self.yam.setHosts(['fake:1', 'fake:2', 'fake:3'], migrationWindow=60)
+        self.yam.set(b'key3', b'x')
+        self.yam.delete(b'key1')
+        self.assertEqual(
+            self.ep3.transport.value(), b'set key3 0 0 1\r\nx\r\n')
+        self.assertEqual(
+            self.ep2.transport.value(),
+            b'set key3 0 0 1\r\nx\r\ndelete key1\r\n')
+
+    def test_multipleWritesGoToBothOwners(self):
+        """
+        During the migration window, the writes of touchMultiple,
+        incrementMultiple and metaSet go to both the new and the previous
+        owner.
+        """
+        self.yam.setHosts(['fake:1', 'fake:2', 'fake:3'], migrationWindow=60)
+        self.yam.touchMultiple([b'key3'], 10)
+        d = self.yam.incrementMultiple({b'key3': 2})
+        self.yam.metaSet(b'key3', b'x')
+        self.assertEqual(
+            self.ep2.transport.value(),
+            b'touch key3 10\r\nincr key3 2\r\nms key3 1 F0 T0\r\nx\r\n')
+        self.ep3.proto.dataReceived(b'TOUCHED\r\nNOT_FOUND\r\n')
+        self.assertEqual(
+            self.ep2.transport.value(),
+            b'touch key3 10\r\nincr key3 2\r\nms key3 1 F0 T0\r\nx\r\n'
+            b'add key3 0 0 1\r\n2\r\n')
+        self.ep3.proto.dataReceived(b'HD\r\nSTORED\r\n')
+        self.assertEqual(self.successResultOf(d), {b'key3': 2})
+
+    def test_migrationWindowEnds(self):
+        """
+        Once the migration window is over, removed hosts are disconnected and
+        reads no longer fall back.
+        """
+        self.yam.setHosts(['fake:1', 'fake:3'], migrationWindow=60)
+        self.assertFalse(self.ep2.proto.transport.disconnecting)
+        self.clock.advance(60)
+        self.assertTrue(self.ep2.proto.transport.disconnecting)
+        self.ep2.proto.connectionLost(Failure(FakeError()))
+        d = self.yam.get(b'key1')
+        self.ep1.proto.dataReceived(b'END\r\n')
+        self.assertEqual(self.successResultOf(d), (0, None))
+        self.assertEqual(len(self.flushLoggedErrors(FakeError)), 0)
+
+
+class YamClientMetaTests(TestCase):
+    def setUp(self):
+        self.clock = clock()
+        self.yam = yam(self.clock)
+        self.yam.connect()
+        self.ep = self.yam._endpoints['fake:2']
+
+    def test_metaGetQuery(self):
+        """
+        metaGet sends an mg command with the requested flags.
+        """
+        self.yam.metaGet(b'key1', withIdentifier=True, vivify=30, recache=10,
+                         expireTime=60)
+        self.assertEqual(
+            self.ep.transport.value(), b'mg key1 v f t c N30 R10 T60\r\n')
+
+    def test_metaGetHit(self):
+        """
+        A VA response carries the value and its flags.
+        """
+        d = self.yam.metaGet(b'key1', withIdentifier=True)
+        self.ep.proto.dataReceived(b'VA 3 f5 t-1 c42 X Z\r\nabc\r\n')
+        result = self.successResultOf(d)
+        self.assertTrue(result.hit)
+        self.assertEqual(result.value, b'abc')
+        self.assertEqual(result.clientFlags, 5)
+        self.assertEqual(result.ttl, -1)
+        self.assertEqual(result.cas, 42)
+        self.assertTrue(result.stale)
+        self.assertTrue(result.winTokenSent)
+        self.assertFalse(result.won)
+
+    def test_metaGetWin(self):
+        """
+        A vivified miss tells the client it won the right to recompute, and
+        the empty placeholder isn't a hit.
+        """
+        d = self.yam.metaGet(b'key1', vivify=30)
+        self.ep.proto.dataReceived(b'VA 0 f0 t30 W\r\n\r\n')
+        result = self.successResultOf(d)
+        self.assertTrue(result.vivified)
+        self.assertFalse(result.hit)
+        self.assertEqual(result.value, b'')
+        self.assertTrue(result.won)
+
+    def test_metaGetLose(self):
+        """
+        Clients getting a vivified placeholder after it was created are told
+        another client is recomputing it, and don't see a hit.
+        """
+        d = self.yam.metaGet(b'key1', vivify=30)
+        self.ep.proto.dataReceived(b'VA 0 f0 t29 Z\r\n\r\n')
+        result = self.successResultOf(d)
+        self.assertTrue(result.vivified)
+        self.assertFalse(result.hit)
+        self.assertFalse(result.won)
+        self.assertTrue(result.winTokenSent)
+
+    def test_metaGetRecacheWin(self):
+        """
+        A recache win comes with the cached value, which is a hit.
+        """
+        d = self.yam.metaGet(b'key1', vivify=30, recache=10)
+        self.ep.proto.dataReceived(b'VA 3 f0 t5 W\r\nabc\r\n')
+        result = self.successResultOf(d)
+        self.assertFalse(result.vivified)
+        self.assertTrue(result.hit)
+        self.assertTrue(result.won)
+
+    def test_metaGetStaleWin(self):
+        """
+        An invalidated item isn't mistaken for a placeholder, even if empty.
+        """
+        d = self.yam.metaGet(b'key1', vivify=30)
+        self.ep.proto.dataReceived(b'VA 0 f0 t30 W X\r\n\r\n')
+        result = self.successResultOf(d)
+        self.assertFalse(result.vivified)
+        self.assertTrue(result.hit)
+        self.assertTrue(result.stale)
+
+    def test_metaGetPipelined(self):
+        """
+        Responses following a meta get's value are handled.
+        """
+        d1 = self.yam.metaGet(b'key1')
+        d2 = self.yam.metaSet(b'key1', b'x')
+        self.ep.proto.dataReceived(b'VA 1 W\r\n1\r\nHD\r\n')
+        self.assertEqual(self.successResultOf(d1).value, b'1')
+        self.assertTrue(self.successResultOf(d2).hit)
+
+    def test_metaSetQuery(self):
+        """
+        metaSet sends an ms command followed by the value.
+        """
+        d = self.yam.metaSet(b'key1', b'value', flags=3, expireTime=60,
+                             cas=42, invalidate=True)
+        self.assertEqual(
+            self.ep.transport.value(),
+            b'ms key1 5 F3 T60 C42 I\r\nvalue\r\n')
+        self.ep.proto.dataReceived(b'EX\r\n')
+        result = self.successResultOf(d)
+        self.assertEqual(result.status, b'EX')
+        self.assertFalse(result.hit)
+
+    def test_metaDeleteInvalidate(self):
+        """
+        metaDelete can mark an item stale instead of removing it.
+        """
+        d = self.yam.metaDelete(b'key1', invalidate=True, expireTime=30)
+        self.assertEqual(self.ep.transport.value(), b'md key1 I T30\r\n')
+        self.ep.proto.dataReceived(b'HD\r\n')
+        self.assertTrue(self.successResultOf(d).hit)
+
+    def test_metaWithNoClients(self):
+        """
+        Meta commands fire with None if no clients are connected.
+        """
+        self.yam.disconnect()
+        self.yam._endpoints['fake:1'].proto.connectionLost(
+            Failure(ConnectionAborted()))
+        self.ep.proto.connectionLost(Failure(ConnectionAborted()))
+        self.assertIsNone(self.successResultOf(self.yam.metaGet(b'key1')))
+
+
+class YamClientLargeValueTests(TestCase):
+    def setUp(self):
+        self.clock = clock()
+        self.yam = yam(self.clock)
+        self.yam.largeChunkSize = 4
+        self.yam._largeValueToken = lambda: b'tok'
+        self.yam._endpoints['fake:2'].failure = FakeError()
+        self.yam.connect()
+        self.assertEqual(len(self.flushLoggedErrors(FakeError)), 1)
+        self.ep = self.yam._endpoints['fake:1']
+
+    def test_setLargeQuery(self):
+        """
+        setLarge stores each chunk under a versioned key before storing the
+        manifest.
+        """
+        d = self.yam.setLarge(b'key1', b'0123456789', 3)
+        self.assertEqual(
+            sorted(self.ep.transport.value().splitlines()), [
+                b'0123', b'4567', b'89',
+                b'set key1/tok/0 0 0 4',
+                b'set key1/tok/1 0 0 4',
+                b'set key1/tok/2 0 0 2',
+            ])
+        self.ep.transport.clear()
+        self.ep.proto.dataReceived(b'STORED\r\n' * 3)
+        self.assertEqual(
+            self.ep.transport.value(), b'set key1 3 0 8\r\ntok:3:10\r\n')
+        self.ep.proto.dataReceived(b'STORED\r\n')
+        self.assertIs(self.successResultOf(d), True)
+
+    def test_setLargeLongKey(self):
+        """
+        Chunk keys which would be longer than memcached allows are derived
+        from a digest of the key instead.
+        """
+        longest = b'k' * 244
+        self.yam.setLarge(longest, b'0123')
+        self.assertEqual(
+            self.ep.transport.value().splitlines()[0],
+            b'set ' + longest + b'/tok/0 0 0 4')
+        self.ep.transport.clear()
+
+        tooLong = b'k' * 245
+        self.yam.setLarge(tooLong, b'0123')
+        chunkKey = self.ep.transport.value().split()[1]
+        self.assertEqual(
+            chunkKey,
+            b'#' + hexlify(hashlib.sha1(tooLong).digest()) + b'/tok/0')
+
+    def test_setLargeChunkFailure(self):
+        """
+        If any chunk isn't stored, the manifest isn't written.
+        """
+        d = self.yam.setLarge(b'key1', b'0123456789')
+        self.ep.transport.clear()
+        self.ep.proto.dataReceived(b'STORED\r\nNOT_STORED\r\nSTORED\r\n')
+        self.assertEqual(self.ep.transport.value(), b'')
+        self.assertIs(self.successResultOf(d), False)
+
+    def test_getLargeAnswer(self):
+        """
+        getLarge reads the manifest, then fetches and reassembles the chunks.
+        """
+        d = self.yam.getLarge(b'key1')
+        self.assertEqual(self.ep.transport.value(), b'get key1\r\n')
+        self.ep.transport.clear()
+        self.ep.proto.dataReceived(b'VALUE key1 3 8\r\ntok:3:10\r\nEND\r\n')
+        self.assertEqual(
+            self.ep.transport.value(),
+            b'get key1/tok/0 key1/tok/1 key1/tok/2\r\n')
+        self.ep.proto.dataReceived(
+            b'VALUE key1/tok/0 0 4\r\n0123\r\n'
+            b'VALUE key1/tok/1 0 4\r\n4567\r\n'
+            b'VALUE key1/tok/2 0 2\r\n89\r\nEND\r\n')
+        self.assertEqual(self.successResultOf(d), (3, b'0123456789'))
+
+    def test_getLargeMissingChunk(self):
+        """
+        If any chunk is missing, getLarge reports a miss.
+        """
+        d = self.yam.getLarge(b'key1')
+        self.ep.proto.dataReceived(b'VALUE key1 3 8\r\ntok:3:10\r\nEND\r\n')
+        self.ep.proto.dataReceived(
+            b'VALUE key1/tok/0 0 4\r\n0123\r\n'
+            b'VALUE key1/tok/2 0 2\r\n89\r\nEND\r\n')
+        self.assertEqual(self.successResultOf(d), (0, None))
+
+    def test_getLargeMissingManifest(self):
+        """
+        If the manifest is missing, getLarge reports a miss without fetching
+        any chunks.
+        """
+        d = self.yam.getLarge(b'key1')
+        self.ep.transport.clear()
+        self.ep.proto.dataReceived(b'END\r\n')
+        self.assertEqual(self.ep.transport.value(), b'')
+        self.assertEqual(self.successResultOf(d), (0, None))
+
+    def test_deleteLarge(self):
+        """
+        deleteLarge deletes the manifest and every chunk it names.
+        """
+        d = self.yam.deleteLarge(b'key1')
+        self.ep.transport.clear()
+        self.ep.proto.dataReceived(b'VALUE key1 0 7\r\ntok:2:5\r\nEND\r\n')
+        self.assertEqual(
+            sorted(self.ep.transport.value().splitlines()),
+            [b'delete key1', b'delete key1/tok/0', b'delete key1/tok/1'])
+        self.ep.proto.dataReceived(b'DELETED\r\n' * 3)
+        self.assertIs(self.successResultOf(d), True)
+
+
+class FakeRunner(object):
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, f, *args):
+        d = defer.Deferred()
+        self.calls.append((f, args, d))
+        return d
+
+    def runAll(self):
+        calls, self.calls = self.calls, []
+        for f, args, d in calls:
+            d.callback(f(*args))
+
+
+class YamClientCodecTests(TestCase):
+    def setUp(self):
+        self.clock = clock()
+        self.runner = FakeRunner()
+        self.yam = yam(self.clock, codec=PickleCodec(), offloadThreshold=10,
+                       offloadRunner=self.runner)
+        self.yam.connect()
+        self.ep = self.yam._endpoints['fake:2']
+
+    def test_setValueInline(self):
+        """
+        Small values are encoded on the reactor thread.
+        """
+        d = self.yam.setValue(b'key1', u'abc', 5)
+        self.assertEqual(self.runner.calls, [])
+        self.assertEqual(
+            self.ep.transport.value(), b'set key1 4 5 3\r\nabc\r\n')
+        self.ep.proto.dataReceived(b'STORED\r\n')
+        self.assertTrue(self.successResultOf(d))
+
+    def test_setValueOffloaded(self):
+        """
+        Values at least C{offloadThreshold} long are encoded by the runner.
+        """
+        d = self.yam.setValue(b'key1', b'x' * 10)
+        self.assertEqual(self.ep.transport.value(), b'')
+        self.runner.runAll()
+        self.assertEqual(
+            self.ep.transport.value(),
+            b'set key1 0 0 10\r\n' + b'x' * 10 + b'\r\n')
+        self.ep.proto.dataReceived(b'STORED\r\n')
+        self.assertTrue(self.successResultOf(d))
+
+    def test_setValueUnknownSizeInline(self):
+        """
+        Values whose size isn't known before encoding are encoded inline.
+        """
+        self.yam.setValue(b'key1', list(range(100)))
+        self.assertEqual(self.runner.calls, [])
+        self.assertTrue(self.ep.transport.value().startswith(b'set key1 1 '))
+
+    def test_setValueEncodingFails(self):
+        """
+        setValue fails if the value can't be encoded.
+        """
+        self.yam.codec = BytesCodec()
+        d = self.yam.setValue(b'key1', u'abc')
+        self.failureResultOf(d, TypeError)
+
+    def test_setValueEncodingFailsOffloading(self):
+        """
+        setValue fails instead of raising if the value can't be encoded, even
+        when values might be offloaded.
+        """
+        self.yam.codec = BytesCodec()
+        self.failureResultOf(self.yam.setValue(b'key1', 12345), TypeError)
+        d = self.yam.setValues({b'key1': 12345})
+        self.assertEqual(self.successResultOf(d), {b'key1': None})
+        self.assertEqual(len(self.flushLoggedErrors(TypeError)), 1)
+
+    def test_sizeOfFails(self):
+        """
+        An exception raised while sizing a value fails setValue.
+        """
+        class BrokenCodec(PickleCodec):
+            def sizeOf(self, value):
+                raise ValueError()
+        self.yam.codec = BrokenCodec()
+        self.failureResultOf(self.yam.setValue(b'key1', b'x'), ValueError)
+
+    def test_bytesCodecNotOffloaded(self):
+        """
+        BytesCodec's work is never offloaded, as it doesn't do any.
+        """
+        self.yam.codec = BytesCodec()
+        self.yam.setValue(b'key1', b'x' * 10)
+        d = self.yam.getValue(b'key1')
+        self.ep.proto.dataReceived(
+            b'STORED\r\nVALUE key1 0 10\r\n' + b'x' * 10 + b'\r\nEND\r\n')
+        self.assertEqual(self.successResultOf(d), b'x' * 10)
+        self.assertEqual(self.runner.calls, [])
+
+    def test_getValue(self):
+        """
+        getValue decodes small values inline.
+        """
+        d = self.yam.getValue(b'key1')
+        self.ep.proto.dataReceived(b'VALUE key1 4 3\r\nabc\r\nEND\r\n')
+        self.assertEqual(self.successResultOf(d), u'abc')
+        self.assertEqual(self.runner.calls, [])
+
+    def test_getValueOffloaded(self):
+        """
+        getValue decodes values at least C{offloadThreshold} long with the
+        runner, and fires with the result.
+        """
+        d = self.yam.getValue(b'key1')
+        self.ep.proto.dataReceived(
+            b'VALUE key1 4 10\r\n' + b'x' * 10 + b'\r\nEND\r\n')
+        self.assertNoResult(d)
+        self.runner.runAll()
+        self.assertEqual(self.successResultOf(d), u'x' * 10)
+
+    def test_getValueMiss(self):
+        """
+        getValue fires with the default on a miss.
+        """
+        d = self.yam.getValue(b'key1', default=7)
+        self.ep.proto.dataReceived(b'END\r\n')
+        self.assertEqual(self.successResultOf(d), 7)
+
+    def test_getValueUndecodable(self):
+        """
+        A value which can't be decoded is logged and treated as a miss.
+        """
+        d = self.yam.getValue(b'key1')
+        self.ep.proto.dataReceived(b'VALUE key1 1 3\r\nabc\r\nEND\r\n')
+        self.assertIdentical(self.successResultOf(d), None)
+        self.assertEqual(len(self.flushLoggedErrors()), 1)
+
+    def test_getValues(self):
+        """
+        getValues decodes the values of the keys which were found.
+        """
+        ep1 = self.yam._endpoints['fake:1']
+        d = self.yam.getValues([b'key1', b'key2', b'key5'])
+        self.ep.proto.dataReceived(
+            b'VALUE key1 4 10\r\n' + b'x' * 10 + b'\r\nEND\r\n')
+        ep1.proto.dataReceived(b'VALUE key5 0 2\r\nab\r\nEND\r\n')
+        self.assertNoResult(d)
+        self.runner.runAll()
+        self.assertEqual(
+            self.successResultOf(d), {b'key1': u'x' * 10, b'key5': b'ab'})
+
+    def test_setValues(self):
+        """
+        setValues encodes each value with its own flags.
+        """
+        d = self.yam.setValues({b'key1': u'abc', b'key2': b'de'}, 5)
+        self.runner.runAll()
+        self.assertEqual(
+            sorted(self.ep.transport.value().split(b'\r\n')),
+            [b'', b'abc', b'de', b'set key1 4 5 3', b'set key2 0 5 2'])
+        self.ep.proto.dataReceived(b'STORED\r\nSTORED\r\n')
+        self.assertEqual(
+            self.successResultOf(d), {b'key1': True, b'key2': True})
+
+    def test_setValuesEncodingFails(self):
+        """
+        Keys whose value can't be encoded are logged and map to C{None}.
+        """
+        self.yam.codec = BytesCodec()
+        d = self.yam.setValues({b'key1': u'abc'})
+        self.assertEqual(self.successResultOf(d), {b'key1': None})
+        self.assertEqual(len(self.flushLoggedErrors(TypeError)), 1)
+
 
 class CustomYamClientTests(TestCase):
     def setUp(self):
@@ -587,6 +1336,224 @@ class CustomYamClientTests(TestCase):
         self.clock.advance(1)
         self.assertEqual(len(self.flushLoggedErrors(FakeError)), 2)
 
+    def test_retryBackoff(self):
+        """
+        Consecutive reconnection attempts can back off exponentially.
+        """
+        self.yam = yam(self.clock, retryDelay=1, retryBackoff=2)
+        endpoint = self.yam._endpoints['fake:1']
+        endpoint.failure = FakeError()
+        self.yam.connect()
+        self.clock.advance(1)
+        self.assertEqual(len(self.flushLoggedErrors(FakeError)), 2)
+        self.clock.advance(1)
+        self.assertEqual(len(self.flushLoggedErrors(FakeError)), 0)
+        self.clock.advance(1)
+        self.assertEqual(len(self.flushLoggedErrors(FakeError)), 1)
+        self.clock.advance(4)
+        self.assertEqual(len(self.flushLoggedErrors(FakeError)), 1)
+
+    def test_retryBackoffCapped(self):
+        """
+        The backoff is capped by maxRetryDelay.
+        """
+        self.yam = yam(self.clock, retryDelay=1, retryBackoff=10,
+                       maxRetryDelay=3)
+        endpoint = self.yam._endpoints['fake:1']
+        endpoint.failure = FakeError()
+        self.yam.connect()
+        self.clock.advance(1)
+        self.clock.advance(3)
+        self.clock.advance(3)
+        self.assertEqual(len(self.flushLoggedErrors(FakeError)), 4)
+
+    def test_retryBackoffResetOnConnection(self):
+        """
+        The backoff starts over once a connection answered a command.
+        """
+        self.yam = yam(self.clock, retryDelay=1, retryBackoff=2)
+        endpoint = self.yam._endpoints['fake:1']
+        endpoint.failure = FakeError()
+        self.yam.connect()
+        self.clock.advance(1)
+        endpoint.failure = None
+        self.clock.advance(2)
+        self.assertEqual(len(self.flushLoggedErrors(FakeError)), 2)
+        proto = endpoint.proto
+        self.yam.get(b'key5')
+        proto.dataReceived(b'END\r\n')
+        proto.connectionLost(Failure(FakeError()))
+        self.clock.advance(1)
+        self.assertIsNot(endpoint.proto, proto)
+        self.assertEqual(len(self.flushLoggedErrors(FakeError)), 1)
+
+    def test_retryBackoffKeptUntilResponse(self):
+        """
+        The backoff doesn't start over if a host accepts connections but drops
+        them before answering anything.
+        """
+        self.yam = yam(self.clock, retryDelay=1, retryBackoff=2)
+        endpoint = self.yam._endpoints['fake:1']
+        self.yam.connect()
+        for delay in [1, 2, 4]:
+            proto = endpoint.proto
+            proto.connectionLost(Failure(FakeError()))
+            self.clock.advance(delay - 0.5)
+            self.assertIs(endpoint.proto, proto)
+            self.clock.advance(0.5)
+            self.assertIsNot(endpoint.proto, proto)
+        self.assertEqual(len(self.flushLoggedErrors(FakeError)), 3)
+
+    def test_connectionAbortedJitter(self):
+        """
+        With jitter, a ConnectionAborted causes a reconnection after a random
+        part of the jittered first delay, and later losses back off.
+        """
+        self.yam = yam(self.clock, retryDelay=4, retryJitter=0.5)
+        self.yam._random = lambda: 0.5
+        endpoint = self.yam._endpoints['fake:1']
+        self.yam.connect()
+        proto = endpoint.proto
+        proto.connectionLost(Failure(ConnectionAborted()))
+        self.clock.advance(0.9)
+        self.assertIs(endpoint.proto, proto)
+        self.clock.advance(0.1)
+        self.assertIsNot(endpoint.proto, proto)
+        proto = endpoint.proto
+        proto.connectionLost(Failure(ConnectionAborted()))
+        self.clock.advance(1)
+        self.assertIs(endpoint.proto, proto)
+        self.clock.advance(2)
+        self.assertIsNot(endpoint.proto, proto)
+        self.flushLoggedErrors(ConnectionAborted)
+
+    def test_retryJitter(self):
+        """
+        A random fraction of each delay can be shaved off.
+        """
+        self.yam = yam(self.clock, retryDelay=4, retryJitter=0.5)
+        self.yam._random = lambda: 0.5
+        endpoint = self.yam._endpoints['fake:1']
+        endpoint.failure = FakeError()
+        self.yam.connect()
+        self.clock.advance(3)
+        self.assertEqual(len(self.flushLoggedErrors(FakeError)), 2)
+
+    def test_connectionAbortedAfterFailuresBacksOff(self):
+        """
+        A ConnectionAborted only causes an immediate reconnection if the host
+        wasn't already failing.
+        """
+        self.yam = yam(self.clock, retryDelay=1, warmup=True)
+        endpoint = self.yam._endpoints['fake:1']
+        self.yam.connect()
+        proto = endpoint.proto
+        proto.connectionLost(Failure(FakeError()))
+        self.clock.advance(1)
+        self.assertIsNot(endpoint.proto, proto)
+        proto = endpoint.proto
+        proto.connectionLost(Failure(ConnectionAborted()))
+        self.assertIs(endpoint.proto, proto)
+        self.clock.advance(1)
+        self.assertIsNot(endpoint.proto, proto)
+        self.flushLoggedErrors(FakeError, ConnectionAborted)
+
+    def test_warmupProbe(self):
+        """
+        With warmup, a host only joins the consistent hash once it answered a
+        version probe.
+        """
+        self.yam = yam(self.clock, warmup=True)
+        self.yam.connect()
+        ep1 = self.yam._endpoints['fake:1']
+        ep2 = self.yam._endpoints['fake:2']
+        self.assertEqual(ep2.transport.value(), b'version\r\n')
+        ep1.proto.dataReceived(b'VERSION 1.6.9\r\n')
+        self.yam.get(b'key1')
+        self.assertEqual(
+            ep1.transport.value(), b'version\r\nget key1\r\n')
+        ep2.proto.dataReceived(b'VERSION 1.6.9\r\n')
+        self.yam.get(b'key1')
+        self.assertEqual(
+            ep2.transport.value(), b'version\r\nget key1\r\n')
+
+    def test_warmupRemovedDuringProbe(self):
+        """
+        A host which was removed while its version probe was pending doesn't
+        join the consistent hash when the probe is answered.
+        """
+        self.yam = yam(self.clock, warmup=True)
+        self.yam.connect()
+        ep1 = self.yam._endpoints['fake:1']
+        ep2 = self.yam._endpoints['fake:2']
+        ep1.proto.dataReceived(b'VERSION 1.6.9\r\n')
+        self.yam.setHosts(['fake:1'], migrationWindow=30)
+        ep2.proto.dataReceived(b'VERSION 1.6.9\r\n')
+        self.assertEqual(self.yam._consistentHash.nodes, ['fake:1'])
+        self.clock.advance(30)
+        self.assertEqual(self.yam._consistentHash.nodes, ['fake:1'])
+        self.assertTrue(ep2.transport.disconnecting)
+
+    def test_warmupProbeFailure(self):
+        """
+        If the version probe fails, the connection is closed.
+        """
+        self.yam = yam(self.clock, warmup=True)
+        self.yam.connect()
+        ep2 = self.yam._endpoints['fake:2']
+        ep2.proto.dataReceived(b'SERVER_ERROR out of memory\r\n')
+        self.assertTrue(ep2.transport.disconnecting)
+        self.assertEqual(len(self.flushLoggedErrors(ServerError)), 1)
+
+    def test_warmupRamp(self):
+        """
+        With a warmup duration, a host's weight in the consistent hash is
+        ramped up gradually.
+        """
+        self.yam = yam(self.clock, warmup=True, warmupDuration=8,
+                       warmupSteps=4)
+        self.yam.connect()
+        ep1 = self.yam._endpoints['fake:1']
+        ep1.proto.dataReceived(b'VERSION 1.6.9\r\n')
+        weights = self.yam._consistentHash.weights
+        self.assertEqual(weights['fake:1'], 0.25)
+        self.clock.advance(2)
+        self.assertEqual(weights['fake:1'], 0.5)
+        self.clock.advance(2)
+        self.clock.advance(2)
+        self.assertEqual(weights['fake:1'], 1)
+        self.assertEqual(self.yam._consistentHash.nodes, ['fake:1'])
+
+    def test_migrationKeepsRampWeights(self):
+        """
+        The consistent hash kept for a migration window has the weights hosts
+        had while they were being ramped up, so reads fall back on the host
+        which really owned the key.
+        """
+        self.yam = yam(self.clock, warmup=True, warmupDuration=8,
+                       warmupSteps=4)
+        ep1 = self.yam._endpoints['fake:1']
+        ep2 = self.yam._endpoints['fake:2']
+        ep3 = self.yam._endpoints['fake:3'] = FakeEndpoint()
+        self.yam.connect()
+        ep1.proto.dataReceived(b'VERSION 1.6.9\r\n')
+        self.clock.pump([2] * 4)
+        ep2.proto.dataReceived(b'VERSION 1.6.9\r\n')
+        # With fake:2 at a quarter of its weight, key27 belongs to fake:1; it
+        # would belong to fake:2 if both had the same weight.
+        self.assertIs(self.yam.getClient(b'key27'), ep1.proto)
+        self.yam.setHosts(['fake:1', 'fake:2', 'fake:3'], migrationWindow=60)
+        ep3.proto.dataReceived(b'VERSION 1.6.9\r\n')
+        self.assertEqual(
+            self.yam._previousHash.weights, {'fake:1': 1, 'fake:2': 0.25})
+        ep1.transport.clear()
+        d = self.yam.get(b'key27')
+        ep3.proto.dataReceived(b'END\r\n')
+        self.assertEqual(ep1.transport.value(), b'get key27\r\n')
+        self.assertEqual(ep2.transport.value(), b'version\r\n')
+        ep1.proto.dataReceived(b'VALUE key27 0 1\r\nx\r\nEND\r\n')
+        self.assertEqual(self.successResultOf(d), (0, b'x'))
+
 
 class YamClientCommandTestsMixin(object):
     def setUp(self):
@@ -747,3 +1714,19 @@ class YamClientCommandDeleteTests(YamClientCommandTestsMixin, TestCase):
     query = b'delete key1\r\n'
     response = b'DELETED\r\n'
     deferredResult = True
+
+
+class YamClientCommandTouchTests(YamClientCommandTestsMixin, TestCase):
+    method = 'touch'
+    arguments = (10,)
+    query = b'touch key1 10\r\n'
+    response = b'TOUCHED\r\n'
+    deferredResult = True
+
+
+class YamClientCommandGetAndTouchTests(YamClientCommandTestsMixin, TestCase):
+    method = 'getAndTouch'
+    arguments = (10,)
+    query = b'gat 10 key1\r\n'
+    response = b'VALUE key1 0 1\r\nx\r\nEND\r\n'
+    deferredResult = (0, b'x')
@@ -0,0 +1,120 @@
+import zlib
+
+from twisted.internet.task import Clock
+from twisted.trial.unittest import TestCase
+
+from txyam.codec import (
+    FLAG_COMPRESSED, FLAG_PICKLE, FLAG_TEXT, BytesCodec, PickleCodec,
+    executorRunner)
+
+
+class BytesCodecTests(TestCase):
+    def test_roundTrip(self):
+        codec = BytesCodec()
+        self.assertEqual(codec.encode(b'abc'), (0, b'abc'))
+        self.assertEqual(codec.decode(0, b'abc'), b'abc')
+        self.assertEqual(codec.sizeOf(b'abc'), 3)
+
+    def test_sizeOfNonBytes(self):
+        """
+        The size of values other than bytes is unknown.
+        """
+        self.assertIdentical(BytesCodec().sizeOf(12345), None)
+
+    def test_onlyBytes(self):
+        """
+        Values other than bytes can't be encoded.
+        """
+        self.assertRaises(TypeError, BytesCodec().encode, u'abc')
+
+
+class PickleCodecTests(TestCase):
+    def test_bytes(self):
+        """
+        Bytes are stored as they are.
+        """
+        self.assertEqual(PickleCodec().encode(b'abc'), (0, b'abc'))
+        self.assertEqual(PickleCodec().decode(0, b'abc'), b'abc')
+
+    def test_text(self):
+        """
+        Text is stored as UTF-8.
+        """
+        codec = PickleCodec()
+        flags, data = codec.encode(u'caf\xe9')
+        self.assertEqual((flags, data), (FLAG_TEXT, b'caf\xc3\xa9'))
+        self.assertEqual(codec.decode(flags, data), u'caf\xe9')
+
+    def test_pickled(self):
+        """
+        Other values are pickled.
+        """
+        codec = PickleCodec()
+        flags, data = codec.encode({'a': [1, 2]})
+        self.assertEqual(flags, FLAG_PICKLE)
+        self.assertEqual(codec.decode(flags, data), {'a': [1, 2]})
+
+    def test_compressed(self):
+        """
+        Encoded values at least C{compressThreshold} bytes long are
+        compressed.
+        """
+        codec = PickleCodec(compressThreshold=10)
+        self.assertEqual(codec.encode(b'short'), (0, b'short'))
+        flags, data = codec.encode(u'x' * 100)
+        self.assertEqual(flags, FLAG_TEXT | FLAG_COMPRESSED)
+        self.assertEqual(zlib.decompress(data), b'x' * 100)
+        self.assertEqual(codec.decode(flags, data), u'x' * 100)
+
+    def test_sizeOf(self):
+        """
+        The size of bytes and text is known, but not the size of values which
+        are pickled.
+        """
+        codec = PickleCodec()
+        self.assertEqual(codec.sizeOf(b'abc'), 3)
+        self.assertEqual(codec.sizeOf(u'abcd'), 4)
+        self.assertIdentical(codec.sizeOf({}), None)
+
+
+class FakeFuture(object):
+    def __init__(self, f, args):
+        self.f = f
+        self.args = args
+
+    def result(self):
+        return self.f(*self.args)
+
+    def add_done_callback(self, callback):
+        callback(self)
+
+
+class FakeExecutor(object):
+    def submit(self, f, *args):
+        return FakeFuture(f, args)
+
+
+class FakeReactor(Clock):
+    def callFromThread(self, f, *args):
+        self.callLater(0, f, *args)
+
+
+class ExecutorRunnerTests(TestCase):
+    def test_result(self):
+        """
+        The result of the function is delivered on the reactor thread.
+        """
+        reactor = FakeReactor()
+        d = executorRunner(reactor, FakeExecutor())(lambda x: x * 2, 21)
+        self.assertNoResult(d)
+        reactor.advance(0)
+        self.assertEqual(self.successResultOf(d), 42)
+
+    def test_failure(self):
+        """
+        An exception raised by the function fails the C{Deferred}.
+        """
+        reactor = FakeReactor()
+        d = executorRunner(reactor, FakeExecutor())(lambda: 1 // 0)
+        reactor.advance(0)
+        self.failureResultOf(d, ZeroDivisionError)
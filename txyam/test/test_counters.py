@@ -0,0 +1,96 @@
+from twisted.trial.unittest import TestCase
+
+from txyam.counters import Counters
+from txyam.test.test_client import FakeError, clock, yam
+
+
+class CountersTests(TestCase):
+    def setUp(self):
+        self.clock = clock()
+        self.yam = yam(self.clock)
+        self.yam.connect()
+        self.counters = Counters(self.yam, flushInterval=1)
+        self.ep1 = self.yam._endpoints['fake:1']
+        self.ep2 = self.yam._endpoints['fake:2']
+
+    def test_aggregatesUntilFlushInterval(self):
+        """
+        Updates to the same key are summed and only sent after the flush
+        interval.
+        """
+        self.counters.increment(b'key1')
+        self.counters.increment(b'key1', 4)
+        self.counters.decrement(b'key5', 2)
+        self.counters.increment(b'key5', 3)
+        self.assertEqual(self.ep1.transport.value(), b'')
+        self.assertEqual(self.ep2.transport.value(), b'')
+        self.clock.advance(1)
+        self.assertEqual(self.ep1.transport.value(), b'incr key5 1\r\n')
+        self.assertEqual(self.ep2.transport.value(), b'incr key1 5\r\n')
+
+    def test_deferredsFireWithNewValue(self):
+        """
+        Every update's deferred fires with the counter's value after its batch
+        was applied.
+        """
+        d1 = self.counters.increment(b'key1')
+        d2 = self.counters.increment(b'key1')
+        self.clock.advance(1)
+        self.assertNoResult(d1)
+        self.ep2.proto.dataReceived(b'7\r\n')
+        self.assertEqual(self.successResultOf(d1), 7)
+        self.assertEqual(self.successResultOf(d2), 7)
+
+    def test_flushImmediately(self):
+        """
+        flush sends pending updates right away and cancels the scheduled
+        flush.
+        """
+        self.counters.increment(b'key5')
+        self.counters.flush()
+        self.assertEqual(self.ep1.transport.value(), b'incr key5 1\r\n')
+        self.ep1.transport.clear()
+        self.clock.advance(1)
+        self.assertEqual(self.ep1.transport.value(), b'')
+
+    def test_flushNothingPending(self):
+        """
+        Flushing with nothing pending sends nothing.
+        """
+        d = self.counters.flush()
+        self.assertEqual(self.successResultOf(d), {})
+        self.assertEqual(self.ep1.transport.value(), b'')
+        self.assertEqual(self.ep2.transport.value(), b'')
+
+    def test_flushFailure(self):
+        """
+        If incrementMultiple raises, the flush and every pending update fail.
+        """
+        def incrementMultiple(deltas, expireTime):
+            raise FakeError()
+
+        self.yam.incrementMultiple = incrementMultiple
+        d1 = self.counters.increment(b'key1')
+        d2 = self.counters.increment(b'key5')
+        self.failureResultOf(self.counters.flush(), FakeError)
+        self.failureResultOf(d1, FakeError)
+        self.failureResultOf(d2, FakeError)
+
+    def test_scheduledFlushFailure(self):
+        """
+        If a scheduled flush fails, the pending updates fail and later
+        updates are flushed again.
+        """
+        incrementMultiple = self.yam.incrementMultiple
+
+        def failing(deltas, expireTime):
+            raise FakeError()
+
+        self.yam.incrementMultiple = failing
+        d = self.counters.increment(b'key5')
+        self.clock.advance(1)
+        self.failureResultOf(d, FakeError)
+        self.yam.incrementMultiple = incrementMultiple
+        d = self.counters.increment(b'key5')
+        self.clock.advance(1)
+        self.assertEqual(self.ep1.transport.value(), b'incr key5 1\r\n')
@@ -0,0 +1,202 @@
+import hashlib
+
+from twisted.trial.unittest import TestCase
+
+from txyam.keys import KeyCollision, KeyEncoder
+from txyam.test.test_client import FakeError, clock, yam
+
+
+def sha1(key):
+    return hashlib.sha1(key).hexdigest().encode('ascii')
+
+
+class KeyEncoderTests(TestCase):
+    def test_prefix(self):
+        """
+        Keys are prefixed.
+        """
+        self.assertEqual(KeyEncoder(b'app:').encode(b'key1'), b'app:key1')
+
+    def test_text(self):
+        """
+        Text keys are encoded to UTF-8.
+        """
+        self.assertEqual(KeyEncoder().encode(u'k\xe9y'), b'k\xc3\xa9y')
+
+    def test_longKey(self):
+        """
+        Keys which would be too long are digested.
+        """
+        key = b'x' * 250
+        self.assertEqual(
+            KeyEncoder(b'app:').encode(key), b'app:#' + sha1(key))
+        self.assertEqual(KeyEncoder().encode(key), key)
+
+    def test_unsafeKey(self):
+        """
+        Keys containing whitespace or control characters are digested.
+        """
+        encoder = KeyEncoder()
+        self.assertEqual(encoder.encode(b'a key'), b'#' + sha1(b'a key'))
+        self.assertEqual(encoder.encode(b'a\nkey'), b'#' + sha1(b'a\nkey'))
+
+    def test_cached(self):
+        """
+        Encoded keys are cached.
+        """
+        encoder = KeyEncoder(b'app:')
+        first = encoder.encode(b'key1')
+        self.assertIs(encoder.encode(b'key1'), first)
+
+    def test_cacheSize(self):
+        """
+        The cache is emptied once it's full.
+        """
+        encoder = KeyEncoder(cacheSize=2)
+        encoder.encode(b'key1')
+        encoder.encode(b'key2')
+        encoder.encode(b'key3')
+        self.assertEqual(list(encoder._cache), [b'key3'])
+
+    def test_collision(self):
+        """
+        Two keys digested into the same key are detected.
+        """
+        encoder = KeyEncoder(hashFunction=lambda key: hashlib.sha1(b''))
+        encoder.encode(b'a key')
+        self.assertRaises(KeyCollision, encoder.encode, b'other key')
+
+    def test_prefixTooLong(self):
+        """
+        A prefix too long for digested keys to fit is rejected.
+        """
+        self.assertRaises(ValueError, KeyEncoder, b'x' * 220)
+
+
+class YamClientKeyEncodingTests(TestCase):
+    def setUp(self):
+        self.clock = clock()
+        self.yam = yam(self.clock, keyEncoder=KeyEncoder(b'p:'))
+        self.yam.connect()
+        self.ep1 = self.yam._endpoints['fake:1']
+        self.ep2 = self.yam._endpoints['fake:2']
+
+    def test_singleKey(self):
+        """
+        Keys passed to single-key commands are encoded.
+        """
+        self.yam.set(b'a key', b'x')
+        encoded = b'#' + sha1(b'a key')
+        self.assertIn(
+            b'set p:' + encoded + b' 0 0 1\r\nx\r\n',
+            [self.ep1.transport.value(), self.ep2.transport.value()])
+
+    def test_getMultiple(self):
+        """
+        getMultiple encodes keys and maps the results back to the original
+        keys.
+        """
+        d = self.yam.getMultiple([b'key1', b'key2'])
+        for ep in (self.ep1, self.ep2):
+            line = ep.transport.value()
+            if not line:
+                continue
+            response = b''
+            for key in line.split()[1:]:
+                response += b'VALUE ' + key + b' 0 1\r\n' + key[-1:] + b'\r\n'
+            ep.proto.dataReceived(response + b'END\r\n')
+        self.assertEqual(
+            self.successResultOf(d),
+            {b'key1': (0, b'1'), b'key2': (0, b'2')})
+
+    def test_incrementMultiple(self):
+        """
+        incrementMultiple encodes keys and maps the results back to the
+        original keys.
+        """
+        d = self.yam.incrementMultiple({b'key1': 2})
+        ep = self.ep1 if self.ep1.transport.value() else self.ep2
+        self.assertEqual(ep.transport.value(), b'incr p:key1 2\r\n')
+        ep.proto.dataReceived(b'4\r\n')
+        self.assertEqual(self.successResultOf(d), {b'key1': 4})
+
+
+class TextKeyTests(TestCase):
+    """
+    Text keys, which a L{KeyEncoder} accepts, work with the commands which
+    derive other keys from them.
+    """
+
+    def setUp(self):
+        self.clock = clock()
+        self.yam = yam(self.clock, keyEncoder=KeyEncoder(b'p:'))
+        self.yam._endpoints['fake:2'].failure = FakeError()
+        self.yam.connect()
+        self.assertEqual(len(self.flushLoggedErrors(FakeError)), 1)
+        self.yam._largeValueToken = lambda: b'tok'
+        self.ep = self.yam._endpoints['fake:1']
+
+    def test_setLarge(self):
+        """
+        setLarge stores the chunks of a text key under keys derived from its
+        UTF-8 encoding.
+        """
+        d = self.yam.setLarge(u'caf\xe9', b'x')
+        self.assertEqual(
+            self.ep.transport.value(),
+            b'set p:caf\xc3\xa9/tok/0 0 0 1\r\nx\r\n')
+        self.ep.transport.clear()
+        self.ep.proto.dataReceived(b'STORED\r\n')
+        self.assertEqual(
+            self.ep.transport.value(),
+            b'set p:caf\xc3\xa9 0 0 7\r\ntok:1:1\r\n')
+        self.ep.proto.dataReceived(b'STORED\r\n')
+        self.assertTrue(self.successResultOf(d))
+
+    def test_getLarge(self):
+        """
+        getLarge fetches the chunks of a text key.
+        """
+        d = self.yam.getLarge(u'caf\xe9')
+        self.ep.proto.dataReceived(
+            b'VALUE p:caf\xc3\xa9 0 7\r\ntok:1:1\r\nEND\r\n')
+        self.assertEqual(
+            self.ep.transport.value(),
+            b'get p:caf\xc3\xa9\r\nget p:caf\xc3\xa9/tok/0\r\n')
+        self.ep.proto.dataReceived(
+            b'VALUE p:caf\xc3\xa9/tok/0 0 1\r\nx\r\nEND\r\n')
+        self.assertEqual(self.successResultOf(d), (0, b'x'))
+
+    def test_deleteLarge(self):
+        """
+        deleteLarge deletes the chunks of a text key.
+        """
+        d = self.yam.deleteLarge(u'caf\xe9')
+        self.ep.proto.dataReceived(
+            b'VALUE p:caf\xc3\xa9 0 7\r\ntok:1:1\r\nEND\r\n')
+        self.assertEqual(
+            self.ep.transport.value(),
+            b'get p:caf\xc3\xa9\r\ndelete p:caf\xc3\xa9\r\n'
+            b'delete p:caf\xc3\xa9/tok/0\r\n')
+        self.ep.proto.dataReceived(b'DELETED\r\nDELETED\r\n')
+        self.assertTrue(self.successResultOf(d))
+
+    def test_namespace(self):
+        """
+        Namespaced text keys are prefixed with the namespace's generation,
+        and results are keyed by the original keys.
+        """
+        ns = self.yam.namespace(b'ns')
+        d = ns.set(u'caf\xe9', b'x')
+        self.ep.proto.dataReceived(b'VALUE p:ns:ns 0 1\r\n7\r\nEND\r\n')
+        self.assertEqual(
+            self.ep.transport.value(),
+            b'get p:ns:ns\r\nset p:ns:7:caf\xc3\xa9 0 0 1\r\nx\r\n')
+        self.ep.proto.dataReceived(b'STORED\r\n')
+        self.assertTrue(self.successResultOf(d))
+        self.ep.transport.clear()
+
+        d = ns.getMultiple([u'caf\xe9'])
+        self.ep.proto.dataReceived(
+            b'VALUE p:ns:7:caf\xc3\xa9 0 1\r\nx\r\nEND\r\n')
+        self.assertEqual(self.successResultOf(d), {u'caf\xe9': (0, b'x')})
@@ -0,0 +1,163 @@
+from twisted.internet import defer
+from twisted.internet.error import ConnectionDone
+from twisted.names import dns
+from twisted.python.failure import Failure
+from twisted.trial.unittest import TestCase
+
+from txyam.membership import CallbackMembership, FileMembership, SRVMembership
+from txyam.test.test_client import FakeEndpoint, clock, yam
+
+
+class FakeResolver(object):
+    def __init__(self):
+        self.result = None
+
+    def lookupService(self, name):
+        self.name = name
+        if isinstance(self.result, Exception):
+            return defer.fail(self.result)
+        return defer.succeed(self.result)
+
+
+def srvRecords(*targets):
+    answers = [
+        dns.RRHeader(type=dns.SRV, payload=dns.Record_SRV(
+            target=target, port=port))
+        for target, port in targets]
+    return answers, [], []
+
+
+class CallbackMembershipTests(TestCase):
+    def test_changes(self):
+        """
+        The callback is called only when the set of hosts changes.
+        """
+        changes = []
+        source = CallbackMembership(['a'])
+        source.start(changes.append)
+        source.setHosts(['a'])
+        source.setHosts(['b', 'a'])
+        source.setHosts(['a', 'b'])
+        self.assertEqual(changes, [['a'], ['b', 'a']])
+
+    def test_stop(self):
+        """
+        Once stopped, changes aren't reported anymore.
+        """
+        changes = []
+        source = CallbackMembership()
+        source.start(changes.append)
+        source.stop()
+        source.setHosts(['a'])
+        self.assertEqual(changes, [])
+
+    def test_followMembership(self):
+        """
+        A client following a membership source connects to added hosts and
+        drops removed ones.
+        """
+        self.clock = clock()
+        self.yam = yam(self.clock)
+        self.yam._endpoints['fake:3'] = FakeEndpoint()
+        self.yam.connect()
+        source = self.yam.followMembership(CallbackMembership())
+        source.setHosts(['fake:1', 'fake:3'])
+        self.assertTrue(self.yam._endpoints['fake:2'].transport.disconnecting)
+        self.assertEqual(
+            sorted(self.yam._protocols), ['fake:1', 'fake:2', 'fake:3'])
+        self.yam._endpoints['fake:2'].proto.connectionLost(
+            Failure(ConnectionDone()))
+        self.assertEqual(sorted(self.yam._protocols), ['fake:1', 'fake:3'])
+
+
+class FileMembershipTests(TestCase):
+    def setUp(self):
+        self.clock = clock()
+        self.path = self.mktemp()
+        self.changes = []
+        self.source = FileMembership(self.clock, self.path, interval=5)
+
+    def write(self, content):
+        with open(self.path, 'w') as f:
+            f.write(content)
+
+    def test_readsHosts(self):
+        """
+        Hosts are read from the file when started, skipping blank lines and
+        comments.
+        """
+        self.write('fake:1\n\n# comment\n  fake:2  \n')
+        self.source.start(self.changes.append)
+        self.assertEqual(self.changes, [['fake:1', 'fake:2']])
+        self.source.stop()
+
+    def test_pollsForChanges(self):
+        """
+        The file is reread every interval.
+        """
+        self.write('fake:1\n')
+        self.source.start(self.changes.append)
+        self.write('fake:1\nfake:2\n')
+        self.clock.advance(5)
+        self.assertEqual(self.changes, [['fake:1'], ['fake:1', 'fake:2']])
+        self.source.stop()
+
+    def test_emptyFile(self):
+        """
+        If the file lists no hosts, for example as it's being rewritten,
+        nothing changes.
+        """
+        self.write('fake:1\n')
+        self.source.start(self.changes.append)
+        self.write('# comment\n')
+        self.clock.advance(5)
+        self.write('')
+        self.clock.advance(5)
+        self.assertEqual(self.changes, [['fake:1']])
+        self.source.stop()
+
+    def test_unreadableFile(self):
+        """
+        If the file can't be read, the error is logged and nothing changes.
+        """
+        self.source.start(self.changes.append)
+        self.assertEqual(self.changes, [])
+        self.assertEqual(len(self.flushLoggedErrors(IOError)), 1)
+        self.source.stop()
+
+
+class SRVMembershipTests(TestCase):
+    def setUp(self):
+        self.clock = clock()
+        self.resolver = FakeResolver()
+        self.changes = []
+        self.source = SRVMembership(
+            self.clock, '_memcache._tcp.example.com', interval=60,
+            resolver=self.resolver)
+
+    def test_resolvesRecords(self):
+        """
+        SRV records are turned into TCP endpoint descriptions.
+        """
+        self.resolver.result = srvRecords(
+            (b'b.example.com', 11212), (b'a.example.com', 11211))
+        self.source.start(self.changes.append)
+        self.assertEqual(self.resolver.name, '_memcache._tcp.example.com')
+        self.assertEqual(self.changes, [[
+            'tcp:host=a.example.com:port=11211',
+            'tcp:host=b.example.com:port=11212',
+        ]])
+        self.source.stop()
+
+    def test_lookupFailure(self):
+        """
+        If the lookup fails, the error is logged and nothing changes.
+        """
+        self.resolver.result = srvRecords((b'a.example.com', 11211))
+        self.source.start(self.changes.append)
+        self.resolver.result = dns.DomainError()
+        self.clock.advance(60)
+        self.assertEqual(len(self.flushLoggedErrors(dns.DomainError)), 1)
+        self.assertEqual(
+            self.changes, [['tcp:host=a.example.com:port=11211']])
+        self.source.stop()
@@ -0,0 +1,112 @@
+from twisted.trial.unittest import TestCase
+
+from txyam.test.test_client import FakeError, clock, yam
+
+
+class NamespaceTests(TestCase):
+    def setUp(self):
+        self.clock = clock()
+        self.clock.advance(5)
+        self.yam = yam(self.clock)
+        self.yam._endpoints['fake:2'].failure = FakeError()
+        self.yam.connect()
+        self.assertEqual(len(self.flushLoggedErrors(FakeError)), 1)
+        self.ep = self.yam._endpoints['fake:1']
+        self.namespace = self.yam.namespace(b'user', cacheTime=1)
+
+    def respond(self, data):
+        self.ep.transport.clear()
+        self.ep.proto.dataReceived(data)
+
+    def test_getFetchesGenerationFirst(self):
+        """
+        With no known generation, the generation is fetched before the data
+        keys.
+        """
+        d = self.namespace.get(b'key1')
+        self.assertEqual(self.ep.transport.value(), b'get ns:user\r\n')
+        self.respond(b'VALUE ns:user 0 1\r\n7\r\nEND\r\n')
+        self.assertEqual(self.ep.transport.value(), b'get user:7:key1\r\n')
+        self.respond(b'VALUE user:7:key1 0 1\r\nx\r\nEND\r\n')
+        self.assertEqual(self.successResultOf(d), (0, b'x'))
+
+    def test_missingGenerationIsInitialized(self):
+        """
+        If the generation key is missing, it is added starting from the
+        current time in milliseconds.
+        """
+        d = self.namespace.set(b'key1', b'x')
+        self.respond(b'END\r\n')
+        self.assertEqual(
+            self.ep.transport.value(), b'add ns:user 0 0 4\r\n5000\r\n')
+        self.respond(b'STORED\r\n')
+        self.assertEqual(
+            self.ep.transport.value(), b'set user:5000:key1 0 0 1\r\nx\r\n')
+        self.respond(b'STORED\r\n')
+        self.assertIs(self.successResultOf(d), True)
+
+    def test_freshGenerationIsCached(self):
+        """
+        Within the cache time, the generation isn't refetched.
+        """
+        self.namespace.get(b'key1')
+        self.respond(b'VALUE ns:user 0 1\r\n7\r\nEND\r\n')
+        self.respond(b'END\r\n')
+        self.namespace.delete(b'key1')
+        self.assertEqual(self.ep.transport.value(), b'delete user:7:key1\r\n')
+
+    def test_staleGenerationFetchedInSameBatch(self):
+        """
+        Once the cached generation is stale, it is refetched along with the
+        data keys and the data is used if the generation didn't change.
+        """
+        self.namespace.get(b'key1')
+        self.respond(b'VALUE ns:user 0 1\r\n7\r\nEND\r\n')
+        self.respond(b'END\r\n')
+        self.clock.advance(1)
+        d = self.namespace.getMultiple([b'key1'])
+        self.assertEqual(
+            self.ep.transport.value(), b'get user:7:key1 ns:user\r\n')
+        self.respond(b'VALUE user:7:key1 0 1\r\nx\r\n'
+                     b'VALUE ns:user 0 1\r\n7\r\nEND\r\n')
+        self.assertEqual(self.ep.transport.value(), b'')
+        self.assertEqual(self.successResultOf(d), {b'key1': (0, b'x')})
+
+    def test_staleGenerationChanged(self):
+        """
+        If the refetched generation changed, the data keys are fetched again
+        under the new generation.
+        """
+        self.namespace.get(b'key1')
+        self.respond(b'VALUE ns:user 0 1\r\n7\r\nEND\r\n')
+        self.respond(b'END\r\n')
+        self.clock.advance(1)
+        d = self.namespace.getMultiple([b'key1'])
+        self.respond(b'VALUE user:7:key1 0 1\r\nx\r\n'
+                     b'VALUE ns:user 0 1\r\n8\r\nEND\r\n')
+        self.assertEqual(self.ep.transport.value(), b'get user:8:key1\r\n')
+        self.respond(b'END\r\n')
+        self.assertEqual(self.successResultOf(d), {b'key1': (0, None)})
+
+    def test_invalidate(self):
+        """
+        invalidate increments the generation and caches the new one.
+        """
+        d = self.namespace.invalidate()
+        self.assertEqual(self.ep.transport.value(), b'incr ns:user 1\r\n')
+        self.respond(b'8\r\n')
+        self.assertEqual(self.successResultOf(d), b'8')
+        self.namespace.delete(b'key1')
+        self.assertEqual(self.ep.transport.value(), b'delete user:8:key1\r\n')
+
+    def test_invalidateMissingGeneration(self):
+        """
+        Invalidating a namespace whose generation was evicted starts a new
+        generation.
+        """
+        d = self.namespace.invalidate()
+        self.respond(b'NOT_FOUND\r\n')
+        self.assertEqual(
+            self.ep.transport.value(), b'add ns:user 0 0 4\r\n5000\r\n')
+        self.respond(b'STORED\r\n')
+        self.assertEqual(self.successResultOf(d), b'5000')
@@ -0,0 +1,88 @@
+from twisted.trial.unittest import TestCase
+
+from txyam.test.test_client import FakeError, clock, yam
+
+
+def recordWrites(ep):
+    writes = []
+    write = ep.transport.write
+
+    def recordingWrite(data):
+        writes.append(data)
+        write(data)
+    ep.transport.write = recordingWrite
+    return writes
+
+
+class PipelineTests(TestCase):
+    def setUp(self):
+        self.clock = clock()
+        self.yam = yam(self.clock)
+        self.yam.connect()
+        self.ep1 = self.yam._endpoints['fake:1']
+        self.ep2 = self.yam._endpoints['fake:2']
+
+    def test_oneWritePerHost(self):
+        """
+        Each host's operations are sent with a single write.
+        """
+        writes1 = recordWrites(self.ep1)
+        writes2 = recordWrites(self.ep2)
+        pipeline = self.yam.pipeline()
+        pipeline.get(b'key1').set(b'key5', b'5').delete(b'key2')
+        self.assertEqual(len(pipeline), 3)
+        pipeline.execute()
+        self.assertEqual(writes1, [b'set key5 0 0 1\r\n5\r\n'])
+        self.assertEqual(writes2, [b'get key1\r\ndelete key2\r\n'])
+        self.assertEqual(len(pipeline), 0)
+
+    def test_consecutiveGetsCoalesced(self):
+        """
+        Consecutive gets to the same host are sent as one multi-key get, but
+        the order of operations is kept.
+        """
+        pipeline = self.yam.pipeline()
+        pipeline.get(b'key1').get(b'key2').set(b'key3', b'3').get(b'key4')
+        pipeline.execute()
+        self.assertEqual(
+            self.ep2.transport.value(),
+            b'get key1 key2\r\nset key3 0 0 1\r\n3\r\nget key4\r\n')
+
+    def test_getsWithIdentifierNotMixed(self):
+        """
+        Gets with and without identifiers are sent separately.
+        """
+        pipeline = self.yam.pipeline()
+        pipeline.get(b'key1').get(b'key2', withIdentifier=True)
+        pipeline.execute()
+        self.assertEqual(
+            self.ep2.transport.value(), b'get key1\r\ngets key2\r\n')
+
+    def test_results(self):
+        """
+        execute fires with every operation's result, in the order they were
+        queued.
+        """
+        pipeline = self.yam.pipeline()
+        pipeline.get(b'key1').set(b'key5', b'5').get(b'key2')
+        pipeline.delete(b'key3').increment(b'key4', 2)
+        d = pipeline.execute()
+        self.ep2.proto.dataReceived(
+            b'VALUE key1 0 1\r\n1\r\nEND\r\nDELETED\r\n4\r\n')
+        self.assertNoResult(d)
+        self.ep1.proto.dataReceived(b'STORED\r\n')
+        self.assertEqual(
+            self.successResultOf(d),
+            [(0, b'1'), True, (0, None), True, 4])
+
+    def test_resultsWithNoClients(self):
+        """
+        If there are no clients available, every result is None.
+        """
+        yam2 = yam(self.clock)
+        yam2._endpoints['fake:1'].failure = FakeError()
+        yam2._endpoints['fake:2'].failure = FakeError()
+        yam2.connect()
+        self.assertEqual(len(self.flushLoggedErrors(FakeError)), 2)
+        d = yam2.pipeline().get(b'key1').set(b'key5', b'5').execute()
+        self.assertEqual(self.successResultOf(d), [None, None])
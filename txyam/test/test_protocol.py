@@ -0,0 +1,194 @@
+from twisted.internet.error import ConnectionDone
+from twisted.internet.task import Clock
+from twisted.python.failure import Failure
+from twisted.test import test_memcache
+from twisted.test.proto_helpers import StringTransportWithDisconnection
+from twisted.trial.unittest import TestCase
+
+from txyam.factory import SlottedMemCacheClientFactory
+from txyam.protocol import CommandRecord, MemCacheProtocol
+from txyam.test import test_client
+
+
+def connectedProtocol(test, **kw):
+    test.proto = MemCacheProtocol(**kw)
+    test.clock = Clock()
+    test.proto.callLater = test.clock.callLater
+    test.transport = StringTransportWithDisconnection()
+    test.transport.protocol = test.proto
+    test.proto.makeConnection(test.transport)
+
+
+class MemCacheProtocolCompatibilityTests(test_memcache.MemCacheTests):
+    """
+    L{MemCacheProtocol} passes Twisted's own memcache protocol tests.
+    """
+
+    def setUp(self):
+        connectedProtocol(self)
+
+
+class MemCacheProtocolFailureCompatibilityTests(
+        test_memcache.CommandFailureTests):
+    def setUp(self):
+        connectedProtocol(self)
+        self.transport.loseConnection()
+
+
+class CommandRecordTests(TestCase):
+    def setUp(self):
+        connectedProtocol(self)
+
+    def test_slots(self):
+        """
+        Command records don't have an instance dictionary.
+        """
+        self.assertFalse(hasattr(CommandRecord(), '__dict__'))
+
+    def test_reused(self):
+        """
+        A command's record is reused by the next command once it's completed.
+        """
+        d = self.proto.get(b'foo')
+        record = self.proto._current[0]
+        self.proto.dataReceived(b'VALUE foo 0 3\r\nbar\r\nEND\r\n')
+        self.assertEqual(self.successResultOf(d), (0, b'bar'))
+        self.assertEqual(list(self.proto._pool), [record])
+        self.assertIdentical(record.key, None)
+        self.assertIdentical(record.value, None)
+
+        d = self.proto.set(b'foo', b'baz')
+        self.assertIdentical(self.proto._current[0], record)
+        self.assertEqual(len(self.proto._pool), 0)
+        self.proto.dataReceived(b'STORED\r\n')
+        self.assertTrue(self.successResultOf(d))
+
+    def test_reusedFromCallback(self):
+        """
+        A command issued from the callback of a completed command can reuse
+        its record.
+        """
+        issued = []
+
+        def again(result):
+            issued.append(self.proto.get(b'foo'))
+            return result
+
+        d = self.proto.get(b'foo').addCallback(again)
+        record = self.proto._current[0]
+        self.proto.dataReceived(b'END\r\n')
+        self.assertEqual(self.successResultOf(d), (0, None))
+        self.assertIdentical(self.proto._current[0], record)
+        self.proto.dataReceived(b'VALUE foo 0 3\r\nbar\r\nEND\r\n')
+        self.assertEqual(self.successResultOf(issued[0]), (0, b'bar'))
+
+    def test_reusedAfterFailure(self):
+        """
+        Records of commands which failed are reused too.
+        """
+        d = self.proto.get(b'foo')
+        self.proto.connectionLost(Failure(ConnectionDone()))
+        self.failureResultOf(d, ConnectionDone)
+        self.assertEqual(len(self.proto._pool), 1)
+
+    def test_poolSize(self):
+        """
+        At most C{poolSize} idle records are kept.
+        """
+        connectedProtocol(self, poolSize=2)
+        deferreds = [self.proto.delete(b'foo') for i in range(4)]
+        self.proto.dataReceived(b'DELETED\r\n' * 4)
+        for d in deferreds:
+            self.assertTrue(self.successResultOf(d))
+        self.assertEqual(len(self.proto._pool), 2)
+
+    def test_noReuse(self):
+        """
+        Records aren't reused if C{reuseCommands} is false.
+        """
+        connectedProtocol(self, reuseCommands=False)
+        d = self.proto.delete(b'foo')
+        self.proto.dataReceived(b'DELETED\r\n')
+        self.assertTrue(self.successResultOf(d))
+        self.assertEqual(len(self.proto._pool), 0)
+
+
+def slottedYam(clock):
+    return test_client.yam(clock, factoryClass=SlottedMemCacheClientFactory)
+
+
+class SlottedYamClientTests(test_client.YamClientTests):
+    """
+    L{test_client.YamClientTests}, using the protocol from
+    L{txyam.protocol}.
+    """
+
+    def setUp(self):
+        self.clock = test_client.clock()
+        self.yam = slottedYam(self.clock)
+
+    def test_slottedProtocol(self):
+        """
+        The client's connections use the slotted protocol.
+        """
+        self.yam.connect()
+        proto = self.yam._endpoints['fake:1'].proto
+        self.assertIsInstance(proto, MemCacheProtocol)
+
+
+class SlottedYamClientMetaTests(test_client.YamClientMetaTests):
+    def setUp(self):
+        self.clock = test_client.clock()
+        self.yam = slottedYam(self.clock)
+        self.yam.connect()
+        self.ep = self.yam._endpoints['fake:2']
+
+
+class SlottedYamClientLargeValueTests(test_client.YamClientLargeValueTests):
+    def setUp(self):
+        self.clock = test_client.clock()
+        self.yam = slottedYam(self.clock)
+        self.yam.largeChunkSize = 4
+        self.yam._largeValueToken = lambda: b'tok'
+        self.yam._endpoints['fake:2'].failure = test_client.FakeError()
+        self.yam.connect()
+        self.assertEqual(
+            len(self.flushLoggedErrors(test_client.FakeError)), 1)
+        self.ep = self.yam._endpoints['fake:1']
+
+
+class SlottedCommandTestsMixin(object):
+    def setUp(self):
+        self.clock = test_client.clock()
+        self.yam = slottedYam(self.clock)
+
+
+class SlottedCommandGetTests(
+        SlottedCommandTestsMixin, test_client.YamClientCommandGetTests):
+    pass
+
+
+class SlottedCommandSetTests(
+        SlottedCommandTestsMixin, test_client.YamClientCommandSetTests):
+    pass
+
+
+class SlottedCommandIncrementTests(
+        SlottedCommandTestsMixin, test_client.YamClientCommandIncrementTests):
+    pass
+
+
+class SlottedCommandDeleteTests(
+        SlottedCommandTestsMixin, test_client.YamClientCommandDeleteTests):
+    pass
+
+
+class SlottedCommandTouchTests(
+        SlottedCommandTestsMixin, test_client.YamClientCommandTouchTests):
+    pass
+
+
+class SlottedCommandGetAndTouchTests(
+        SlottedCommandTestsMixin,
+        test_client.YamClientCommandGetAndTouchTests):
+    pass
@@ -0,0 +1,243 @@
+import re
+
+from twisted.trial.unittest import TestCase
+
+from txyam.client import YamClient
+from txyam.codec import PickleCodec
+from txyam.router import NoRoute, Router
+from txyam.test.test_client import clock, yam
+
+
+class RouterTests(TestCase):
+    def setUp(self):
+        self.clock = clock()
+        self.sessions = yam(self.clock)
+        self.fragments = yam(self.clock, codec=PickleCodec())
+        self.router = Router(
+            self.clock,
+            {'sessions': self.sessions, 'fragments': self.fragments},
+            [(b'session:', 'sessions'), (re.compile(b'frag(ment)?:'),
+                                         'fragments')],
+            default='sessions')
+        self.router.connect()
+
+    def transport(self, pool, host):
+        return pool._endpoints[host].transport
+
+    def proto(self, pool, host):
+        return pool._endpoints[host].proto
+
+    def test_poolFor(self):
+        """
+        Keys are routed by prefix or pattern, in order, falling back on the
+        default pool.
+        """
+        self.assertEqual(self.router.poolFor(b'session:a'), 'sessions')
+        self.assertEqual(self.router.poolFor(b'frag:a'), 'fragments')
+        self.assertEqual(self.router.poolFor(b'fragment:a'), 'fragments')
+        self.assertEqual(self.router.poolFor(b'other'), 'sessions')
+        self.assertIs(self.router.clientFor(b'frag:a'), self.fragments)
+
+    def test_noRoute(self):
+        """
+        Without a default pool, commands for keys no route matches fail.
+        """
+        self.router.default = None
+        self.assertRaises(NoRoute, self.router.poolFor, b'other')
+        self.failureResultOf(self.router.get(b'other'), NoRoute)
+        self.failureResultOf(
+            self.router.getMultiple([b'frag:a', b'other']), NoRoute)
+
+    def test_unknownPool(self):
+        """
+        Routes and the default must name known pools.
+        """
+        self.assertRaises(ValueError, self.router.addRoute, b'x', 'nope')
+        self.assertRaises(ValueError, Router, self.clock, {}, default='nope')
+
+    def test_routeCached(self):
+        """
+        Adding a route clears the cached routes.
+        """
+        self.assertEqual(self.router.poolFor(b'counter:a'), 'sessions')
+        self.router.addRoute(b'counter:', 'fragments')
+        self.assertEqual(self.router.poolFor(b'counter:a'), 'fragments')
+
+    def test_singleKeyCommand(self):
+        """
+        Single key commands go to the key's pool.
+        """
+        d = self.router.set(b'frag:1', b'abc')
+        proto = self.fragments.getClient(b'frag:1')
+        self.assertEqual(
+            proto.transport.value(), b'set frag:1 0 0 3\r\nabc\r\n')
+        proto.dataReceived(b'STORED\r\n')
+        self.assertTrue(self.successResultOf(d))
+
+    def test_getMultiple(self):
+        """
+        getMultiple sends each key to its pool's host for it, and merges the
+        results.
+        """
+        keys = [b'session:1', b'session:2', b'frag:1', b'frag:2']
+        d = self.router.getMultiple(keys)
+        protos = {}
+        for key, pool in zip(keys, [self.sessions] * 2 + [self.fragments] * 2):
+            protos.setdefault(pool.getClient(key), []).append(key)
+        for proto, ks in protos.items():
+            self.assertEqual(
+                proto.transport.value(), b'get ' + b' '.join(ks) + b'\r\n')
+            self.assertNoResult(d)
+            proto.dataReceived(b''.join(
+                b'VALUE %s 0 1\r\nx\r\n' % (key,) for key in ks
+                if key != b'frag:2') + b'END\r\n')
+        self.assertEqual(self.successResultOf(d), {
+            b'session:1': (0, b'x'),
+            b'session:2': (0, b'x'),
+            b'frag:1': (0, b'x'),
+            b'frag:2': (0, None),
+        })
+        metrics = self.router.metrics
+        self.assertEqual(
+            (metrics['sessions'].requests, metrics['sessions'].keys,
+             metrics['sessions'].hits, metrics['sessions'].misses),
+            (1, 2, 2, 0))
+        self.assertEqual(
+            (metrics['fragments'].requests, metrics['fragments'].keys,
+             metrics['fragments'].hits, metrics['fragments'].misses),
+            (1, 2, 1, 1))
+        self.assertEqual(metrics['fragments'].hitRatio, 0.5)
+
+    def test_setMultiple(self):
+        """
+        setMultiple splits the items between pools.
+        """
+        d = self.router.setMultiple({b'session:1': b'a', b'frag:1': b'b'})
+        for pool, key in [(self.sessions, b'session:1'),
+                          (self.fragments, b'frag:1')]:
+            proto = pool.getClient(key)
+            self.assertTrue(
+                proto.transport.value().startswith(b'set ' + key + b' '))
+            proto.dataReceived(b'STORED\r\n')
+        self.assertEqual(
+            self.successResultOf(d), {b'session:1': True, b'frag:1': True})
+
+    def test_valuesUsePoolCodec(self):
+        """
+        Values are encoded with the codec of their key's pool.
+        """
+        d = self.router.setValues({b'frag:1': u'abc'})
+        proto = self.fragments.getClient(b'frag:1')
+        self.assertEqual(
+            proto.transport.value(), b'set frag:1 4 0 3\r\nabc\r\n')
+        proto.dataReceived(b'STORED\r\n')
+        self.assertEqual(self.successResultOf(d), {b'frag:1': True})
+        self.failureResultOf(
+            self.router.setValue(b'session:1', u'abc'), TypeError)
+
+    def test_getValueMetrics(self):
+        """
+        getValue counts hits and misses, and fires with the default on a
+        miss.
+        """
+        d = self.router.getValue(b'frag:1', default=5)
+        self.fragments.getClient(b'frag:1').dataReceived(b'END\r\n')
+        self.assertEqual(self.successResultOf(d), 5)
+        self.assertEqual(self.router.metrics['fragments'].misses, 1)
+
+    def test_timeAndFailures(self):
+        """
+        The time commands take and their failures are counted per pool.
+        """
+        d = self.router.get(b'session:1')
+        self.clock.advance(2)
+        self.sessions.getClient(b'session:1').dataReceived(b'END\r\n')
+        self.successResultOf(d)
+        metrics = self.router.metrics['sessions']
+        self.assertEqual(metrics.totalTime, 2)
+        self.assertEqual(metrics.averageTime, 2)
+
+        d = self.router.setValue(b'session:1', u'text')
+        self.failureResultOf(d, TypeError)
+        self.assertEqual(metrics.failures, 1)
+        self.assertEqual(metrics.requests, 2)
+
+    def test_errorsAreFailures(self):
+        """
+        Commands which YamClient turned into C{None} because of an error
+        count as failures, not misses.
+        """
+        proto = self.sessions.getClient(b'session:1')
+        gets = [self.router.get(b'session:1'),
+                self.router.getValue(b'session:1', default=5),
+                self.router.set(b'session:1', b'abc')]
+        proto.dataReceived(b'SERVER_ERROR oops\r\n' * 3)
+        self.flushLoggedErrors()
+        self.assertEqual(
+            [self.successResultOf(d) for d in gets], [None, 5, None])
+        metrics = self.router.metrics['sessions']
+        self.assertEqual(
+            (metrics.requests, metrics.hits, metrics.misses,
+             metrics.failures),
+            (3, 0, 0, 3))
+        self.assertEqual(metrics.hitRatio, None)
+
+    def test_getMultipleHostFailure(self):
+        """
+        The keys of hosts which failed during a getMultiple aren't counted as
+        misses, and the fetch counts as a failure.
+        """
+        keys = [b'session:%d' % (i,) for i in range(10)]
+        d = self.router.getMultiple(keys)
+        protos = {}
+        for key in keys:
+            protos.setdefault(self.sessions.getClient(key), []).append(key)
+        self.assertEqual(len(protos), 2)
+        (failed, failedKeys), (answered, answeredKeys) = protos.items()
+        failed.dataReceived(b'SERVER_ERROR oops\r\n')
+        self.flushLoggedErrors()
+        answered.dataReceived(b'END\r\n')
+        self.assertEqual(sorted(self.successResultOf(d)), answeredKeys)
+        metrics = self.router.metrics['sessions']
+        self.assertEqual(
+            (metrics.keys, metrics.hits, metrics.misses, metrics.failures),
+            (10, 0, len(answeredKeys), 1))
+
+    def test_getMultipleRepeatedKey(self):
+        """
+        A key fetched twice by a getMultiple isn't mistaken for a failure.
+        """
+        d = self.router.getMultiple([b'frag:1', b'frag:1'])
+        self.fragments.getClient(b'frag:1').dataReceived(
+            b'VALUE frag:1 0 1\r\nx\r\nEND\r\n')
+        self.assertEqual(self.successResultOf(d), {b'frag:1': (0, b'x')})
+        metrics = self.router.metrics['fragments']
+        self.assertEqual((metrics.hits, metrics.failures), (1, 0))
+
+    def test_multipleWriteFailures(self):
+        """
+        Each key of setMultiple, deleteMultiple or setValues whose command
+        failed counts as a failure.
+        """
+        proto = self.sessions.getClient(b'session:1')
+        ds = [self.router.setMultiple({b'session:1': b'a'}),
+              self.router.deleteMultiple([b'session:1']),
+              self.router.setValues({b'session:1': b'a'})]
+        proto.dataReceived(b'SERVER_ERROR oops\r\n' * 3)
+        self.flushLoggedErrors()
+        for d in ds:
+            self.assertEqual(self.successResultOf(d), {b'session:1': None})
+        metrics = self.router.metrics['sessions']
+        self.assertEqual((metrics.requests, metrics.failures), (3, 3))
+
+    def test_fromConfig(self):
+        """
+        fromConfig creates a client for each pool.
+        """
+        router = Router.fromConfig(
+            self.clock, {'a': {'hosts': ['tcp:localhost:11211'],
+                               'codec': PickleCodec()}},
+            [(b'a:', 'a')])
+        self.assertIsInstance(router.pools['a'], YamClient)
+        self.assertIsInstance(router.pools['a'].codec, PickleCodec)
+        self.assertEqual(router.poolFor(b'a:1'), 'a')
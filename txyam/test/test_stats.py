@@ -0,0 +1,231 @@
+from twisted.trial.unittest import TestCase
+
+from txyam import stats
+from txyam.test.test_client import FakeEndpoint, FakeError, clock, yam
+
+
+def statsResponse(**values):
+    return b''.join(
+        b'STAT ' + key.encode() + b' ' + str(value).encode() + b'\r\n'
+        for key, value in sorted(values.items())) + b'END\r\n'
+
+
+SLABS = (b'STAT 1:chunk_size 96\r\nSTAT 1:used_chunks 10\r\n'
+         b'STAT active_slabs 1\r\nSTAT total_malloced 80\r\nEND\r\n')
+ITEMS = b'STAT items:1:number 10\r\nSTAT items:1:evicted 2\r\nEND\r\n'
+
+
+class ParsingTests(TestCase):
+    def test_parseStatValue(self):
+        """
+        Numeric stat values are converted to numbers.
+        """
+        self.assertEqual(stats.parseStatValue(b'12'), 12)
+        self.assertEqual(stats.parseStatValue(b'0.5'), 0.5)
+        self.assertEqual(stats.parseStatValue(b'1.6.9'), b'1.6.9')
+
+    def test_parseSlabStats(self):
+        """
+        Per-slab stats are grouped by slab class id.
+        """
+        self.assertEqual(
+            stats.parseSlabStats({
+                b'1:chunk_size': b'96',
+                b'2:chunk_size': b'120',
+                b'active_slabs': b'2',
+            }),
+            ({1: {b'chunk_size': 96}, 2: {b'chunk_size': 120}},
+             {b'active_slabs': 2}))
+
+    def test_parseItemStats(self):
+        """
+        The items: prefix of C{stats items} keys is stripped.
+        """
+        self.assertEqual(
+            stats.parseSlabStats({b'items:1:number': b'5'}),
+            ({1: {b'number': 5}}, {}))
+
+
+class StatsCollectorTests(TestCase):
+    def setUp(self):
+        self.clock = clock()
+        self.yam = yam(self.clock)
+        self.yam._endpoints['fake:2'].failure = FakeError()
+        self.yam.connect()
+        self.assertEqual(len(self.flushLoggedErrors(FakeError)), 1)
+        self.ep = self.yam._endpoints['fake:1']
+        self.collector = stats.StatsCollector(self.yam, interval=10)
+
+    def respond(self, **values):
+        self.ep.proto.dataReceived(statsResponse(**values))
+        self.ep.proto.dataReceived(SLABS)
+        self.ep.proto.dataReceived(ITEMS)
+
+    def test_pollQuery(self):
+        """
+        Polling issues stats, stats slabs and stats items queries.
+        """
+        self.collector.poll()
+        self.assertEqual(
+            sorted(self.ep.transport.value().splitlines()),
+            [b'stats', b'stats items', b'stats slabs'])
+
+    def test_pollAnswer(self):
+        """
+        Polling parses every host's stats and computes its signals.
+        """
+        d = self.collector.poll()
+        self.respond(uptime=10, get_hits=3, get_misses=1, bytes=50,
+                     limit_maxbytes=100, version='1.6.9')
+        cluster = self.successResultOf(d)
+        host = cluster.hosts['fake:1']
+        self.assertEqual(host.stats[b'version'], b'1.6.9')
+        self.assertEqual(host.slabs, {1: {b'chunk_size': 96,
+                                          b'used_chunks': 10}})
+        self.assertEqual(host.items, {1: {b'number': 10, b'evicted': 2}})
+        self.assertEqual(
+            host.slabTotals, {b'active_slabs': 1, b'total_malloced': 80})
+        self.assertEqual(host.hitRatio, 0.75)
+        self.assertEqual(host.memoryPressure, 0.5)
+        self.assertEqual(host.mallocedPressure, 0.8)
+        self.assertEqual(host.evictingSlabs(), [1])
+        self.assertEqual(host.rates, {})
+        self.assertEqual(cluster.hitRatio, 0.75)
+        self.assertEqual(cluster.pressuredHosts(0.5), ['fake:1'])
+
+    def test_rates(self):
+        """
+        Rates are computed from the difference between two polls.
+        """
+        self.collector.poll()
+        self.respond(uptime=10, get_hits=3, get_misses=1, evictions=0)
+        d = self.collector.poll()
+        self.respond(uptime=20, get_hits=13, get_misses=11, evictions=5)
+        cluster = self.successResultOf(d)
+        host = cluster.hosts['fake:1']
+        self.assertEqual(host.rates[b'get_hits'], 1.0)
+        self.assertEqual(host.recentHitRatio, 0.5)
+        self.assertEqual(host.evictionRate, 0.5)
+        self.assertEqual(cluster.evictionRate, 0.5)
+        self.assertEqual(cluster.evictingHosts(), ['fake:1'])
+
+    def test_ratesAfterRestart(self):
+        """
+        No rates are reported if a counter went backwards.
+        """
+        self.collector.poll()
+        self.respond(uptime=10, get_hits=30)
+        d = self.collector.poll()
+        self.respond(uptime=20, get_hits=3)
+        self.assertEqual(self.successResultOf(d).hosts['fake:1'].rates, {})
+
+    def test_periodicPolling(self):
+        """
+        Once started, the collector polls every interval and notifies its
+        observers.
+        """
+        observed = []
+        self.collector.addObserver(observed.append)
+        self.collector.start()
+        self.respond(uptime=10)
+        self.assertEqual(len(observed), 1)
+        self.ep.transport.clear()
+        self.clock.advance(10)
+        # fake:2 is still being reconnected to in the meantime
+        self.flushLoggedErrors(FakeError)
+        self.assertEqual(len(self.ep.transport.value().splitlines()), 3)
+        self.respond(uptime=20)
+        self.assertEqual(len(observed), 2)
+        self.assertIs(self.collector.latest, observed[-1])
+        self.collector.stop()
+
+
+class SetWeightTests(TestCase):
+    def setUp(self):
+        self.clock = clock()
+        self.yam = yam(self.clock)
+        self.yam.connect()
+
+    def test_setWeight(self):
+        """
+        setWeight changes a host's weight in the consistent hash, and keeps it
+        when the host joins the hash again.
+        """
+        ring = self.yam._consistentHash
+        self.yam.setWeight('fake:2', 0.5)
+        self.assertEqual(ring.weights['fake:2'], 0.5)
+        self.assertEqual(ring.nodes.count('fake:2'), 1)
+        self.yam.setHosts(['fake:1'])
+        self.yam.setHosts(['fake:1', 'fake:2'])
+        self.assertEqual(ring.weights['fake:2'], 0.5)
+
+    def test_setWeightFromObserver(self):
+        """
+        A stats observer can shift keys away from hosts under memory
+        pressure.
+        """
+        def observer(cluster):
+            for host in cluster.pressuredHosts(0.9):
+                self.yam.setWeight(host, 0.25)
+
+        collector = stats.StatsCollector(self.yam)
+        collector.addObserver(observer)
+        d = collector.poll()
+        for host, used in [('fake:1', 95), ('fake:2', 50)]:
+            proto = self.yam._endpoints[host].proto
+            proto.dataReceived(statsResponse(bytes=used, limit_maxbytes=100))
+            proto.dataReceived(SLABS)
+            proto.dataReceived(ITEMS)
+        self.successResultOf(d)
+        self.assertEqual(self.yam._consistentHash.weights['fake:1'], 0.25)
+        self.assertEqual(self.yam._consistentHash.weights['fake:2'], 1)
+
+    def test_invalidWeight(self):
+        """
+        Weights must be large enough to give the host a point in the
+        consistent hash.
+        """
+        self.assertRaises(ValueError, self.yam.setWeight, 'fake:1', 0)
+        self.assertRaises(ValueError, self.yam.setWeight, 'fake:1', 0.02)
+        self.yam.setWeight('fake:1', self.yam.minWeight)
+        self.assertTrue(self.yam._consistentHash.keys)
+        self.assertEqual(
+            set(self.yam._consistentHash.key_node.values()),
+            set(['fake:1', 'fake:2']))
+
+    def test_rampStaysOnRing(self):
+        """
+        A host with a small weight keeps a point in the consistent hash while
+        it's ramped up.
+        """
+        self.yam = yam(self.clock, warmup=True, warmupDuration=8,
+                       warmupSteps=4)
+        self.yam.setWeight('fake:1', 0.05)
+        self.yam.connect()
+        self.yam._endpoints['fake:1'].proto.dataReceived(
+            b'VERSION 1.6.9\r\n')
+        self.assertEqual(
+            self.yam._consistentHash.weights['fake:1'], self.yam.minWeight)
+        self.assertEqual(
+            set(self.yam._consistentHash.key_node.values()), set(['fake:1']))
+
+    def test_migrationKeepsWeights(self):
+        """
+        The consistent hash kept for a migration window has the weights set
+        with setWeight, so reads fall back on the host which really owned the
+        key.
+        """
+        ep1 = self.yam._endpoints['fake:1']
+        ep2 = self.yam._endpoints['fake:2']
+        ep3 = self.yam._endpoints['fake:3'] = FakeEndpoint()
+        self.yam.setWeight('fake:2', 0.25)
+        # key27 belongs to fake:1 now; it would belong to fake:2 if both had
+        # the same weight.
+        self.assertIs(self.yam.getClient(b'key27'), ep1.proto)
+        self.yam.setHosts(['fake:1', 'fake:2', 'fake:3'], migrationWindow=60)
+        d = self.yam.get(b'key27')
+        ep3.proto.dataReceived(b'END\r\n')
+        self.assertEqual(ep1.transport.value(), b'get key27\r\n')
+        self.assertEqual(ep2.transport.value(), b'')
+        ep1.proto.dataReceived(b'VALUE key27 0 1\r\nx\r\nEND\r\n')
+        self.assertEqual(self.successResultOf(d), (0, b'x'))
@@ -0,0 +1,65 @@
+from twisted.internet import defer
+from twisted.python.failure import Failure
+from twisted.trial.unittest import TestCase
+
+from txyam.utils import aggregate, deferredDict
+
+
+class FakeError(Exception):
+    pass
+
+
+class AggregateTests(TestCase):
+    def test_empty(self):
+        """
+        Aggregating nothing fires immediately with an empty list.
+        """
+        self.assertEqual(self.successResultOf(aggregate([])), [])
+
+    def test_order(self):
+        """
+        Results are in the same order as the deferreds, whatever order they
+        fire in.
+        """
+        d1, d2 = defer.Deferred(), defer.Deferred()
+        d = aggregate([d1, d2])
+        d2.callback(2)
+        self.assertNoResult(d)
+        d1.callback(1)
+        self.assertEqual(self.successResultOf(d), [1, 2])
+
+    def test_alreadyFired(self):
+        """
+        Deferreds which already fired are counted.
+        """
+        d = aggregate([defer.succeed(1), defer.succeed(2)])
+        self.assertEqual(self.successResultOf(d), [1, 2])
+
+    def test_failuresInPlace(self):
+        """
+        Failures are consumed and recorded in place.
+        """
+        d = aggregate([defer.fail(FakeError()), defer.succeed(2)])
+        failure, value = self.successResultOf(d)
+        self.assertIsInstance(failure, Failure)
+        failure.trap(FakeError)
+        self.assertEqual(value, 2)
+
+
+class DeferredDictTests(TestCase):
+    def test_empty(self):
+        """
+        An empty dict fires immediately with an empty dict.
+        """
+        self.assertEqual(self.successResultOf(deferredDict({})), {})
+
+    def test_results(self):
+        """
+        Results are keyed like the deferreds, leaving out failures.
+        """
+        d = deferredDict({
+            'a': defer.succeed(1),
+            'b': defer.fail(FakeError()),
+            'c': defer.succeed(3),
+        })
+        self.assertEqual(self.successResultOf(d), {'a': 1, 'c': 3})
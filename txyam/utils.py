@@ -1,4 +1,41 @@
 from twisted.internet import defer
+from twisted.python.failure import Failure
+
+
+def aggregate(deferreds):
+    """
+    Wait for every C{Deferred} in a sequence to fire.
+
+    This is a cheaper replacement for C{defer.DeferredList}: the results are
+    written straight into a preallocated C{list} and a countdown fires the
+    returned C{Deferred} once the last one arrives, instead of building a
+    C{(success, value)} tuple for each result. Failures are consumed and
+    recorded in place.
+
+    @param deferreds: A sequence of C{Deferred} objects.
+
+    @return: A C{Deferred} which fires with a C{list} holding the result of
+    each deferred, or its C{Failure}, in the same order as C{deferreds}.
+    """
+    deferreds = list(deferreds)
+    remaining = [len(deferreds)]
+    if not remaining[0]:
+        return defer.succeed([])
+    results = [None] * remaining[0]
+    done = defer.Deferred()
+
+    def record(result, index):
+        results[index] = result
+        remaining[0] -= 1
+        if not remaining[0]:
+            done.callback(results)
+        if isinstance(result, Failure):
+            return None
+        return result
+
+    for index, d in enumerate(deferreds):
+        d.addBoth(record, index)
+    return done
 
 
 def deferredDict(d):
@@ -8,19 +45,19 @@ def deferredDict(d):
 
     @param d: A C{dict} whose values are all C{Deferred} objects.
 
-    @return: A C{DeferredList} whose callback will be given a dictionary whose
+    @return: A C{Deferred} whose callback will be given a dictionary whose
     keys are the same as the parameter C{d}'s and whose values are the results
-    of each individual deferred call.
+    of each individual deferred call. Keys whose deferred failed are left out.
     """
     if len(d) == 0:
         return defer.succeed({})
 
     def handle(results, names):
         rvalue = {}
-        for key, (succeeded, value) in zip(names, results):
-            if succeeded:
+        for key, value in zip(names, results):
+            if not isinstance(value, Failure):
                 rvalue[key] = value
         return rvalue
 
-    dl = defer.DeferredList(d.values(), consumeErrors=True)
-    return dl.addCallback(handle, d.keys())
+    names = list(d)
+    return aggregate([d[name] for name in names]).addCallback(handle, names)